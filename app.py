@@ -1,11 +1,34 @@
 import streamlit as st
 import pandas as pd
-import re
+import numpy as np
 import os
-import hashlib
-from datetime import datetime, date, timedelta
-from io import BytesIO
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
 import time
+import uuid
+
+from ingestao import (
+    processar_arquivo_extrato, processar_arquivo_benner, EXTENSOES_EXTRATO, EXTENSOES_BENNER,
+    em_reais, tipar_extrato, formatar_br, para_exibicao, classificar_benner, diferencas_benner,
+)
+from exportacao import FORMATOS, exportar_em_cache
+from persistencia import (
+    inicializar_db, versao_tabela, load_hist_extrato, FilaHistorico,
+    aplicar_historico, momento_conciliacao, load_db_benner, gravar_db_benner, limpar_db_benner,
+    hashes_benner,
+)
+from conciliacao import (
+    IndiceExtrato, conciliar_benner_com_extrato, atualizar_candidatos, melhores_candidatos,
+    marcar_candidatos, buscar_agrupados,
+)
+from medicao import ATIVO as MEDICAO_ATIVA, MedicaoRerun, RegistroReruns
+from arquivo_extrato import PARTICOES as PARTICOES_ARQUIVO, arquivar_extrato, abrir_extrato, catalogo as catalogo_arquivo
+
+# Cópias de DataFrame compartilhadas entre sessões precisam de copy-on-write (padrão a partir do pandas 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # Tenta importar rapidfuzz, se não tiver, usa fallback simples
 try:
@@ -115,6 +138,7 @@ def check_password():
             # --- DEFINA AQUI SEU USUÁRIO E SENHA ---
             if user == "admin" and pwd == "admin": 
                 st.session_state["password_correct"] = True
+                st.session_state["usuario"] = user
                 st.rerun()
             else:
                 st.error("Usuário ou senha incorretos.")
@@ -127,249 +151,554 @@ def check_password():
 if not check_password():
     st.stop()
 
+# --- MEDIÇÃO DOS RERUNS (FINANCEIRO_PERFIL=1) ---
+ADMINS = {"admin"}  # quem vê o painel de desempenho
+
+@st.cache_resource(show_spinner=False)
+def registro_reruns():
+    return RegistroReruns()
+
+def iniciar_medicao():
+    # Rerun anterior sem encerrar: saiu por st.rerun()/st.stop() (ou erro) antes do fim do roteiro
+    anterior = st.session_state.get("rerun_atual")
+    if anterior is not None: anterior.encerrar("interrompido")
+    rerun = MedicaoRerun(st.session_state.get("id_sessao", ""), perfilar=st.session_state.pop("perfilar_proximo", False))
+    st.session_state.rerun_atual = rerun
+    registro_reruns().adicionar(rerun)
+
+def marco(nome):
+    """Fecha a etapa `nome` do rerun atual (tempo desde o marco anterior). Sem medição, não faz nada."""
+    if MEDICAO_ATIVA: st.session_state.rerun_atual.marco(nome)
+
+def painel_desempenho():
+    with st.sidebar.expander("⏱️ Desempenho"):
+        reruns = registro_reruns().ultimos()[::-1]
+        resumo = pd.DataFrame([{
+            "Hora": r["inicio"][11:], "Sessão": r["sessao"][:6], "Página": r["pagina"], "Total (ms)": r["total_ms"],
+            "Situação": r["situacao"],
+            "Mais lenta": max(r["etapas"], key=lambda e: e["ms"])["etapa"] if r["etapas"] else None,
+        } for r in reruns])
+        st.dataframe(resumo, hide_index=True)
+        escolhido = st.selectbox("Etapas do rerun", range(len(reruns)), key="perfil_rerun",
+                                 format_func=lambda i: f"{reruns[i]['inicio'][11:]} · {reruns[i]['pagina']}")
+        if escolhido is not None and reruns[escolhido]["etapas"]:
+            st.dataframe(pd.DataFrame(reruns[escolhido]["etapas"]), hide_index=True)
+
+        if st.button("🔬 Perfilar o próximo rerun", key="perfilar_btn"): st.session_state.perfilar_proximo = True
+        if st.session_state.get("perfilar_proximo"): st.caption("O próximo rerun desta sessão será perfilado (cProfile).")
+        perfilado = next((r for r in reruns if r["perfil"]), None)
+        if perfilado is not None:
+            st.caption(f"cProfile do rerun das {perfilado['inicio'][11:]} ({perfilado['pagina']})")
+            st.code(perfilado["perfil"], language=None)
+        st.download_button("📥 Exportar JSON", registro_reruns().exportar_json, "reruns.json", "application/json",
+                           on_click="ignore", key="exportar_reruns")
+
+if MEDICAO_ATIVA: iniciar_medicao()
+
 # --- 2. FUNÇÕES UTILITÁRIAS ---
-def formatar_br(valor):
-    try: return f"R$ {float(valor):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except: return "R$ 0,00"
-
-def formatar_data(dt):
-    try: return pd.to_datetime(dt).strftime("%d/%m/%Y")
-    except: return ""
-
-def limpar_descricao(texto):
-    texto = str(texto).upper()
-    termos = ["PIX", "TED", "DOC", "TRANSF", "PGTO", "PAGAMENTO", "ENVIO", "CREDITO", "DEBITO", "EM CONTA"]
-    for t in termos: texto = texto.replace(t, "")
-    return re.sub(r'[^A-Z0-9\s]', ' ', texto).strip()
-
-def converter_valor(valor):
-    if pd.isna(valor) or valor == "": return 0.0
-    v = str(valor).strip().upper()
-    sinal = -1.0 if '-' in v else 1.0
-    v = v.replace('R$', '').replace(' ', '').replace('-', '')
-    # Se houver ponto e vírgula, trata formato brasileiro (1.000,00)
-    if ',' in v and '.' in v:
-        v = v.replace('.', '').replace(',', '.')
-    elif ',' in v:
-        v = v.replace(',', '.')
-    try: return float(v) * sinal
-    except: return 0.0
-
-def gerar_hash(row):
-    return hashlib.md5(f"{row['DATA']}{row['VALOR']}{row['DESCRIÇÃO']}{row['BANCO']}{row['OCORRENCIA']}".encode()).hexdigest()
-
-def formatar_visual_db(valor):
-    try: return f"{float(valor):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except: return ""
-
-@st.cache_data(show_spinner=False)
-def to_excel(df):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    return output.getvalue()
-
-# --- 3. PERSISTÊNCIA DE DADOS (CSV) ---
-DB_EXTRATO_HIST = "historico_conciliacoes_db.csv"
-DB_BENNER = "db_benner_master.csv"
-
-# --- EXTRATO ---
-def load_hist_extrato():
-    if os.path.exists(DB_EXTRATO_HIST):
-        try: return pd.read_csv(DB_EXTRATO_HIST, dtype=str)
-        except: pass
-    return pd.DataFrame(columns=["ID_HASH", "CONCILIADO", "DATA_CONCILIACAO"])
-
-def save_hist_extrato(df):
-    # Salva apenas os conciliados no histórico para persistência
-    conc = df[df["CONCILIADO"] == True][["ID_HASH", "CONCILIADO", "DATA_CONCILIACAO"]]
-    hist = load_hist_extrato()
-    new_ids = set(conc["ID_HASH"])
-    # Remove antigos se existirem para atualizar
-    hist = hist[~hist["ID_HASH"].isin(new_ids)]
-    pd.concat([hist, conc], ignore_index=True).to_csv(DB_EXTRATO_HIST, index=False)
-
-def process_extrato(file):
-    try:
-        # Lê Excel ou CSV
-        if file.name.endswith('.csv'):
-             df = pd.read_csv(file, sep=None, engine='python')
-        else:
-             df = pd.read_excel(file)
-             
-        df.columns = [str(c).upper().strip() for c in df.columns]
-        
-        # Mapa flexível de colunas
-        mapa = {'DATA LANÇAMENTO': 'DATA', 'LANCAMENTO': 'DATA', 'HISTÓRICO': 'DESCRIÇÃO', 'VALOR (R$)': 'VALOR', 'INSTITUICAO': 'BANCO', 'HISTORICO': 'DESCRIÇÃO'}
-        df = df.rename(columns=mapa)
-        
-        c_data = next((c for c in df.columns if 'DATA' in c), None)
-        c_val = next((c for c in df.columns if 'VALOR' in c), None)
-        
-        if not c_data or not c_val: return None
-        
-        df["DATA"] = pd.to_datetime(df[c_data], dayfirst=True, errors='coerce')
-        df["VALOR"] = df.apply(lambda r: converter_valor(r[c_val]), axis=1)
-        
-        c_desc = next((c for c in df.columns if 'DESC' in c or 'HIST' in c), 'DESCRIÇÃO')
-        df["DESCRIÇÃO"] = df[c_desc].astype(str).fillna("")
-        
-        c_banco = next((c for c in df.columns if 'BANCO' in c or 'INSTITU' in c), 'BANCO')
-        if c_banco not in df.columns: 
-            df["BANCO"] = "PADRÃO"
-        else:
-            df["BANCO"] = df[c_banco]
-        
-        df = df.sort_values(["DATA", "VALOR"])
-        df['OCORRENCIA'] = df.groupby(['DATA', 'VALOR', 'DESCRIÇÃO']).cumcount()
-        df['ID_HASH'] = df.apply(gerar_hash, axis=1)
-        df["MES_ANO"] = df["DATA"].dt.strftime('%m/%Y')
-        df["DESC_CLEAN"] = df["DESCRIÇÃO"].apply(limpar_descricao)
-        df["VALOR_VISUAL"] = df["VALOR"].apply(formatar_visual_db)
-        df["TIPO"] = df["VALOR"].apply(lambda x: "CRÉDITO" if x >= 0 else "DÉBITO")
-        
-        # Inicializa colunas
-        df["CONCILIADO"] = False
-        df["DATA_CONCILIACAO"] = None
-        
-        return df
-    except Exception as e:
-        st.error(f"Erro ao processar extrato: {e}")
-        return None
+def botao_exportar(container, rotulo, nome, token, gerar, key):
+    """Formato + download. O arquivo só é montado no clique (fora do rerun) e fica em cache pelo token
+    (versão dos dados + filtros): nada de hash do DataFrame inteiro a cada rerun."""
+    fmt = container.selectbox("Formato", list(FORMATOS), format_func=lambda f: FORMATOS[f][0], key=f"{key}_formato", label_visibility="collapsed")
+    container.download_button(f"{rotulo} ({fmt.upper()})", lambda: exportar_em_cache(token, fmt, gerar), f"{nome}.{fmt}",
+                              FORMATOS[fmt][1], key=key, on_click="ignore")
+
+# --- IMPORTAÇÃO DE VÁRIOS EXTRATOS ---
+@st.cache_resource(show_spinner=False)
+def pool_leitura():
+    # Compartilhado pelo servidor; leitura de Excel (openpyxl) é limitada por CPU, por isso processos e não threads
+    return ProcessPoolExecutor(max_workers=max(1, min(4, os.cpu_count() or 1)), mp_context=multiprocessing.get_context("spawn"))
+
+def chave_upload(f):
+    return f"{f.name}:{f.size}"
+
+def mesclar_extrato(novo):
+    """Acrescenta ao dados_mestre só as linhas cujo ID_HASH ainda não está no índice de hashes.
+    Retorna quantas linhas entraram (as repetidas entre arquivos com períodos sobrepostos são descartadas)."""
+    indice = st.session_state.hashes_extrato
+    novo = novo[~novo['ID_HASH'].isin(indice)].drop_duplicates('ID_HASH')
+    if novo.empty: return 0
+    base = st.session_state.dados_mestre
+    if base is None:
+        st.session_state.dados_mestre = tipar_extrato(novo)
+    else:
+        st.session_state.dados_mestre = tipar_extrato(pd.concat([base, novo], ignore_index=True).sort_values(["DATA", "VALOR"], kind="stable"))
+    indice.update(novo['ID_HASH'])
+    st.session_state.versao_extrato += 1
+    return len(novo)
+
+def carregar_extratos(arquivos):
+    """Lê os arquivos em paralelo (um processo por arquivo) e mescla cada um assim que termina."""
+    if len(arquivos) == 1:
+        tarefas = [(arquivos[0], lambda f=arquivos[0]: processar_arquivo_extrato(f.name, f.getvalue()))]
+    else:
+        pool = pool_leitura()
+        futuros = {pool.submit(processar_arquivo_extrato, f.name, f.getvalue()): f for f in arquivos}
+        tarefas = ((futuros[fut], fut.result) for fut in as_completed(futuros))
+
+    linhas = 0
+    for f, resultado in tarefas:
+        st.session_state.extratos_lidos.add(chave_upload(f))
+        try:
+            df = resultado()
+        except Exception as e:
+            st.error(f"Erro ao processar extrato {f.name}: {e}")
+            continue
+        if df is None:
+            st.error(f"{f.name}: colunas de data e valor não encontradas.")
+            continue
+        linhas += mesclar_extrato(df)
+        try: arquivar_extrato(df)  # só as linhas que o arquivo ainda não tem
+        except Exception as e: st.warning(f"{f.name}: linhas não gravadas no arquivo de extratos: {e}")
+    return linhas
 
 def sync_extrato_com_historico():
-    if st.session_state.dados_mestre is not None:
-        hist = load_hist_extrato()
-        if not hist.empty:
-            hist_dict = hist.set_index('ID_HASH')[['CONCILIADO', 'DATA_CONCILIACAO']].to_dict('index')
-            
-            def atualizar_row(row):
-                if row['ID_HASH'] in hist_dict:
-                    return True, hist_dict[row['ID_HASH']]['DATA_CONCILIACAO']
-                return row['CONCILIADO'], row['DATA_CONCILIACAO']
-            
-            # Aplica a atualização
-            st.session_state.dados_mestre[['CONCILIADO', 'DATA_CONCILIACAO']] = st.session_state.dados_mestre.apply(
-                lambda row: pd.Series(atualizar_row(row)), axis=1
-            )
+    # Só refaz o cruzamento se o extrato da sessão ou o histórico gravado mudaram desde a última vez
+    if st.session_state.dados_mestre is None: return
+    carimbo = (st.session_state.versao_extrato, versao_tabela("hist_extrato"))
+    anterior = st.session_state.get("carimbo_sync")
+    if anterior == carimbo: return
+    fila = fila_historico()
+    # Lotes gravados só com alterações desta sessão: já estão no dados_mestre, avança sem refazer
+    if anterior and anterior[0] == carimbo[0] and fila.so_de(st.session_state.id_sessao, anterior[1], carimbo[1]):
+        st.session_state.carimbo_sync = carimbo
+        return
+    removidos = fila.remocoes_pendentes()  # antes de ler o histórico: desmarcadas ainda na fila não voltam
+    hist = obter_hist_extrato()
+    if removidos: hist = hist[~hist['ID_HASH'].isin(removidos)]
+    registrar_conciliacao(aplicar_historico(st.session_state.dados_mestre, hist))
+    st.session_state.carimbo_sync = carimbo
+
+def posicoes_extrato(ids):
+    """Posições (iloc) no dados_mestre dos ID_HASH informados, via índice refeito só quando o extrato muda."""
+    cache = st.session_state.get("indice_posicoes")
+    if cache is None or cache[0] != st.session_state.versao_extrato:
+        cache = (st.session_state.versao_extrato, pd.Index(st.session_state.dados_mestre['ID_HASH']))
+        st.session_state.indice_posicoes = cache
+    pos = cache[1].get_indexer_for(list(ids))
+    return pos[pos >= 0]
+
+def salvar_edicoes_extrato(ids_tela, edicoes):
+    """Aplica ao dados_mestre e ao histórico só as linhas alteradas no editor (edited_rows: posição -> campos).
+    Retorna True se algo mudou."""
+    dm = st.session_state.dados_mestre
+    marcar, desmarcar = [], []
+    for pos, campos in edicoes.items():
+        if "CONCILIADO" in campos:
+            (marcar if campos["CONCILIADO"] else desmarcar).append(ids_tela.iloc[int(pos)])
+    col_conc, col_data = dm.columns.get_loc("CONCILIADO"), dm.columns.get_loc("DATA_CONCILIACAO")
+    # Descarta o que já está no estado pedido (o editor reenvia as edições até os dados da tela mudarem)
+    pos_m = posicoes_extrato(marcar)
+    pos_m = pos_m[~dm.iloc[pos_m, col_conc].to_numpy(dtype=bool)]
+    pos_d = posicoes_extrato(desmarcar)
+    pos_d = pos_d[dm.iloc[pos_d, col_conc].to_numpy(dtype=bool)]
+    if not len(pos_m) and not len(pos_d): return False
+
+    if len(pos_m):
+        dm.iloc[pos_m, col_conc] = True
+        dm.iloc[pos_m, col_data] = momento_conciliacao()
+        fila_historico().marcar(dm.iloc[pos_m], st.session_state.id_sessao)
+    if len(pos_d):
+        dm.iloc[pos_d, col_conc] = False
+        dm.iloc[pos_d, col_data] = None
+        fila_historico().remover(dm['ID_HASH'].iloc[pos_d], st.session_state.id_sessao)
+    registrar_conciliacao(np.concatenate([pos_m, pos_d]))
+    return True
+
+# --- ARQUIVO DE EXTRATOS (PARQUET POR MÊS/BANCO) ---
+def _chave_mes(mes):
+    m, _, a = str(mes).partition("/")
+    return a, m
+
+def opcoes_arquivo(col, painel, catalogo):
+    # Filtros da Busca: o que está na sessão + o que está no arquivo (mesma ordenação do painel)
+    i = PARTICOES_ARQUIVO.index(col)
+    valores = set(painel.opcoes[col]) | {p[i] for p in catalogo if p[i] is not None}
+    return sorted(valores, reverse=(col == "MES_ANO"))
+
+def abrir_fatia_arquivada(catalogo):
+    """Traz do arquivo para o dados_mestre o mês/banco escolhido nos filtros da Busca (só essas partições e só as
+    colunas do extrato são lidas). Sem extrato na sessão, abre o mês mais recente; "Todos"/"Todos" não lê nada."""
+    if not catalogo: return
+    abertas = st.session_state.fatias_arquivo
+    mes, banco = st.session_state.filtro_mes, st.session_state.filtro_banco
+    if st.session_state.dados_mestre is None and mes == "Todos" and banco == "Todos":
+        mes = max((p[0] for p in catalogo if p[0] is not None), key=_chave_mes, default="Todos")
+        st.session_state.filtro_mes = mes
+    if mes == "Todos" and banco == "Todos": return
+    if abertas & {(mes, banco), (mes, "Todos"), ("Todos", banco)}: return
+    df = abrir_extrato(None if mes == "Todos" else [mes], None if banco == "Todos" else [banco])
+    abertas.add((mes, banco))
+    if df is not None and mesclar_extrato(df): sync_extrato_com_historico()
+
+# --- CONCILIAÇÃO NA IMPORTAÇÃO DO BENNER ---
+def indice_extrato():
+    # Índice do extrato inteiro, refeito só quando o extrato da sessão muda; os pendentes são filtrados na hora
+    cache = st.session_state.get("indice_extrato")
+    if cache is None or cache[0] != st.session_state.versao_extrato:
+        cache = (st.session_state.versao_extrato, IndiceExtrato(st.session_state.dados_mestre))
+        st.session_state.indice_extrato = cache
+    return cache[1]
 
-# --- FUNÇÃO: CONCILIAÇÃO REVERSA INTELIGENTE (BENNER -> EXTRATO) ---
 def auto_conciliar_extrato_pelo_benner(df_benner_atual):
     if st.session_state.dados_mestre is None: return 0
     
-    baixados = df_benner_atual[df_benner_atual['Data Baixa'].notna()].copy()
-    extrato_pendente = st.session_state.dados_mestre[st.session_state.dados_mestre['CONCILIADO'] == False].copy()
-    
-    if extrato_pendente.empty or baixados.empty: return 0
+    baixados = df_benner_atual[df_benner_atual['Data Baixa'].notna()]
+    pendente = ~st.session_state.dados_mestre['CONCILIADO'].to_numpy(dtype=bool)
     
-    count_matches = 0
-    ids_para_conciliar = []
+    if not pendente.any() or baixados.empty: return 0
     
-    # Prepara dados
-    extrato_pendente['DESC_CLEAN'] = extrato_pendente['DESCRIÇÃO'].apply(limpar_descricao)
-    lista_ext = extrato_pendente.to_dict('records')
-    
-    col_valor = 'Valor Total' if 'Valor Total' in baixados.columns else 'Valor Baixa'
-    baixados['VALOR_NUM'] = baixados[col_valor].apply(converter_valor)
-    baixados['DESC_REF_CLEAN'] = baixados['Nome'].astype(str).apply(limpar_descricao)
-    
-    for _, doc in baixados.iterrows():
-        val_doc = doc['VALOR_NUM']
-        if val_doc <= 0: continue
-        
-        data_doc = pd.to_datetime(doc['Data Baixa'])
-        candidato_match = None
-        
-        # TENTATIVA 1: VALOR EXATO + DATA (5 DIAS)
-        for ext in lista_ext:
-            if ext['ID_HASH'] in ids_para_conciliar: continue
-            if abs(abs(ext['VALOR']) - val_doc) <= 0.05:
-                delta_dias = abs((ext['DATA'] - data_doc).days)
-                if delta_dias <= 5:
-                    candidato_match = ext['ID_HASH']
-                    break 
-        
-        # TENTATIVA 2: NOME SIMILAR + DATA (3 DIAS)
-        if not candidato_match and fuzz:
-             for ext in lista_ext:
-                if ext['ID_HASH'] in ids_para_conciliar: continue
-                delta_dias = abs((ext['DATA'] - data_doc).days)
-                if delta_dias <= 3:
-                    score = fuzz.token_set_ratio(doc['DESC_REF_CLEAN'], ext['DESC_CLEAN'])
-                    if score > 85:
-                        candidato_match = ext['ID_HASH']
-                        break
-
-        if candidato_match:
-            ids_para_conciliar.append(candidato_match)
-            count_matches += 1
+    ids_para_conciliar = conciliar_benner_com_extrato(st.session_state.dados_mestre, baixados, pendente, indice_extrato())
 
     if ids_para_conciliar:
         mask = st.session_state.dados_mestre['ID_HASH'].isin(ids_para_conciliar)
         st.session_state.dados_mestre.loc[mask, 'CONCILIADO'] = True
-        st.session_state.dados_mestre.loc[mask, 'DATA_CONCILIACAO'] = datetime.now().strftime("%d/%m/%Y %H:%M")
-        save_hist_extrato(st.session_state.dados_mestre)
+        st.session_state.dados_mestre.loc[mask, 'DATA_CONCILIACAO'] = momento_conciliacao()
+        fila_historico().marcar(st.session_state.dados_mestre[mask], st.session_state.id_sessao)
+        registrar_conciliacao(np.flatnonzero(mask.to_numpy()))
+        fila_historico().esperar()  # a quantidade só é informada com o histórico gravado
         
-    return count_matches
+    return len(ids_para_conciliar)
 
-# --- BENNER (CSV) ---
-def load_db_benner():
-    cols = ['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total', 'STATUS_CONCILIACAO', 'ID_BENNER']
-    if os.path.exists(DB_BENNER):
+# --- PESQUISA EM SEGUNDO PLANO ---
+class TarefaConciliacao:
+    """Pesquisa de conciliação rodando numa thread do servidor, fora do rerun.
+    `chave` = versões dos dados de entrada + filtros: enquanto não muda, o resultado é reaproveitado
+    (confirmação, exportação, troca de página)."""
+    def __init__(self, chave):
+        self.chave = chave
+        self.progresso = 0.0  # lido pela tela a cada atualização, não enviado a cada faixa
+        self.cancelada = threading.Event()
+        self.matches = None
+        self.erro = None
+        self.futuro = None
+
+    def executar(self, ex_pendente, df_ex_robo, df_bn_robo, registradas):
         try:
-            df = pd.read_csv(DB_BENNER, dtype={'Número': str, 'ID_BENNER': str})
-            for c in cols: 
-                if c not in df.columns: df[c] = None
-            return df
-        except: pass
-    return pd.DataFrame(columns=cols)
-
-def save_db_benner(df):
-    df.to_csv(DB_BENNER, index=False)
+            if atualizar_candidatos(ex_pendente, df_bn_robo, registradas, progresso=self._progresso, cancelar=self.cancelada):
+                matches = melhores_candidatos(df_ex_robo, df_bn_robo)
+                # Grupos só com o que o 1:1 não usou
+                livres_ex = df_ex_robo[~df_ex_robo['ID_HASH'].isin([m['ID_HASH'] for m in matches])]
+                livres_bn = df_bn_robo[~df_bn_robo['ID_BENNER'].isin([m['ID_BENNER'] for m in matches])]
+                agrupados = buscar_agrupados(livres_ex, livres_bn, self.cancelada)
+                if agrupados is not None: self.matches = matches + agrupados
+        except Exception as e:
+            self.erro = e
+
+    def _progresso(self, fracao):
+        self.progresso = fracao
+
+    @property
+    def rodando(self):
+        return not self.futuro.done()
+
+@st.cache_resource(show_spinner=False)
+def executor_tarefas():
+    # Threads: os DataFrames não precisam ser copiados para outro processo e o cdist do rapidfuzz libera o GIL
+    return ThreadPoolExecutor(max_workers=2)
+
+def iniciar_conciliacao(chave, ex_pendente, df_ex_robo, df_bn_robo):
+    anterior = st.session_state.get("tarefa_conciliacao")
+    if anterior is not None: anterior.cancelada.set()
+    inicializar_db()  # a thread só abre conexões
+    registradas = st.session_state.setdefault("linhas_candidatas", set())
+    tarefa = TarefaConciliacao(chave)
+    tarefa.futuro = executor_tarefas().submit(tarefa.executar, ex_pendente, df_ex_robo, df_bn_robo, registradas)
+    st.session_state.tarefa_conciliacao = tarefa
+
+def tarefa_conciliacao(chave):
+    """Tarefa da sessão para estes dados e filtros. Se as entradas mudaram, a anterior é cancelada e descartada."""
+    tarefa = st.session_state.get("tarefa_conciliacao")
+    if tarefa is None or tarefa.chave == chave: return tarefa
+    tarefa.cancelada.set()
+    st.session_state.tarefa_conciliacao = None
+    return None
+
+@st.fragment(run_every=0.5)
+def acompanhar_conciliacao(tarefa):
+    # Só este trecho é refeito enquanto a pesquisa roda; ao terminar, a página inteira é atualizada
+    if not tarefa.rodando: st.rerun()
+    st.progress(tarefa.progresso, text=f"Pesquisando... {tarefa.progresso:.0%}")
+    if st.button("⛔ CANCELAR PESQUISA", type="secondary"): tarefa.cancelada.set()
+
+# --- BENNER (SQLITE) ---
+def save_db_benner(df, alterados=None):
+    df, versao = gravar_db_benner(df, alterados)
+    # A sessão que gravou já tem o resultado: publica direto no cache, sem reler o banco
+    cache_dados().publicar("benner", versao, df)
     st.session_state.db_benner = df
 
-def prepare_benner_upload(df_raw):
-    # Padroniza nomes de colunas para busca
-    df_raw.columns = [str(c).strip() for c in df_raw.columns]
-    
-    mapa = {
-        'Número': 'Número', 'Numero': 'Número',
-        'Nome': 'Nome', 'Favorecido': 'Nome',
-        'CNPJ/CPF': 'CNPJ/CPF',
-        'Tipo do Documento': 'Tipo do Documento', 'TIPO DO DOCUMENTO': 'Tipo do Documento',
-        'Data de Vencimento': 'Data de Vencimento', 'Vencimento': 'Data de Vencimento',
-        'Data Baixa': 'Data Baixa', 'Baixa': 'Data Baixa',
-        'Valor Total': 'Valor Total', 'Valor Liquido': 'Valor Total', 'Valor': 'Valor Total', 'VALOR TOTAL': 'Valor Total'
-    }
-    
-    df = df_raw.rename(columns={k:v for k,v in mapa.items() if k in df_raw.columns})
-    
-    if 'Tipo do Documento' in df.columns:
-        df['Tipo do Documento'] = df['Tipo do Documento'].apply(lambda x: 'BASA' if 'AMAZONAS' in str(x).upper() else ('BB' if 'BRASIL' in str(x).upper() else x))
+# --- CACHE COMPARTILHADO (UMA CÓPIA POR SERVIDOR) ---
+class CacheDados:
+    """Base Benner e histórico carregados uma vez por processo e compartilhados por todas as sessões.
+    Recarrega só quando a versão gravada no banco muda; cada sessão recebe uma visão copy-on-write."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tabelas = {}  # tabela -> (versao, df)
+        self.derivados = {}  # (tabela, nome) -> (versao, objeto)
 
-    for c in ['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total']:
-        if c not in df.columns: df[c] = None
-    
-    df = df[['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total']]
-    
-    # ID Benner é o Número
-    df['ID_BENNER'] = df['Número'].astype(str).str.strip()
-    df = df.drop_duplicates(subset=['ID_BENNER'], keep='last')
-    
-    df['Data Baixa'] = pd.to_datetime(df['Data Baixa'], errors='coerce')
-    df['STATUS_CONCILIACAO'] = df['Data Baixa'].apply(lambda x: 'Conciliado' if pd.notnull(x) else 'Pendente')
-    
-    # Converte valor
-    df['Valor Total'] = df['Valor Total'].apply(converter_valor)
-    
-    return df
+    def obter(self, tabela, carregar):
+        versao = versao_tabela(tabela)
+        with self.lock:
+            atual = self.tabelas.get(tabela)
+            if atual is None or atual[0] != versao:
+                atual = (versao, carregar())
+                self.tabelas[tabela] = atual
+        return atual[1].copy(deep=False)
+
+    def publicar(self, tabela, versao, df):
+        with self.lock:
+            atual = self.tabelas.get(tabela)
+            if atual is None or atual[0] < versao:
+                self.tabelas[tabela] = (versao, df.copy(deep=False))
+
+    def versao(self, tabela):
+        # Versão do que está em memória (token barato para caches derivados, ex.: exportações)
+        with self.lock:
+            return self.tabelas[tabela][0]
+
+    def derivado(self, tabela, nome, construir):
+        """Objeto calculado a partir da tabela (ex.: agregados), refeito só quando a versão dela muda."""
+        with self.lock:
+            versao, df = self.tabelas[tabela]
+            atual = self.derivados.get((tabela, nome))
+            if atual is None or atual[0] != versao:
+                atual = (versao, construir(df))
+                self.derivados[(tabela, nome)] = atual
+        return atual[1]
+
+@st.cache_resource(show_spinner=False)
+def cache_dados():
+    return CacheDados()
+
+def obter_db_benner():
+    return cache_dados().obter("benner", load_db_benner)
+
+def obter_hist_extrato():
+    return cache_dados().obter("hist_extrato", load_hist_extrato)
+
+@st.cache_resource(show_spinner=False)
+def fila_historico():
+    # Uma fila por servidor: alterações de todas as sessões gravadas em lote por uma thread
+    return FilaHistorico()
+
+# --- PESQUISA RÁPIDA (ÍNDICE) ---
+TOL_VALOR_PESQUISA = 0.1
+SCORE_MIN_APROXIMADA = 80
+
+class IndiceBusca:
+    """Índice da Pesquisa Rápida, montado uma vez por extrato carregado.
+    Texto: trigramas -> descrições distintas (em maiúsculas). Valor: valores absolutos ordenados (busca por faixa)."""
+    def __init__(self, df):
+        self.rotulos = df.index.to_numpy()
+        self.codigos, unicos = pd.factorize(df['DESCRIÇÃO'].astype(str).str.upper())
+        self.serie_textos = pd.Series(unicos, dtype=object)
+        self.textos = list(unicos)
+        self.tamanhos = self.serie_textos.str.len().to_numpy()
+        trigramas = {}
+        for i, t in enumerate(self.textos):
+            for g in {t[k:k + 3] for k in range(len(t) - 2)}:
+                trigramas.setdefault(g, []).append(i)
+        self.trigramas = {g: np.array(v, dtype=np.int64) for g, v in trigramas.items()}
+
+        valores = em_reais(df['VALOR'].abs()).to_numpy(dtype=float)
+        self.ordem_valor = np.argsort(valores, kind='stable')
+        self.valores_ord = valores[self.ordem_valor]
+
+    def _candidatos(self, termo):
+        # Termos curtos não têm trigrama: varre as descrições distintas de uma vez
+        if len(termo) < 3: return np.flatnonzero(self.serie_textos.str.contains(termo, regex=False).to_numpy(dtype=bool))
+        listas = [self.trigramas.get(termo[k:k + 3]) for k in range(len(termo) - 2)]
+        if any(l is None for l in listas): return []
+        cand = listas[0]
+        for l in sorted(listas[1:], key=len): cand = np.intersect1d(cand, l, assume_unique=True)
+        return cand
+
+    def buscar_texto(self, termo, aproximada=False):
+        """Rótulos das linhas cuja descrição contém o termo, mais relevantes primeiro
+        (termo mais no início, descrição mais curta). Com `aproximada`, inclui parecidas pelo rapidfuzz."""
+        termo = termo.upper()
+        ids = np.asarray(self._candidatos(termo), dtype=np.int64)
+        pos = self.serie_textos.iloc[ids].str.find(termo).to_numpy(dtype=np.int64)
+        ids, pos = ids[pos >= 0], pos[pos >= 0]
+        score = np.full(len(ids), 100.0)
+        if aproximada and fuzz:
+            ja = set(ids.tolist())
+            extra = [(i, sc) for _, sc, i in process.extract(termo, self.textos, scorer=fuzz.partial_ratio,
+                                                             score_cutoff=SCORE_MIN_APROXIMADA, limit=None) if i not in ja]
+            if extra:
+                ids_x = np.array([i for i, _ in extra], dtype=np.int64)
+                ids = np.concatenate([ids, ids_x])
+                pos = np.concatenate([pos, self.tamanhos[ids_x]])
+                score = np.concatenate([score, [sc for _, sc in extra]])
+        if not len(ids): return self.rotulos[:0]
+        ordem = np.full(len(self.textos), -1)
+        ordem[ids[np.lexsort((self.tamanhos[ids], pos, -score))]] = np.arange(len(ids))
+        rank = ordem[self.codigos]
+        linhas = np.flatnonzero(rank >= 0)
+        linhas = linhas[np.argsort(rank[linhas], kind='stable')]
+        return self.rotulos[linhas]
+
+    def buscar_valor(self, val, tol=TOL_VALOR_PESQUISA):
+        """Rótulos das linhas com |VALOR| a até `tol` do valor pedido, do mais próximo ao mais distante."""
+        i = np.searchsorted(self.valores_ord, val - tol - 1e-6, side='left')
+        j = np.searchsorted(self.valores_ord, val + tol + 1e-6, side='right')
+        dif = np.abs(self.valores_ord[i:j] - val)
+        ok = dif <= tol
+        linhas, dif = self.ordem_valor[i:j][ok], dif[ok]
+        return self.rotulos[linhas[np.argsort(dif, kind='stable')]]
+
+def indice_busca():
+    # Refeito só quando o extrato da sessão muda (novo upload)
+    cache = st.session_state.get("indice_busca")
+    if cache is None or cache[0] != st.session_state.versao_extrato:
+        cache = (st.session_state.versao_extrato, IndiceBusca(st.session_state.dados_mestre))
+        st.session_state.indice_busca = cache
+    return cache[1]
+
+def filtrar_por_rotulos(df, rotulos):
+    # Mantém a ordem do ranking, restrita às linhas que passaram pelos demais filtros
+    rotulos = pd.Index(rotulos)
+    return df.loc[rotulos[rotulos.isin(df.index)]]
+
+# --- PAINÉIS (AGREGADOS PRÉ-CALCULADOS) ---
+def _bitmaps(serie):
+    # Categoria -> máscara booleana das linhas (combinações de filtros viram um & entre máscaras)
+    codigos = serie.cat.codes.to_numpy()
+    return {serie.cat.categories[k]: codigos == k for k in np.unique(codigos[codigos >= 0])}
+
+class PainelExtrato:
+    """Agregados da Busca Extrato, montados uma vez por extrato carregado: máscaras por mês/banco/tipo,
+    listas dos filtros e totais por combinação. Conciliações entram de forma incremental (atualizar)."""
+    FILTROS = ["MES_ANO", "BANCO", "TIPO"]
+
+    def __init__(self, df):
+        self.n = len(df)
+        self.bitmaps = {c: _bitmaps(df[c]) for c in self.FILTROS}
+        self.opcoes = {"MES_ANO": sorted(self.bitmaps["MES_ANO"], reverse=True), "BANCO": sorted(self.bitmaps["BANCO"])}
+        self.valor = df["VALOR"].to_numpy()
+        chaves = df[self.FILTROS].assign(ITENS=1, CREDITO=np.where(self.valor > 0, self.valor, 0),
+                                         DEBITO=np.where(self.valor < 0, self.valor, 0))
+        self.totais_grupo = chaves.groupby(self.FILTROS, observed=True, dropna=False).sum().reset_index()
+        self.conciliado = df["CONCILIADO"].to_numpy(dtype=bool).copy()
+        self._recalcular_hoje(df)
+
+    def _recalcular_hoje(self, df):
+        self.dia = date.today()
+        self.hoje = (df["DATA_CONCILIACAO"] >= pd.Timestamp(self.dia)).to_numpy().copy()
+        self.qtd_hoje = int(self.hoje.sum())
+        self.valor_hoje = int(self.valor[self.hoje].sum())
+
+    def atualizar(self, df, pos):
+        """Reflete a conciliação/desconciliação das posições informadas (só elas são relidas)."""
+        pos = np.unique(np.asarray(pos, dtype=np.int64))
+        if not len(pos): return
+        self.conciliado[pos] = df["CONCILIADO"].iloc[pos].to_numpy(dtype=bool)
+        novo = (df["DATA_CONCILIACAO"].iloc[pos] >= pd.Timestamp(self.dia)).to_numpy()
+        delta = novo.astype(np.int64) - self.hoje[pos]
+        self.qtd_hoje += int(delta.sum())
+        self.valor_hoje += int((delta * self.valor[pos]).sum())
+        self.hoje[pos] = novo
+
+    def conciliados_hoje(self, df):
+        if self.dia != date.today(): self._recalcular_hoje(df)  # virou o dia
+        return self.qtd_hoje, self.valor_hoje / 100
+
+    def posicoes(self, filtros, pendentes=False):
+        """Posições das linhas que atendem aos filtros {coluna: valor}; None = todas."""
+        mask = ~self.conciliado if pendentes else None
+        for c, v in filtros.items():
+            b = self.bitmaps[c].get(v)
+            if b is None: return np.array([], dtype=np.int64)
+            mask = b if mask is None else mask & b
+        return None if mask is None else np.flatnonzero(mask)
+
+    def totais(self, filtros):
+        """(itens, créditos, débitos) da combinação de filtros, somados a partir dos totais por grupo."""
+        t = self.totais_grupo
+        for c, v in filtros.items(): t = t[t[c] == v]
+        return int(t["ITENS"].sum()), t["CREDITO"].sum() / 100, t["DEBITO"].sum() / 100
+
+def painel_extrato():
+    # Refeito só quando o extrato da sessão muda (novo upload)
+    cache = st.session_state.get("painel_extrato")
+    if cache is None or cache[0] != st.session_state.versao_extrato:
+        cache = (st.session_state.versao_extrato, PainelExtrato(st.session_state.dados_mestre))
+        st.session_state.painel_extrato = cache
+    return cache[1]
+
+def registrar_conciliacao(posicoes):
+    # Chamado por quem altera CONCILIADO/DATA_CONCILIACAO no dados_mestre
+    if not len(posicoes): return
+    st.session_state.versao_conciliacao = st.session_state.get("versao_conciliacao", 0) + 1
+    cache = st.session_state.get("painel_extrato")
+    if cache is not None and cache[0] == st.session_state.versao_extrato:
+        cache[1].atualizar(st.session_state.dados_mestre, posicoes)
+
+def filtrar_posicoes(df, pos):
+    return df if pos is None else df.iloc[pos]
+
+class PainelBenner:
+    """Agregados da Gestão Benner, montados uma vez por versão da base e compartilhados entre as sessões:
+    máscaras por status e tipo, vencimentos ordenados (faixa de datas por busca binária) e totais por dia."""
+    def __init__(self, df):
+        self.n = len(df)
+        self.status = _bitmaps(df['STATUS_CONCILIACAO'])
+        self.tipos = _bitmaps(df['Tipo do Documento'])
+        self.opcoes_tipo = sorted(str(x) for x in self.tipos)
+        venc = df['Data de Vencimento'].to_numpy()
+        validas = np.flatnonzero(~np.isnat(venc))
+        self.ordem_venc = validas[np.argsort(venc[validas], kind='stable')]
+        self.venc_ord = venc[self.ordem_venc]
+        self.d_min = pd.Timestamp(self.venc_ord[0]).date() if len(validas) else date.today()
+        self.d_max = pd.Timestamp(self.venc_ord[-1]).date() if len(validas) else date.today()
+        dias = df['Data de Vencimento'].dt.normalize()
+        self.totais_dia = (df[['STATUS_CONCILIACAO', 'Tipo do Documento']].assign(DIA=dias, ITENS=1, VALOR=df['Valor Total'])
+                           .groupby(['STATUS_CONCILIACAO', 'Tipo do Documento', 'DIA'], observed=True, dropna=False).sum().reset_index())
+
+    def posicoes(self, status=None, tipo=None, ini=None, fim=None):
+        """Posições (na ordem da base) por status/tipo e, com ini/fim, vencimento dentro da faixa."""
+        mask = None
+        if ini is not None:
+            i = np.searchsorted(self.venc_ord, np.datetime64(pd.Timestamp(ini)), side='left')
+            j = np.searchsorted(self.venc_ord, np.datetime64(pd.Timestamp(fim + timedelta(days=1))), side='left')
+            mask = np.zeros(self.n, dtype=bool)
+            mask[self.ordem_venc[i:j]] = True
+        for bitmaps, v in [(self.status, status), (self.tipos, tipo)]:
+            if v is None: continue
+            b = bitmaps.get(v)
+            if b is None: return np.array([], dtype=np.int64)
+            mask = b if mask is None else mask & b
+        return np.arange(self.n) if mask is None else np.flatnonzero(mask)
+
+    def totais(self, status, tipo, ini, fim):
+        """(documentos, valor em reais) da seleção, somados a partir dos totais por dia."""
+        t = self.totais_dia
+        t = t[(t['DIA'] >= pd.Timestamp(ini)) & (t['DIA'] <= pd.Timestamp(fim))]
+        if status is not None: t = t[t['STATUS_CONCILIACAO'] == status]
+        if tipo is not None: t = t[t['Tipo do Documento'] == tipo]
+        return int(t['ITENS'].sum()), t['VALOR'].sum() / 100
+
+def painel_benner(df):
+    painel = cache_dados().derivado("benner", "painel", PainelBenner)
+    # Base da sessão recém-alterada e ainda não publicada: monta na hora
+    return painel if painel.n == len(df) else PainelBenner(df)
 
 # --- INICIALIZAÇÃO DE ESTADO ---
-if "db_benner" not in st.session_state: st.session_state.db_benner = load_db_benner()
+marco("definicoes")
+for aviso in inicializar_db(): st.warning(aviso)  # só na primeira execução do processo (migração dos CSVs)
+# Visão da base Benner compartilhada: só relê o banco quando alguém gravou
+st.session_state.db_benner = obter_db_benner()
 if "dados_mestre" not in st.session_state: st.session_state.dados_mestre = None
+if "hashes_extrato" not in st.session_state: st.session_state.hashes_extrato = set()
+if "versao_extrato" not in st.session_state: st.session_state.versao_extrato = 0
+if "versao_conciliacao" not in st.session_state: st.session_state.versao_conciliacao = 0
+if "id_sessao" not in st.session_state: st.session_state.id_sessao = uuid.uuid4().hex  # separa exportações de sessões diferentes
+if "extratos_lidos" not in st.session_state: st.session_state.extratos_lidos = set()
 if "conflitos" not in st.session_state: st.session_state.conflitos = None
 if "novos" not in st.session_state: st.session_state.novos = None
 if "last_benner" not in st.session_state: st.session_state.last_benner = ""
+if "fatias_arquivo" not in st.session_state: st.session_state.fatias_arquivo = set()  # (mês, banco) já trazidos do arquivo
 
 # States da Busca Extrato
 if "filtro_mes" not in st.session_state: st.session_state.filtro_mes = "Todos"
@@ -383,60 +712,60 @@ def limpar_filtros_extrato():
     st.session_state.filtro_tipo = "Todos"
     st.session_state.filtro_texto = ""
 
+marco("estado_inicial")
+
 # Sincroniza logo ao carregar
 sync_extrato_com_historico()
+if fila_historico().erro is not None:
+    st.warning(f"Histórico ainda não gravado, nova tentativa em instantes: {fila_historico().erro}")
+marco("sync_historico")
 
 # --- SIDEBAR COM MENU ---
 st.sidebar.title("Navegação")
-st.sidebar.caption(f"Logado como: admin")
+st.sidebar.caption(f"Logado como: {st.session_state.get('usuario', 'admin')}")
 if st.sidebar.button("Sair / Logout", key="logout_btn"):
     st.session_state["password_correct"] = False
     st.rerun()
 
 pagina = st.sidebar.radio("Ir para:", ["📁 Gestão Benner", "🔎 Busca Extrato", "🤝 Conciliação Automática"])
+if MEDICAO_ATIVA: st.session_state.rerun_atual.pagina, st.session_state.rerun_atual.sessao = pagina, st.session_state.id_sessao
 st.sidebar.markdown("---")
 st.sidebar.title("Importar Arquivos")
 
-f_ext = st.sidebar.file_uploader("1. Extrato (Excel/CSV)", type=["xlsx", "xlsm", "csv"])
-f_ben = st.sidebar.file_uploader("2. Documentos Benner (CSV/Excel)", type=["csv", "xlsx"])
+f_exts = st.sidebar.file_uploader("1. Extratos (Excel/CSV)", type=EXTENSOES_EXTRATO, accept_multiple_files=True)
+f_ben = st.sidebar.file_uploader("2. Documentos Benner (CSV/Excel)", type=EXTENSOES_BENNER)
 
-# Processamento do Upload Extrato
-if f_ext and st.session_state.dados_mestre is None:
-    st.session_state.dados_mestre = process_extrato(f_ext)
+# Processamento do Upload Extrato (só arquivos ainda não lidos nesta sessão)
+novos_ext = [f for f in f_exts or [] if chave_upload(f) not in st.session_state.extratos_lidos]
+if novos_ext:
+    with st.spinner(f"Lendo {len(novos_ext)} extrato(s)..."):
+        qtd_linhas = carregar_extratos(novos_ext)
     sync_extrato_com_historico()
-    st.toast("Extrato Carregado!", icon="✅")
+    st.toast(f"Extrato Carregado! {qtd_linhas} linhas novas.", icon="✅")
 
 # Processamento do Upload Benner
 if f_ben:
     if st.session_state.last_benner != f_ben.name:
         try:
-            if f_ben.name.endswith('.csv'): 
-                df_raw = pd.read_csv(f_ben, sep=None, engine='python')
-            else: 
-                df_raw = pd.read_excel(f_ben)
-            
-            df_new = prepare_benner_upload(df_raw)
+            df_new = processar_arquivo_benner(f_ben.name, f_ben.getvalue())
             db = st.session_state.db_benner
             
-            if not db.empty:
-                ids_db = set(db['ID_BENNER'])
-                ids_new = set(df_new['ID_BENNER'])
-                ids_conf = ids_new.intersection(ids_db)
-                st.session_state.novos = df_new[~df_new['ID_BENNER'].isin(ids_conf)]
-                st.session_state.conflitos = df_new[df_new['ID_BENNER'].isin(ids_conf)] if ids_conf else None
-            else:
-                st.session_state.novos = df_new
-                st.session_state.conflitos = None
+            # Pelo hash do conteúdo: documentos iguais aos do banco não são gravados nem reconciliados
+            novos, alterados, iguais = classificar_benner(df_new, hashes_benner())
+            st.session_state.novos = novos
+            st.session_state.conflitos = alterados if not alterados.empty else None
                 
             if st.session_state.conflitos is None:
-                final = pd.concat([db, st.session_state.novos], ignore_index=True)
-                save_db_benner(final)
-                
-                # Auto-Conciliação na Importação
-                qtd_conc = auto_conciliar_extrato_pelo_benner(st.session_state.novos)
+                qtd_conc = 0
+                if not novos.empty:
+                    final = pd.concat([db, novos], ignore_index=True)
+                    save_db_benner(final, alterados=novos)
+                    
+                    # Auto-Conciliação na Importação
+                    qtd_conc = auto_conciliar_extrato_pelo_benner(novos)
                 msg_extra = f" + {qtd_conc} conciliados no Extrato!" if qtd_conc > 0 else ""
                 
-                st.toast(f"Importação Benner concluída!{msg_extra}", icon="✅")
+                st.toast(f"Importação Benner concluída! {len(novos)} novos, {iguais} sem alteração.{msg_extra}", icon="✅")
             else:
                 st.toast("⚠️ Conflitos detectados! Resolva na aba Gestão Benner.", icon="⚠️")
                 
@@ -444,6 +773,7 @@ if f_ben:
             st.rerun() 
         except Exception as e:
             st.error(f"Erro no upload Benner: {e}")
+marco("importacao")
 
 # ==============================================================================
 # ABA 1: GESTÃO BENNER
@@ -453,26 +783,27 @@ if pagina == "📁 Gestão Benner":
     
     if st.session_state.conflitos is not None and not st.session_state.conflitos.empty:
         with st.container():
-            st.markdown("""<div class="conflict-box"><h3>⚠️ Duplicidade Identificada</h3><p>Registros do arquivo já existem no banco. Escolha:</p></div>""", unsafe_allow_html=True)
-            c1, c2 = st.columns(2)
+            st.markdown("""<div class="conflict-box"><h3>⚠️ Duplicidade Identificada</h3><p>Documentos do arquivo já existem no banco com conteúdo diferente. Escolha:</p></div>""", unsafe_allow_html=True)
             ids_c = st.session_state.conflitos['ID_BENNER'].tolist()
             old = st.session_state.db_benner[st.session_state.db_benner['ID_BENNER'].isin(ids_c)]
             
-            c1.info("💾 Dados Atuais")
-            c1.dataframe(old[['Número', 'Valor Total', 'Data Baixa', 'STATUS_CONCILIACAO']], hide_index=True)
-            c2.warning("📄 Dados Novos")
-            c2.dataframe(st.session_state.conflitos[['Número', 'Valor Total', 'Data Baixa', 'STATUS_CONCILIACAO']], hide_index=True)
+            # Só os campos que mudaram, documento a documento
+            st.caption(f"{len(ids_c)} documento(s) alterado(s)")
+            st.dataframe(diferencas_benner(old, st.session_state.conflitos), hide_index=True, use_container_width=True)
             
             b1, b2 = st.columns(2)
             if b1.button("🔄 SUBSTITUIR (Usar Novo)", type="primary"):
                 db_clean = st.session_state.db_benner[~st.session_state.db_benner['ID_BENNER'].isin(ids_c)]
                 final = pd.concat([db_clean, st.session_state.conflitos, st.session_state.novos], ignore_index=True)
-                save_db_benner(final)
+                tudo_novo = pd.concat([st.session_state.conflitos, st.session_state.novos], ignore_index=True)
+                save_db_benner(final, alterados=tudo_novo)
                 
                 # Tenta conciliar com os novos
-                tudo_novo = pd.concat([st.session_state.conflitos, st.session_state.novos], ignore_index=True)
-                qtd = auto_conciliar_extrato_pelo_benner(tudo_novo)
-                if qtd > 0: st.toast(f"{qtd} itens conciliados automaticamente no Extrato!", icon="✨")
+                try:
+                    qtd = auto_conciliar_extrato_pelo_benner(tudo_novo)
+                    if qtd > 0: st.toast(f"{qtd} itens conciliados automaticamente no Extrato!", icon="✨")
+                except Exception as e:
+                    st.toast(f"Erro ao gravar o histórico: {e}", icon="⚠️")
                 
                 st.session_state.conflitos = None
                 st.session_state.novos = None
@@ -481,9 +812,12 @@ if pagina == "📁 Gestão Benner":
             if b2.button("❌ IGNORAR NOVOS (Manter Atual)", type="secondary"):
                 if st.session_state.novos is not None and not st.session_state.novos.empty:
                     final = pd.concat([st.session_state.db_benner, st.session_state.novos], ignore_index=True)
-                    save_db_benner(final)
-                    qtd = auto_conciliar_extrato_pelo_benner(st.session_state.novos)
-                    if qtd > 0: st.toast(f"{qtd} itens conciliados automaticamente no Extrato!", icon="✨")
+                    save_db_benner(final, alterados=st.session_state.novos)
+                    try:
+                        qtd = auto_conciliar_extrato_pelo_benner(st.session_state.novos)
+                        if qtd > 0: st.toast(f"{qtd} itens conciliados automaticamente no Extrato!", icon="✨")
+                    except Exception as e:
+                        st.toast(f"Erro ao gravar o histórico: {e}", icon="⚠️")
                 st.session_state.conflitos = None
                 st.session_state.novos = None
                 st.rerun()
@@ -491,44 +825,44 @@ if pagina == "📁 Gestão Benner":
 
     df = st.session_state.db_benner
     if not df.empty:
-        df['Valor Total'] = df['Valor Total'].apply(converter_valor)
-        df['Data de Vencimento'] = pd.to_datetime(df['Data de Vencimento'], errors='coerce')
-        
+        painel = painel_benner(df)
         with st.expander("🌪️ Filtros & Exportação", expanded=True):
             f1, f2, f3, f4 = st.columns(4)
             st_filt = f1.selectbox("Status", ["Todos", "Pendente", "Conciliado"])
             
-            opcoes_tipo = ["Todos"] + sorted([str(x) for x in df['Tipo do Documento'].unique() if pd.notna(x)])
+            opcoes_tipo = ["Todos"] + painel.opcoes_tipo
             tp_filt = f2.selectbox("Banco (Tipo)", opcoes_tipo)
             
-            d_min = df['Data de Vencimento'].min().date() if not df['Data de Vencimento'].dropna().empty else date.today()
-            d_max = df['Data de Vencimento'].max().date() if not df['Data de Vencimento'].dropna().empty else date.today()
-            ini = f3.date_input("De", d_min)
-            fim = f4.date_input("Até", d_max)
+            ini = f3.date_input("De", painel.d_min)
+            fim = f4.date_input("Até", painel.d_max)
             
-        df_v = df.copy()
-        if st_filt != "Todos": df_v = df_v[df_v['STATUS_CONCILIACAO'] == st_filt]
-        if tp_filt != "Todos": df_v = df_v[df_v['Tipo do Documento'] == tp_filt]
-        df_v = df_v[(df_v['Data de Vencimento'].dt.date >= ini) & (df_v['Data de Vencimento'].dt.date <= fim)]
+        sel_status = None if st_filt == "Todos" else st_filt
+        sel_tipo = None if tp_filt == "Todos" else tp_filt
+        df_v = df.iloc[painel.posicoes(sel_status, sel_tipo, ini, fim)]
         
-        soma_filtrada = df_v['Valor Total'].sum()
-        st.metric("Total Filtrado", formatar_br(soma_filtrada), f"{len(df_v)} docs")
+        qtd_filtrada, soma_filtrada = painel.totais(sel_status, sel_tipo, ini, fim)
+        st.metric("Total Filtrado", formatar_br(soma_filtrada), f"{qtd_filtrada} docs")
+        marco("gestao_filtros")
         
-        st.dataframe(df_v, use_container_width=True, hide_index=True)
+        st.dataframe(para_exibicao(df_v), use_container_width=True, hide_index=True, column_config={"DESC_CLEAN": None})
+        marco("gestao_tabela")
         
         ce1, ce2 = st.columns([3, 1])
         with ce1: tipo_exp = st.radio("Exportar:", ["Dados da Tela", "Pendentes", "Conciliados", "Tudo"], horizontal=True)
         with ce2:
-            st.write("")
-            if tipo_exp == "Dados da Tela": df_exp = df_v
-            elif tipo_exp == "Pendentes": df_exp = df[df['STATUS_CONCILIACAO'] == 'Pendente']
-            elif tipo_exp == "Conciliados": df_exp = df[df['STATUS_CONCILIACAO'] == 'Conciliado']
+            token = ("benner", cache_dados().versao("benner"), tipo_exp)
+            if tipo_exp == "Dados da Tela":
+                df_exp = df_v
+                token += (sel_status, sel_tipo, ini, fim)
+            elif tipo_exp == "Pendentes": df_exp = df.iloc[painel.posicoes('Pendente')]
+            elif tipo_exp == "Conciliados": df_exp = df.iloc[painel.posicoes('Conciliado')]
             else: df_exp = df
-            st.download_button("📥 BAIXAR EXCEL", to_excel(df_exp), "benner.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            botao_exportar(st, "📥 BAIXAR", "benner", token, lambda: para_exibicao(df_exp.drop(columns="DESC_CLEAN")), key="exportar_benner")
+        marco("gestao_exportar")
             
         st.markdown("---")
         if st.button("🗑️ ZERAR BASE", type="primary"):
-            if os.path.exists(DB_BENNER): os.remove(DB_BENNER)
+            limpar_db_benner()
             st.session_state.db_benner = pd.DataFrame(columns=df.columns)
             st.rerun()
     else:
@@ -539,85 +873,84 @@ if pagina == "📁 Gestão Benner":
 # ==============================================================================
 elif pagina == "🔎 Busca Extrato":
     st.title("🔎 Busca Extrato")
+    catalogo = catalogo_arquivo()
+    abrir_fatia_arquivada(catalogo)
+    marco("busca_arquivo")
     if st.session_state.dados_mestre is not None:
         df_master = st.session_state.dados_mestre
-        hoje = datetime.now().strftime("%d/%m/%Y")
-        conc_hoje = df_master[df_master["DATA_CONCILIACAO"].astype(str).str.contains(hoje, na=False)]
+        painel = painel_extrato()
+        qtd_hoje, valor_hoje = painel.conciliados_hoje(df_master)
         c1, c2 = st.columns(2)
-        c1.metric("Conciliados Hoje", len(conc_hoje))
-        c2.metric("Valor Hoje", formatar_br(conc_hoje["VALOR"].sum()))
+        c1.metric("Conciliados Hoje", qtd_hoje)
+        c2.metric("Valor Hoje", formatar_br(valor_hoje))
         st.markdown("---")
         with st.expander("🌪️ Filtros Avançados", expanded=True):
             c1, c2, c3 = st.columns(3)
-            meses = ["Todos"] + sorted(df_master["MES_ANO"].unique().tolist(), reverse=True)
+            meses = ["Todos"] + opcoes_arquivo("MES_ANO", painel, catalogo)
             sel_mes = c1.selectbox("📅 Mês:", meses, key="filtro_mes")
-            bancos = ["Todos"] + sorted(df_master["BANCO"].unique().tolist())
+            bancos = ["Todos"] + opcoes_arquivo("BANCO", painel, catalogo)
             sel_banco = c2.selectbox("🏦 Banco:", bancos, key="filtro_banco")
             tipos = ["Todos", "CRÉDITO", "DÉBITO"]
             sel_tipo = c3.selectbox("🔄 Tipo:", tipos, key="filtro_tipo")
             if st.button("🧹 LIMPAR FILTROS", type="secondary", on_click=limpar_filtros_extrato): pass
         
-        df_f = df_master.copy()
-        if st.session_state.filtro_mes != "Todos": df_f = df_f[df_f["MES_ANO"] == st.session_state.filtro_mes]
-        if st.session_state.filtro_banco != "Todos": df_f = df_f[df_f["BANCO"] == st.session_state.filtro_banco]
-        if st.session_state.filtro_tipo != "Todos": df_f = df_f[df_f["TIPO"] == st.session_state.filtro_tipo]
+        filtros = {c: st.session_state[k] for c, k in [("MES_ANO", "filtro_mes"), ("BANCO", "filtro_banco"), ("TIPO", "filtro_tipo")]
+                   if st.session_state[k] != "Todos"}
+        df_f = filtrar_posicoes(df_master, painel.posicoes(filtros))
+        marco("busca_filtros")
         
-        busca = st.text_input("🔎 Pesquisa Rápida (Valor ou Nome)", key="filtro_texto")
+        cb1, cb2 = st.columns([4, 1])
+        busca = cb1.text_input("🔎 Pesquisa Rápida (Valor ou Nome)", key="filtro_texto")
+        aproximada = cb2.checkbox("Busca aproximada", key="filtro_aproximada", disabled=fuzz is None)
         if busca:
             termo = busca.strip()
+            idx_busca = indice_busca()
             # Tenta buscar por valor numérico
             if any(char.isdigit() for char in termo) and not termo.replace('.','').isdigit():
                  try:
                       val = float(termo.replace('R$','').replace('.','').replace(',','.'))
-                      df_f = df_f[(df_f["VALOR"].abs() - val).abs() <= 0.1]
-                 except: df_f = df_f[df_f["DESCRIÇÃO"].str.contains(termo, case=False, na=False)]
+                      df_f = filtrar_por_rotulos(df_f, idx_busca.buscar_valor(val))
+                 except ValueError: df_f = filtrar_por_rotulos(df_f, idx_busca.buscar_texto(termo, aproximada))
             else:
-                df_f = df_f[df_f["DESCRIÇÃO"].str.contains(termo, case=False, na=False)]
+                df_f = filtrar_por_rotulos(df_f, idx_busca.buscar_texto(termo, aproximada))
+        marco("busca_pesquisa_rapida")
         
         if not df_f.empty:
-            ent = df_f[df_f["VALOR"] > 0]["VALOR"].sum()
-            sai = df_f[df_f["VALOR"] < 0]["VALOR"].sum()
+            if busca:
+                itens = len(df_f)
+                ent = df_f[df_f["VALOR"] > 0]["VALOR"].sum() / 100
+                sai = df_f[df_f["VALOR"] < 0]["VALOR"].sum() / 100
+            else:
+                itens, ent, sai = painel.totais(filtros)
             k1, k2, k3 = st.columns(3)
-            k1.metric("Itens", len(df_f))
+            k1.metric("Itens", itens)
             k2.metric("Créditos", formatar_br(ent))
             k3.metric("Débitos", formatar_br(sai))
             
-            df_show = df_f.copy()
+            df_show = para_exibicao(df_f)
             df_show["DATA"] = df_show["DATA"].dt.date
             
-            edited = st.data_editor(
+            st.data_editor(
                 df_show[["CONCILIADO", "DATA", "BANCO", "DESCRIÇÃO", "VALOR", "ID_HASH"]],
                 hide_index=True,
                 use_container_width=True,
                 height=500,
-                column_config={"CONCILIADO": st.column_config.CheckboxColumn(default=False), "ID_HASH": None}
+                column_config={"CONCILIADO": st.column_config.CheckboxColumn(default=False), "ID_HASH": None},
+                disabled=["DATA", "BANCO", "DESCRIÇÃO", "VALOR"],
+                key="editor_extrato"
             )
+            marco("busca_editor")
             
-            # Lógica de Salvar Manualmente
-            ids_conc = edited[edited["CONCILIADO"]==True]["ID_HASH"].tolist()
-            ids_unconc = edited[edited["CONCILIADO"]==False]["ID_HASH"].tolist()
-            changed = False
-            
-            # Marca como conciliado
-            if ids_conc:
-                mask = st.session_state.dados_mestre["ID_HASH"].isin(ids_conc)
-                if not st.session_state.dados_mestre.loc[mask, "CONCILIADO"].all():
-                    st.session_state.dados_mestre.loc[mask, "CONCILIADO"] = True
-                    st.session_state.dados_mestre.loc[mask, "DATA_CONCILIACAO"] = datetime.now().strftime("%d/%m/%Y %H:%M")
-                    changed = True
-            
-            # Desmarca
-            mask_un = st.session_state.dados_mestre["ID_HASH"].isin(ids_unconc) & st.session_state.dados_mestre["ID_HASH"].isin(df_f["ID_HASH"])
-            if st.session_state.dados_mestre.loc[mask_un, "CONCILIADO"].any():
-                st.session_state.dados_mestre.loc[mask_un, "CONCILIADO"] = False
-                st.session_state.dados_mestre.loc[mask_un, "DATA_CONCILIACAO"] = None
-                changed = True
-                
-            if changed:
-                save_hist_extrato(st.session_state.dados_mestre)
+            # Lógica de Salvar Manualmente: só as linhas alteradas no editor, não a tela inteira
+            edicoes = st.session_state["editor_extrato"].get("edited_rows", {})
+            if edicoes and salvar_edicoes_extrato(df_show["ID_HASH"], edicoes):
                 st.toast("Salvo!")
+            marco("busca_salvar_edicoes")
             
-            st.download_button("📥 BAIXAR EXTRATO (XLSX)", to_excel(df_f), "extrato_filtrado.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            token = ("extrato", st.session_state.id_sessao, st.session_state.versao_extrato, st.session_state.versao_conciliacao,
+                     tuple(sorted(filtros.items())), busca, aproximada)
+            botao_exportar(st, "📥 BAIXAR EXTRATO", "extrato_filtrado", token, lambda: para_exibicao(df_f), key="exportar_extrato")
+            marco("busca_exportar")
         else:
             st.warning("Nenhum dado encontrado.")
     else:
@@ -633,77 +966,83 @@ elif pagina == "🤝 Conciliação Automática":
     df_bn = st.session_state.db_benner
     
     if df_ex is not None and not df_bn.empty:
-        meses = ["Todos"] + sorted(df_ex["MES_ANO"].unique().tolist(), reverse=True)
+        painel = painel_extrato()
+        meses = ["Todos"] + painel.opcoes["MES_ANO"]
         f_mes = c1.selectbox("📅 Mês Extrato:", meses)
-        bancos = ["Todos"] + sorted(df_ex["BANCO"].unique().tolist())
+        bancos = ["Todos"] + painel.opcoes["BANCO"]
         f_banco = c2.selectbox("🏦 Banco Extrato:", bancos)
         
-        df_ex_robo = df_ex[df_ex['CONCILIADO'] == False].copy()
-        if f_mes != "Todos": df_ex_robo = df_ex_robo[df_ex_robo["MES_ANO"] == f_mes]
-        if f_banco != "Todos": df_ex_robo = df_ex_robo[df_ex_robo["BANCO"] == f_banco]
+        filtros = {c: v for c, v in [("MES_ANO", f_mes), ("BANCO", f_banco)] if v != "Todos"}
+        df_ex_robo = df_ex.iloc[painel.posicoes(filtros, pendentes=True)]
         
-        df_bn_robo = df_bn[df_bn['STATUS_CONCILIACAO'] == 'Pendente'].copy()
-        df_bn_robo["VALOR_REF"] = df_bn_robo["Valor Total"].apply(converter_valor)
-        df_bn_robo["DESC_CLEAN"] = df_bn_robo["Nome"].astype(str).apply(limpar_descricao)
+        df_bn_robo = df_bn.iloc[painel_benner(df_bn).posicoes('Pendente')]
         
         st.info(f"Escopo: {len(df_ex_robo)} itens do extrato vs {len(df_bn_robo)} documentos pendentes.")
+        marco("conciliacao_escopo")
         
+        chave = (st.session_state.id_sessao, st.session_state.versao_extrato, st.session_state.versao_conciliacao,
+                 cache_dados().versao("benner"), f_mes, f_banco)
         if st.button("🚀 PESQUISAR CONCILIAÇÃO"):
-            matches = []
-            l_ex = df_ex_robo.to_dict('records')
-            l_bn = df_bn_robo.to_dict('records')
-            
-            pbar = st.progress(0)
-            
             if fuzz:
-                for i, bn in enumerate(l_bn):
-                    pbar.progress((i+1)/len(l_bn))
-                    # Filtra primeiro por valor aproximado (margem de 10 centavos)
-                    candidates = [e for e in l_ex if abs(abs(e['VALOR']) - bn['VALOR_REF']) <= 0.10]
-                    
-                    best_score = 0
-                    best_match = None
-                    
-                    for cand in candidates:
-                        score = fuzz.token_set_ratio(bn['DESC_CLEAN'], cand['DESC_CLEAN'])
-                        if score > 70 and score > best_score:
-                            best_score = score
-                            best_match = cand
-                    
-                    if best_match:
-                        matches.append({
-                            "Extrato Data": formatar_data(best_match['DATA']),
-                            "Extrato Desc": best_match['DESCRIÇÃO'],
-                            "Extrato Valor": formatar_br(best_match['VALOR']),
-                            "Benner Doc": bn['Número'],
-                            "Benner Nome": bn['Nome'],
-                            "Score": best_score,
-                            "ID_HASH": best_match['ID_HASH'],
-                            "ID_BENNER": bn['ID_BENNER']
-                        })
+                iniciar_conciliacao(chave, df_ex.iloc[painel.posicoes({}, pendentes=True)], df_ex_robo, df_bn_robo)
             else:
                  st.error("Biblioteca rapidfuzz não instalada.")
 
-            if matches:
-                res = pd.DataFrame(matches)
+        tarefa = tarefa_conciliacao(chave)
+        if tarefa is not None and tarefa.rodando:
+            acompanhar_conciliacao(tarefa)
+        elif tarefa is not None:
+            matches = tarefa.matches
+            if tarefa.erro is not None:
+                st.error(f"Erro na pesquisa: {tarefa.erro}")
+            elif matches is None:
+                st.info("Pesquisa cancelada.")
+            elif matches:
+                res = pd.DataFrame(matches).drop(columns=["ID_HASH", "ID_BENNER"])
                 st.success(f"{len(res)} Matches Encontrados!")
-                st.dataframe(res.drop(columns=["ID_HASH", "ID_BENNER"]), hide_index=True)
+                # Desmarcados são rejeitados ao salvar e não voltam a ser sugeridos
+                res_tela = st.data_editor(res.assign(OK=True), hide_index=True, key="editor_matches",
+                                          column_config={"OK": st.column_config.CheckboxColumn()},
+                                          disabled=[c for c in res.columns])
                 
-                st.download_button("📥 BAIXAR MATCHES (XLSX)", to_excel(res.drop(columns=["ID_HASH", "ID_BENNER"])), "matches.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                botao_exportar(st, "📥 BAIXAR MATCHES", "matches", ("matches",) + chave,
+                               lambda: res, key="exportar_matches")
                 
                 if st.button("💾 CONFIRMAR E SALVAR CONCILIAÇÃO"):
-                    ids_ex = [m['ID_HASH'] for m in matches]
+                    aceitos = res_tela["OK"].to_numpy(dtype=bool)
+                    # Só os pares 1:1 ficam no banco de candidatos; grupos são refeitos a cada pesquisa
+                    pares = [(m['ID_BENNER'], m['ID_HASH']) if m['Tipo'] == "1:1" else None for m in matches]
+                    marcar_candidatos([p for p, ok in zip(pares, aceitos) if p and not ok], "rejeitado")
+                    marcar_candidatos([p for p, ok in zip(pares, aceitos) if p and ok], "confirmado")
+                    matches = [m for m, ok in zip(matches, aceitos) if ok]
+                    ids_ex = [i for m in matches for i in np.atleast_1d(m['ID_HASH'])]
                     mask = st.session_state.dados_mestre['ID_HASH'].isin(ids_ex)
                     st.session_state.dados_mestre.loc[mask, 'CONCILIADO'] = True
-                    save_hist_extrato(st.session_state.dados_mestre)
+                    fila_historico().marcar(st.session_state.dados_mestre[mask], st.session_state.id_sessao)
+                    registrar_conciliacao(np.flatnonzero(mask.to_numpy()))
                     
-                    ids_bn = [m['ID_BENNER'] for m in matches]
-                    db = load_db_benner()
-                    db.loc[db['ID_BENNER'].isin(ids_bn), 'STATUS_CONCILIACAO'] = 'Conciliado'
-                    save_db_benner(db)
+                    ids_bn = [i for m in matches for i in np.atleast_1d(m['ID_BENNER'])]
+                    db = obter_db_benner()
+                    mask_bn = db['ID_BENNER'].isin(ids_bn)
+                    db.loc[mask_bn, 'STATUS_CONCILIACAO'] = 'Conciliado'
+                    save_db_benner(db, alterados=db[mask_bn])
                     
-                    st.balloons()
+                    # Entradas mudaram: o resultado já foi gravado e não vale mais
+                    st.session_state.tarefa_conciliacao = None
+                    try:
+                        fila_historico().esperar()  # só confirma com o histórico gravado
+                        st.balloons()
+                    except Exception as e:
+                        st.error(f"Erro ao gravar o histórico: {e}")
             else:
                 st.warning("Nenhum match encontrado.")
+        marco("conciliacao_resultados")
     else:
         st.warning("Carregue Extrato e Documentos primeiro.")
+
+# --- PAINEL DE DESEMPENHO (ADMIN) ---
+if MEDICAO_ATIVA:
+    marco("pagina")  # o que sobrou da página depois do último marco
+    st.session_state.rerun_atual.encerrar()  # antes do painel: ele já mostra este rerun (e não entra na conta)
+    st.session_state.rerun_atual = None
+    if st.session_state.get("usuario") in ADMINS: painel_desempenho()
@@ -0,0 +1,126 @@
+"""Arquivo em disco das linhas de extrato já lidas: Parquet particionado por mês e banco
+(arquivo_extrato/MES_ANO=01%2F2024/BANCO=BB/parte-*.parquet, convenção hive).
+
+Cada importação grava só as linhas que a partição ainda não tem. Na leitura, os filtros da tela viram poda de
+diretórios (só os mês/banco pedidos são abertos) e projeção de colunas (só as pedidas são lidas dos arquivos).
+As marcas de conciliação continuam no SQLite: quem lê aplica o histórico por cima.
+Sem dependência do Streamlit.
+"""
+import os
+import hashlib
+import threading
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from ingestao import tipar_extrato
+
+DIR_ARQUIVO = "arquivo_extrato"
+PARTICOES = ["MES_ANO", "BANCO"]
+# Colunas gravadas nos arquivos (mês e banco ficam só no nome dos diretórios)
+COLS_ARQUIVO = ["DATA", "DESCRIÇÃO", "VALOR", "OCORRENCIA", "ID_HASH", "DESC_CLEAN", "TIPO"]
+# Colunas lidas para a sessão (OCORRENCIA só serve para o hash, já calculado)
+COLS_LEITURA = ["DATA", "DESCRIÇÃO", "VALOR", "ID_HASH", "DESC_CLEAN", "TIPO"] + PARTICOES
+NULO = "__HIVE_DEFAULT_PARTITION__"  # partição de valor vazio (o pyarrow lê como nulo)
+MAX_PARTES = 16  # acima disso as partes da partição são juntadas numa só
+
+_ESQUEMA_PARTICOES = pa.schema([(c, pa.string()) for c in PARTICOES])
+_lock = threading.Lock()
+
+def _segmento(col, valor):
+    # "/" do MES_ANO (e qualquer outro caractere de caminho) vai codificado
+    return f"{col}={NULO if valor is None or pd.isna(valor) else quote(str(valor), safe='')}"
+
+def _valor(segmento):
+    v = segmento.split("=", 1)[1]
+    return None if v == NULO else unquote(v)
+
+def _pasta(raiz, mes, banco):
+    return os.path.join(raiz, _segmento("MES_ANO", mes), _segmento("BANCO", banco))
+
+def _partes(pasta):
+    try: return sorted(e.path for e in os.scandir(pasta) if e.name.endswith(".parquet"))
+    except FileNotFoundError: return []
+
+def _subpastas(pasta, col, valores):
+    # Com valores, nada é listado: o caminho de cada partição sai direto do valor
+    if valores is not None:
+        return [p for p in (os.path.join(pasta, _segmento(col, v)) for v in valores) if os.path.isdir(p)]
+    try: return [e.path for e in os.scandir(pasta) if e.is_dir() and e.name.startswith(col + "=")]
+    except FileNotFoundError: return []
+
+def _tabela(arquivos, raiz, colunas=None):
+    dataset = ds.dataset(arquivos, format="parquet", partition_base_dir=raiz,
+                         partitioning=ds.partitioning(_ESQUEMA_PARTICOES, flavor="hive"))
+    return dataset.to_table(columns=colunas)
+
+def _gravar_parte(pasta, df):
+    os.makedirs(pasta, exist_ok=True)
+    # Nome pelo conteúdo: dois processos gravando as mesmas linhas produzem o mesmo arquivo
+    nome = hashlib.blake2b("".join(sorted(df["ID_HASH"])).encode(), digest_size=12).hexdigest()
+    destino = os.path.join(pasta, f"parte-{nome}.parquet")
+    tmp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df[COLS_ARQUIVO].to_parquet(tmp, index=False)
+        os.replace(tmp, destino)  # atômico: leitores nunca veem parte pela metade
+    except Exception:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    return destino
+
+def _compactar(pasta, raiz):
+    # Muitas importações pequenas no mesmo mês/banco: junta tudo numa parte só (a nova entra antes de as
+    # antigas saírem; no intervalo a leitura vê linhas repetidas e descarta pelo ID_HASH)
+    partes = _partes(pasta)
+    if len(partes) <= MAX_PARTES: return
+    df = _tabela(partes, raiz, COLS_ARQUIVO).to_pandas().drop_duplicates("ID_HASH")
+    nova = _gravar_parte(pasta, df)
+    for p in partes:
+        if p == nova: continue
+        try: os.remove(p)
+        except FileNotFoundError: pass
+
+def arquivar_extrato(df, raiz=DIR_ARQUIVO):
+    """Grava no arquivo as linhas de `df` (extrato já processado) que a partição mês/banco ainda não tem.
+    De cada partição existente só a coluna ID_HASH é lida. Retorna quantas linhas entraram."""
+    if df is None or df.empty: return 0
+    gravadas = 0
+    with _lock:
+        for (mes, banco), grupo in df.groupby(PARTICOES, observed=True, dropna=False, sort=False):
+            pasta = _pasta(raiz, mes, banco)
+            partes = _partes(pasta)
+            if partes:
+                existentes = _tabela(partes, raiz, ["ID_HASH"]).column(0).to_pandas()
+                grupo = grupo[~grupo["ID_HASH"].isin(existentes)]
+            grupo = grupo.drop_duplicates("ID_HASH")
+            if grupo.empty: continue
+            _gravar_parte(pasta, grupo)
+            _compactar(pasta, raiz)
+            gravadas += len(grupo)
+    return gravadas
+
+def catalogo(raiz=DIR_ARQUIVO):
+    """(mês, banco) de todas as partições gravadas, pelos nomes dos diretórios (nenhum arquivo é aberto)."""
+    return [(_valor(os.path.basename(m)), _valor(os.path.basename(b)))
+            for m in _subpastas(raiz, "MES_ANO", None) for b in _subpastas(m, "BANCO", None) if _partes(b)]
+
+def ler_arquivo(meses=None, bancos=None, colunas=None, raiz=DIR_ARQUIVO):
+    """Linhas arquivadas dos `meses`/`bancos` pedidos (None = todos), só com as `colunas` pedidas
+    (None = todas, mês e banco inclusive). Retorna None se não há nada gravado para a seleção."""
+    for tentativa in range(2):
+        arquivos = [p for m in _subpastas(raiz, "MES_ANO", meses) for b in _subpastas(m, "BANCO", bancos) for p in _partes(b)]
+        if not arquivos: return None
+        try: return _tabela(arquivos, raiz, colunas).to_pandas()
+        except FileNotFoundError:
+            if tentativa: raise  # parte removida por uma compactação entre a listagem e a leitura: lista de novo
+
+def abrir_extrato(meses=None, bancos=None, raiz=DIR_ARQUIVO):
+    """Fatia do arquivo no esquema do extrato da sessão, sem conciliação (o histórico é aplicado depois)."""
+    df = ler_arquivo(meses, bancos, COLS_LEITURA, raiz)
+    if df is None or df.empty: return None
+    df = df.drop_duplicates("ID_HASH").sort_values(["DATA", "VALOR"], kind="stable").reset_index(drop=True)
+    df["CONCILIADO"] = False
+    df["DATA_CONCILIACAO"] = pd.NaT
+    return tipar_extrato(df)
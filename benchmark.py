@@ -0,0 +1,295 @@
+"""Benchmark das etapas pesadas (ingestão, histórico, conciliação, exportação) com dados sintéticos.
+
+    python benchmark.py [--tamanhos 1k,10k,100k] [--etapas ...] [--semente 42] [--saida bench.json]
+                        [--sem-memoria] [--comparar bench_anterior.json]
+
+Gera extratos e exportações do Benner realistas (valores no formato brasileiro, PIX/TED/boletos, nomes de
+fornecedor com variações de grafia) a partir de uma semente fixa: mesma semente, mesmos dados. Cada tamanho
+roda num processo novo, numa pasta temporária (banco e caches vazios). O tempo é medido numa passada sem
+rastreamento e o pico de memória (alocações Python/NumPy via tracemalloc) em outra, para um não distorcer
+o outro. O resultado vai para JSON; com --comparar, imprime a razão em relação a uma execução anterior.
+1m (1 milhão de linhas) fica fora do padrão: leva horas com poucos núcleos; use com --etapas.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+TAMANHOS = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# --- GERADOR ---
+PREFIXOS = ["COMERCIAL", "DISTRIBUIDORA", "AUTO POSTO", "SUPERMERCADO", "CONSTRUTORA", "TRANSPORTES",
+            "FARMACIA", "MADEIREIRA", "PAPELARIA", "CLINICA", "AGROPECUARIA", "MATERIAIS ELETRICOS"]
+SOBRENOMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "LIMA", "PEREIRA", "COSTA", "RODRIGUES", "ALMEIDA",
+              "NASCIMENTO", "CARVALHO", "ARAUJO", "RIBEIRO", "MARTINS", "BARBOSA", "GOMES", "ROCHA", "DIAS"]
+SUFIXOS = ["LTDA", "LTDA ME", "EIRELI", "S/A", "ME", ""]
+ABREVIACOES = {"COMERCIAL": "COM", "DISTRIBUIDORA": "DIST", "SUPERMERCADO": "SUPERM", "CONSTRUTORA": "CONSTR",
+               "TRANSPORTES": "TRANSP", "MATERIAIS ELETRICOS": "MAT ELET", "AGROPECUARIA": "AGROPEC"}
+SAIDAS = ["PIX ENVIADO", "TED ENVIADA", "PAGAMENTO BOLETO", "PGTO FORNECEDOR", "TRANSF ENVIADA"]
+AVULSOS = ["TARIFA BANCARIA", "IOF", "RENDIMENTO APLICACAO", "PIX RECEBIDO CLIENTE", "DEPOSITO EM DINHEIRO"]
+BANCOS = ["BB", "BASA", "CAIXA", "ITAU", "BRADESCO"]
+
+def _fornecedores(rng, n):
+    nomes = {f"{rng.choice(PREFIXOS)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SUFIXOS)}".strip()
+             for _ in range(n * 2)}
+    return np.array(sorted(nomes)[:n])
+
+def _variar(nome, rng):
+    # Como o banco escreve o favorecido: sem sufixo, abreviado, truncado
+    r = rng.random()
+    if r < 0.25:
+        for s in SUFIXOS[:-1]: nome = nome.removesuffix(" " + s)
+    elif r < 0.45:
+        for longo, curto in ABREVIACOES.items(): nome = nome.replace(longo, curto)
+    elif r < 0.6:
+        nome = nome[:25]
+    return nome
+
+def _valor_br(v):
+    return f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+def gerar_dados(n, semente=42):
+    """Extrato com n linhas (bytes de CSV, como vem do banco) e exportação do Benner (DataFrame bruto, ~n/4 docs).
+    Parte dos documentos corresponde a pagamentos do extrato: baixados (conciliação na importação), pendentes
+    (pesquisa valor + nome), alguns com diferença de centavos e alguns pagos em 2 ou 3 parcelas."""
+    rng = np.random.default_rng(semente)
+    fornecedores = _fornecedores(rng, max(50, n // 40))
+    dias = max(30, min(365, n // 300))
+    inicio = np.datetime64("2024-01-01")
+
+    n_pag = int(n * 0.7)
+    forn_pag = rng.integers(0, len(fornecedores), n_pag)
+    valores_pag = np.round(np.exp(rng.normal(6.5, 1.4, n_pag)).clip(5, 250_000), 2)
+    datas_pag = inicio + rng.integers(0, dias, n_pag).astype("timedelta64[D]")
+    # 2% dos pagamentos divididos em 2 ou 3 lançamentos no extrato
+    partes = np.where(rng.random(n_pag) < 0.02, rng.integers(2, 4, n_pag), 1)
+
+    linhas_forn, linhas_val, linhas_data = [], [], []
+    for f, v, d, k in zip(forn_pag, valores_pag, datas_pag, partes):
+        if k == 1:
+            linhas_forn.append(f); linhas_val.append(v); linhas_data.append(d)
+        else:
+            cortes = np.round(np.diff(np.r_[0, np.sort(rng.uniform(0, v, k - 1)), v]), 2)
+            cortes[-1] = round(v - cortes[:-1].sum(), 2)
+            for c in cortes:
+                linhas_forn.append(f); linhas_val.append(c); linhas_data.append(d + rng.integers(0, 3))
+    n_pag_linhas = len(linhas_val)
+    n_avulsos = max(0, n - n_pag_linhas)
+    desc = [f"{rng.choice(SAIDAS)} {_variar(fornecedores[f], rng)}" for f in linhas_forn]
+    desc += list(rng.choice(AVULSOS, n_avulsos))
+    valores = np.r_[-np.array(linhas_val), np.round(rng.uniform(1, 20_000, n_avulsos), 2) * rng.choice([-1, 1], n_avulsos)]
+    datas = np.r_[np.array(linhas_data, dtype="datetime64[D]"), inicio + rng.integers(0, dias, n_avulsos).astype("timedelta64[D]")]
+    ordem = rng.permutation(len(valores))[:n]
+    extrato = pd.DataFrame({
+        "Data": pd.to_datetime(datas[ordem]).strftime("%d/%m/%Y"),
+        "Histórico": np.array(desc, dtype=object)[ordem],
+        "Valor": [_valor_br(v) for v in valores[ordem]],
+        "Banco": rng.choice(BANCOS, len(ordem)),
+    })
+    csv = extrato.to_csv(index=False, sep=";").encode("utf-8")
+
+    # Benner: 1 documento por pagamento (até n/4), mais documentos sem lançamento no extrato
+    n_docs = max(10, n // 4)
+    usados = rng.choice(n_pag, min(n_pag, int(n_docs * 0.8)), replace=False)
+    valor_doc = valores_pag[usados] + np.where(rng.random(len(usados)) < 0.05, rng.choice([-0.03, 0.02, 0.07], len(usados)), 0)
+    baixado = rng.random(len(usados)) < 0.4
+    n_extra = n_docs - len(usados)
+    vencimento = np.r_[datas_pag[usados] - rng.integers(0, 10, len(usados)).astype("timedelta64[D]"),
+                       inicio + rng.integers(0, dias, n_extra).astype("timedelta64[D]")]
+    baixa = np.r_[np.where(baixado, datas_pag[usados] + rng.integers(-3, 4, len(usados)).astype("timedelta64[D]"),
+                           np.datetime64("NaT")), np.full(n_extra, np.datetime64("NaT"), dtype="datetime64[D]")]
+    benner = pd.DataFrame({
+        "Número": [f"{100000 + i}" for i in range(n_docs)],
+        "Nome": np.r_[fornecedores[forn_pag[usados]], rng.choice(fornecedores, n_extra)],
+        "CNPJ/CPF": [f"{rng.integers(10, 99)}.{rng.integers(100, 999)}.{rng.integers(100, 999)}/0001-{rng.integers(10, 99)}" for _ in range(n_docs)],
+        "Tipo do Documento": rng.choice(["BANCO DO BRASIL", "BANCO DA AMAZONIA", "BOLETO", "NOTA FISCAL"], n_docs),
+        "Data de Vencimento": pd.to_datetime(vencimento).strftime("%Y-%m-%d"),
+        "Data Baixa": pd.to_datetime(baixa).strftime("%Y-%m-%d"),
+        "Valor Total": [_valor_br(v) for v in np.r_[valor_doc, np.round(rng.uniform(10, 50_000, n_extra), 2)]],
+    })
+    return csv, benner
+
+# --- ETAPAS ---
+def executar_etapas(n, semente, etapas, memoria):
+    """Roda as etapas em sequência (cada uma usa a saída das anteriores) e mede cada uma."""
+    origem = os.getcwd()
+    # Banco e caches vazios a cada execução, numa pasta apagada ao final (centenas de MB nos tamanhos grandes)
+    with tempfile.TemporaryDirectory(prefix="bench_", ignore_cleanup_errors=True) as pasta:
+        os.chdir(pasta)
+        try: return _medir_etapas(n, semente, etapas, memoria)
+        finally: os.chdir(origem)
+
+def _medir_etapas(n, semente, etapas, memoria):
+    from ingestao import process_extrato, prepare_benner_upload, para_exibicao
+    from persistencia import inicializar_db, save_hist_extrato, load_hist_extrato, aplicar_historico, momento_conciliacao
+    from conciliacao import (conciliar_benner_com_extrato, buscar_matches_valor_nome, atualizar_candidatos,
+                             melhores_candidatos, buscar_agrupados)
+    from exportacao import exportar_bytes
+    from arquivo_extrato import arquivar_extrato, abrir_extrato
+
+    inicializar_db()
+    csv, benner_bruto = gerar_dados(n, semente)
+    estado = {}
+
+    def e_process_extrato():
+        f = io.BytesIO(csv); f.name = "extrato.csv"
+        estado["ex"] = process_extrato(f)
+        return len(estado["ex"])
+
+    def e_prepare_benner_upload():
+        estado["bn"] = prepare_benner_upload(benner_bruto.copy())
+        return len(estado["bn"])
+
+    def e_save_hist_extrato():
+        # Histórico com 30% das linhas (como se já tivessem sido conciliadas antes)
+        hist = estado["ex"].sample(frac=0.3, random_state=semente).assign(CONCILIADO=True, DATA_CONCILIACAO=momento_conciliacao())
+        save_hist_extrato(hist)
+        return len(hist)
+
+    def e_sync_historico():
+        # sync_extrato_com_historico: lê o histórico e marca as linhas do extrato
+        estado["ex"] = estado["ex"].copy()
+        return len(aplicar_historico(estado["ex"], load_hist_extrato()))
+
+    def e_auto_conciliacao():
+        ex, bn = estado["ex"], estado["bn"]
+        return len(conciliar_benner_com_extrato(ex, bn[bn["Data Baixa"].notna()], ~ex["CONCILIADO"].to_numpy(dtype=bool)))
+
+    def _pendentes():
+        ex, bn = estado["ex"], estado["bn"]
+        bn_p = bn[bn["STATUS_CONCILIACAO"] == "Pendente"].reset_index(drop=True)
+        return ex[~ex["CONCILIADO"].to_numpy(dtype=bool)], bn_p
+
+    def e_busca_valor_nome():
+        estado["matches"] = buscar_matches_valor_nome(*_pendentes())
+        return len(estado["matches"])
+
+    def e_candidatos_inicial():
+        ex_p, bn_p = _pendentes()
+        atualizar_candidatos(ex_p.iloc[len(ex_p) // 100:], bn_p, set())
+        return len(melhores_candidatos(ex_p, bn_p))
+
+    def e_candidatos_delta():
+        # 1% de linhas novas desde a última pesquisa
+        ex_p, bn_p = _pendentes()
+        atualizar_candidatos(ex_p, bn_p, set(ex_p["ID_HASH"].iloc[len(ex_p) // 100:]))
+        return len(melhores_candidatos(ex_p, bn_p))
+
+    def e_pagamentos_agrupados():
+        ex_p, bn_p = _pendentes()
+        usados = estado.get("matches") or []
+        return len(buscar_agrupados(ex_p[~ex_p["ID_HASH"].isin([m["ID_HASH"] for m in usados])],
+                                    bn_p[~bn_p["ID_BENNER"].isin([m["ID_BENNER"] for m in usados])]))
+
+    def e_exportar_xlsx():
+        return len(exportar_bytes(para_exibicao(estado["ex"]), "xlsx"))
+
+    def e_exportar_csv():
+        return len(exportar_bytes(para_exibicao(estado["ex"]), "csv"))
+
+    def e_arquivar_extrato():
+        return arquivar_extrato(estado["ex"])
+
+    def e_abrir_fatia():
+        # Busca Extrato filtrada por um mês/banco: só essa partição é lida
+        mes, banco = estado["ex"][["MES_ANO", "BANCO"]].iloc[0]
+        return len(abrir_extrato([mes], [banco]))
+
+    funcoes = {"process_extrato": e_process_extrato, "prepare_benner_upload": e_prepare_benner_upload,
+               "save_hist_extrato": e_save_hist_extrato, "sync_historico": e_sync_historico,
+               "auto_conciliacao": e_auto_conciliacao, "busca_valor_nome": e_busca_valor_nome,
+               "candidatos_inicial": e_candidatos_inicial, "candidatos_delta": e_candidatos_delta,
+               "pagamentos_agrupados": e_pagamentos_agrupados, "exportar_xlsx": e_exportar_xlsx,
+               "exportar_csv": e_exportar_csv, "arquivar_extrato": e_arquivar_extrato, "abrir_fatia": e_abrir_fatia}
+    resultados = []
+    for nome in ETAPAS:
+        if nome not in etapas and not any(nome in DEPENDENCIAS.get(e, ()) for e in etapas): continue
+        if memoria: tracemalloc.start()
+        t = time.perf_counter()
+        saida = funcoes[nome]()
+        segundos = time.perf_counter() - t
+        pico = tracemalloc.get_traced_memory()[1] / 2**20 if memoria else None
+        if memoria: tracemalloc.stop()
+        if nome in etapas:
+            resultados.append({"tamanho": n, "etapa": nome, "segundos": segundos, "pico_mb": pico, "saida": saida})
+    return resultados
+
+ETAPAS = ["process_extrato", "prepare_benner_upload", "save_hist_extrato", "sync_historico", "auto_conciliacao",
+          "busca_valor_nome", "candidatos_inicial", "candidatos_delta", "pagamentos_agrupados", "exportar_xlsx", "exportar_csv",
+          "arquivar_extrato", "abrir_fatia"]
+# Etapas que precisam rodar antes (o estado é montado por elas)
+_BASE = ("process_extrato", "prepare_benner_upload", "save_hist_extrato", "sync_historico")
+DEPENDENCIAS = {e: _BASE[:i] for i, e in enumerate(_BASE)}
+DEPENDENCIAS.update({e: _BASE for e in ETAPAS if e not in _BASE})
+DEPENDENCIAS["candidatos_delta"] = _BASE + ("candidatos_inicial",)
+DEPENDENCIAS["pagamentos_agrupados"] = _BASE + ("busca_valor_nome",)
+DEPENDENCIAS["abrir_fatia"] = _BASE + ("arquivar_extrato",)
+
+def _em_processo_novo(*args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(executar_etapas, *args).result()
+
+def _versao_codigo():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def comparar(atual, anterior):
+    base = {(r["tamanho"], r["etapa"]): r for r in anterior["resultados"]}
+    print(f"\nComparação com {anterior.get('versao')} ({anterior.get('data')}): razão atual/anterior")
+    comuns = [(r, base[(r["tamanho"], r["etapa"])]) for r in atual["resultados"] if (r["tamanho"], r["etapa"]) in base]
+    if not comuns: print("  nenhum tamanho/etapa em comum")
+    for r, a in comuns:
+        tempo = r["segundos"] / a["segundos"] if a["segundos"] else float("nan")
+        mem = (r["pico_mb"] / a["pico_mb"]) if r["pico_mb"] and a.get("pico_mb") else None
+        alerta = "  <-- mais lento" if tempo > 1.2 else ""
+        print(f"  {r['tamanho']:>9,} {r['etapa']:<22} tempo x{tempo:5.2f}" + (f"  memória x{mem:5.2f}" if mem else "") + alerta)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de ingestão e conciliação com dados sintéticos.")
+    parser.add_argument("--tamanhos", default="1k,10k,100k", help=f"linhas do extrato ({', '.join(TAMANHOS)} ou número)")
+    parser.add_argument("--etapas", default=",".join(ETAPAS), help="etapas a medir, separadas por vírgula")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", default=f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument("--sem-memoria", action="store_true", help="pula a passada de memória (metade do tempo)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior")
+    args = parser.parse_args(argv)
+    tamanhos = [TAMANHOS.get(t.strip().lower()) or int(t) for t in args.tamanhos.split(",")]
+    etapas = [e.strip() for e in args.etapas.split(",")]
+    desconhecidas = set(etapas) - set(ETAPAS)
+    if desconhecidas: parser.error(f"etapas desconhecidas: {', '.join(sorted(desconhecidas))}")
+
+    saida = {"versao": _versao_codigo(), "data": time.strftime("%Y-%m-%d %H:%M:%S"), "semente": args.semente,
+             "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+             "plataforma": platform.platform(), "cpus": os.cpu_count(), "resultados": []}
+    for n in tamanhos:
+        print(f"\n{n:,} linhas")
+        tempos = _em_processo_novo(n, args.semente, etapas, False)
+        memorias = {} if args.sem_memoria else {r["etapa"]: r["pico_mb"] for r in _em_processo_novo(n, args.semente, etapas, True)}
+        for r in tempos:
+            r["pico_mb"] = memorias.get(r["etapa"])
+            mem = f"{r['pico_mb']:9.1f} MB" if r["pico_mb"] is not None else ""
+            print(f"  {r['etapa']:<22} {r['segundos']:9.3f} s {mem}  ({r['saida']:,})")
+        saida["resultados"] += tempos
+        with open(args.saida, "w", encoding="utf-8") as f:  # grava a cada tamanho: nada se perde se interromper
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados em {args.saida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f: comparar(saida, json.load(f))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+"""Regras de conciliação entre extrato e Benner: casamento reverso na importação, busca valor + nome,
+armazém incremental de candidatos e pagamentos agrupados.
+
+Sem dependência do Streamlit: usada pelo app (em thread) e pela conciliação em lote (em processos).
+"""
+from contextlib import closing
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+try:
+    from rapidfuzz import process, fuzz
+except ImportError:
+    process = fuzz = None
+
+from ingestao import tokens_descricao, em_reais, formatar_br, formatar_data
+from persistencia import conectar_db
+
+# --- CONCILIAÇÃO REVERSA INTELIGENTE (BENNER -> EXTRATO) ---
+TOL_VALOR_AUTO = 0.05
+DIAS_VALOR_AUTO = 5
+DIAS_NOME_AUTO = 3
+SCORE_NOME_AUTO = 85
+
+class IndiceExtrato:
+    """Índices do extrato pendente: valor absoluto ordenado e data ordenada.
+    As posições seguem a ordem original das linhas, usada como critério de desempate (primeiro match)."""
+    def __init__(self, df):
+        self.hashes = df['ID_HASH'].to_numpy()
+        self.desc = df['DESC_CLEAN'].to_numpy()
+        valores = em_reais(df['VALOR'].abs()).to_numpy(dtype=float)
+        datas = pd.to_datetime(df['DATA'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+        # Linhas sem data nunca casam (a regra de data é obrigatória nas duas tentativas)
+        validas = np.flatnonzero(~np.isnat(datas))
+        self.valores = valores
+        self.datas = datas
+
+        ord_v = validas[np.argsort(valores[validas], kind='stable')]
+        self.pos_por_valor = ord_v
+        self.valores_ord = valores[ord_v]
+
+        ord_d = validas[np.argsort(datas[validas], kind='stable')]
+        self.pos_por_data = ord_d
+        self.datas_ord = datas[ord_d]
+
+    def por_valor(self, valor, tol):
+        # Janela levemente alargada; a regra exata é reaplicada por quem consome
+        i = np.searchsorted(self.valores_ord, valor - tol - 1e-6, side='left')
+        j = np.searchsorted(self.valores_ord, valor + tol + 1e-6, side='right')
+        return self.pos_por_valor[i:j]
+
+    def por_data(self, data, dias):
+        # abs(delta.days) <= dias  <=>  -dias <= delta < dias + 1 (Timedelta.days arredonda para baixo)
+        i = np.searchsorted(self.datas_ord, data - np.timedelta64(dias, 'D'), side='left')
+        j = np.searchsorted(self.datas_ord, data + np.timedelta64(dias + 1, 'D'), side='left')
+        return self.pos_por_data[i:j]
+
+def _dentro_janela(datas, data, dias):
+    delta = datas - data
+    return (delta >= np.timedelta64(-dias, 'D')) & (delta < np.timedelta64(dias + 1, 'D'))
+
+def conciliar_benner_com_extrato(extrato, baixados, pendente=None, idx=None):
+    """Retorna os ID_HASH do extrato que casam com os documentos baixados do Benner.
+    Mesmas regras do primeiro match: valor (±0,05) e data (±5 dias); senão nome similar (>85) e data (±3 dias).
+    `pendente` (máscara das linhas ainda livres) e `idx` (índice já montado sobre `extrato`) permitem reaproveitar
+    o índice do extrato inteiro entre importações em vez de remontá-lo sobre os pendentes."""
+    if extrato.empty or baixados.empty: return []
+    if idx is None: idx = IndiceExtrato(extrato)
+    # Linhas já conciliadas contam como consumidas
+    consumidos = set() if pendente is None else set(idx.hashes[~pendente])
+    ids_para_conciliar = []
+
+    valores_doc = em_reais(baixados['Valor Total']).to_numpy(dtype=float)
+    datas_doc = pd.to_datetime(baixados['Data Baixa'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    nomes_doc = baixados['DESC_CLEAN'].to_numpy()
+
+    for val_doc, data_doc, nome_doc in zip(valores_doc, datas_doc, nomes_doc):
+        if val_doc <= 0 or np.isnat(data_doc): continue
+        candidato_match = None
+
+        # TENTATIVA 1: VALOR EXATO + DATA (5 DIAS)
+        cand = idx.por_valor(val_doc, TOL_VALOR_AUTO)
+        if len(cand):
+            ok = (np.abs(idx.valores[cand] - val_doc) <= TOL_VALOR_AUTO) & _dentro_janela(idx.datas[cand], data_doc, DIAS_VALOR_AUTO)
+            for p in np.sort(cand[ok]):
+                if idx.hashes[p] not in consumidos:
+                    candidato_match = idx.hashes[p]
+                    break
+
+        # TENTATIVA 2: NOME SIMILAR + DATA (3 DIAS)
+        if candidato_match is None and fuzz:
+            for p in np.sort(idx.por_data(data_doc, DIAS_NOME_AUTO)):
+                if idx.hashes[p] in consumidos: continue
+                if fuzz.token_set_ratio(nome_doc, idx.desc[p]) > SCORE_NOME_AUTO:
+                    candidato_match = idx.hashes[p]
+                    break
+
+        if candidato_match is not None:
+            consumidos.add(candidato_match)
+            ids_para_conciliar.append(candidato_match)
+
+    return ids_para_conciliar
+
+# --- BUSCA DE CONCILIAÇÃO (VALOR + NOME) ---
+TOL_VALOR_BUSCA = 0.10
+SCORE_MIN_BUSCA = 70
+
+def pontuar_pares(val_bn, desc_bn, val_ex, desc_ex, progresso=None, workers=-1, cancelar=None):
+    """Pares (documento, linha do extrato) com valor a ±0,10 e similaridade de nome > 70.
+    Os documentos são agrupados em faixas de valor de 0,10 e cada faixa é pontuada com um único process.cdist.
+    Retorna (pos_bn, pos_ex, score) ou None se `cancelar` (threading.Event) for acionado no meio."""
+    vazio = (np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64))
+    if not len(val_bn) or not len(val_ex): return vazio
+    ordem_ex = np.argsort(val_ex, kind='stable')
+    val_ex_ord = val_ex[ordem_ex]
+
+    # Só documentos com alguma linha na faixa de valor (poucos quando um lado é uma importação pequena)
+    com_vizinho = (np.searchsorted(val_ex_ord, val_bn + TOL_VALOR_BUSCA + 1e-6, side='right')
+                   > np.searchsorted(val_ex_ord, val_bn - TOL_VALOR_BUSCA - 1e-6, side='left'))
+    docs = np.flatnonzero(com_vizinho)
+    faixas = np.floor(np.round(val_bn[docs] * 100) / 10)
+    grupos = pd.Series(docs).groupby(faixas, sort=False).indices
+
+    partes = [vazio]
+    for n, idx in enumerate(grupos.values()):
+        if cancelar is not None and cancelar.is_set(): return None
+        if progresso: progresso((n + 1) / len(grupos))
+        pos_bn = docs[idx]
+        v_bn = val_bn[pos_bn]
+        i = np.searchsorted(val_ex_ord, v_bn.min() - TOL_VALOR_BUSCA - 1e-6, side='left')
+        j = np.searchsorted(val_ex_ord, v_bn.max() + TOL_VALOR_BUSCA + 1e-6, side='right')
+        pos_ex = np.sort(ordem_ex[i:j])
+        scores = process.cdist([desc_bn[b] for b in pos_bn], [desc_ex[e] for e in pos_ex],
+                               scorer=fuzz.token_set_ratio, dtype=np.float64, workers=workers)
+        ok = (np.abs(val_ex[pos_ex][None, :] - v_bn[:, None]) <= TOL_VALOR_BUSCA) & (scores > SCORE_MIN_BUSCA)
+        linhas, colunas = np.nonzero(ok)
+        partes.append((pos_bn[linhas], pos_ex[colunas], scores[linhas, colunas]))
+    return tuple(np.concatenate(p) for p in zip(*partes))
+
+def melhor_par_por_documento(pos_bn, pos_ex, score):
+    """Maior score de cada documento; empate fica com a linha que vem primeiro no extrato. Ordenado por documento."""
+    ordem = np.lexsort((pos_ex, -score, pos_bn))
+    pos_bn, pos_ex, score = pos_bn[ordem], pos_ex[ordem], score[ordem]
+    primeiro = np.r_[True, pos_bn[1:] != pos_bn[:-1]] if len(pos_bn) else np.array([], dtype=bool)
+    return pos_bn[primeiro], pos_ex[primeiro], score[primeiro]
+
+def montar_matches(df_ex_robo, df_bn_robo, pos_bn, pos_ex, score):
+    l_ex = df_ex_robo.iloc[pos_ex].to_dict('records')
+    l_bn = df_bn_robo.iloc[pos_bn].to_dict('records')
+    matches = []
+    for bn, best_match, best_score in zip(l_bn, l_ex, score):
+        matches.append({
+            "Extrato Data": formatar_data(best_match['DATA']),
+            "Extrato Desc": best_match['DESCRIÇÃO'],
+            "Extrato Valor": formatar_br(best_match['VALOR'] / 100),
+            "Benner Doc": bn['Número'],
+            "Benner Nome": bn['Nome'],
+            "Score": float(best_score),
+            "Tipo": "1:1",
+            "ID_HASH": best_match['ID_HASH'],
+            "ID_BENNER": bn['ID_BENNER']
+        })
+    return matches
+
+def buscar_matches_valor_nome(df_ex_robo, df_bn_robo, progresso=None, workers=-1, cancelar=None):
+    """Para cada documento Benner, o item do extrato com valor a ±0,10 e maior similaridade de nome (>70),
+    pontuando tudo do zero. Retorna None se cancelado."""
+    if df_ex_robo.empty or df_bn_robo.empty: return []
+    pares = pontuar_pares(em_reais(df_bn_robo['Valor Total']).to_numpy(dtype=float), df_bn_robo['DESC_CLEAN'].tolist(),
+                          em_reais(df_ex_robo['VALOR'].abs()).to_numpy(dtype=float), df_ex_robo['DESC_CLEAN'].tolist(),
+                          progresso, workers, cancelar)
+    if pares is None: return None
+    return montar_matches(df_ex_robo, df_bn_robo, *melhor_par_por_documento(*pares))
+
+# --- CANDIDATOS DE CONCILIAÇÃO (INCREMENTAL) ---
+# Pares já pontuados ficam no banco: cada pesquisa só pontua linhas de extrato ainda não registradas
+# e documentos novos ou alterados. Invariante: todo par (documento registrado, linha registrada) na faixa
+# de valor com score > 70 está em `candidatos`.
+def _assinaturas_benner(df_bn):
+    return df_bn['Valor Total'].astype(str) + "|" + df_bn['DESC_CLEAN'].astype(str)
+
+def _ids_temp(con, tabela, ids):
+    """Preenche a tabela temporária `tabela` (uma coluna id) da conexão com `ids`."""
+    con.execute(f"CREATE TEMP TABLE IF NOT EXISTS {tabela} (id TEXT PRIMARY KEY)")
+    con.execute(f"DELETE FROM {tabela}")
+    con.executemany(f"INSERT OR IGNORE INTO {tabela} VALUES (?)", ((i,) for i in ids))
+
+def _linhas_na_faixa(con, centavos):
+    """Linhas registradas com |valor| perto dos valores (em centavos) informados; a regra exata fica com pontuar_pares."""
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS faixas (ini INTEGER, fim INTEGER)")
+    con.execute("DELETE FROM faixas")
+    folga = int(round(TOL_VALOR_BUSCA * 100)) + 1
+    con.executemany("INSERT INTO faixas VALUES (?, ?)", ((int(c) - folga, int(c) + folga) for c in np.unique(centavos)))
+    return pd.read_sql_query("SELECT DISTINCT l.ID_HASH, l.VALOR_ABS, l.DESC_CLEAN FROM cand_extrato l "
+                             "JOIN faixas f ON l.VALOR_ABS BETWEEN f.ini AND f.fim", con)
+
+def _docs_concorrentes(con, gravadas, docs_novos):
+    """Documentos registrados por outra pesquisa depois da leitura de `gravadas` (valor e nome saem da assinatura)."""
+    agora = pd.read_sql_query("SELECT ID_BENNER, ASSINATURA FROM cand_benner", con)
+    agora = agora[(agora['ID_BENNER'].map(gravadas) != agora['ASSINATURA']).to_numpy()
+                  & ~agora['ID_BENNER'].isin(docs_novos['ID_BENNER']).to_numpy()]
+    partes = agora['ASSINATURA'].str.split("|", n=1, expand=True).reindex(columns=[0, 1])
+    return pd.DataFrame({'ID_BENNER': agora['ID_BENNER'].to_numpy(),
+                         'Valor Total': pd.to_numeric(partes[0]).to_numpy(dtype=np.int64),
+                         'DESC_CLEAN': partes[1].to_numpy()})
+
+def atualizar_candidatos(ex_pendente, bn_pendente, registradas, progresso=None, cancelar=None, workers=-1):
+    """Pontua só o que mudou desde a última pesquisa. `registradas` = ID_HASH que esta sessão já sabe estarem no
+    banco (evita consultar o extrato inteiro a cada vez); é atualizado no fim. Retorna False se cancelado."""
+    novas = ex_pendente[~ex_pendente['ID_HASH'].isin(registradas)]
+    with closing(conectar_db()) as con:
+        if len(novas):
+            _ids_temp(con, "ids_novos", novas['ID_HASH'])
+            ja = pd.read_sql_query("SELECT ID_HASH FROM cand_extrato WHERE ID_HASH IN (SELECT id FROM ids_novos)", con)
+            novas = novas[~novas['ID_HASH'].isin(ja['ID_HASH'])].drop_duplicates('ID_HASH')
+        gravadas = pd.read_sql_query("SELECT ID_BENNER, ASSINATURA FROM cand_benner", con).set_index('ID_BENNER')['ASSINATURA']
+        assinaturas = _assinaturas_benner(bn_pendente)
+        alterados = (bn_pendente['ID_BENNER'].map(gravadas) != assinaturas).to_numpy()
+        docs_novos, docs_antigos = bn_pendente[alterados], bn_pendente[~alterados]
+        linhas_docs = _linhas_na_faixa(con, docs_novos['Valor Total'].to_numpy()) if len(docs_novos) else None
+
+    # 1) Linhas novas x documentos já registrados (e sem alteração)
+    val_novas = em_reais(novas['VALOR'].abs()).to_numpy(dtype=float)
+    pares_a = pontuar_pares(em_reais(docs_antigos['Valor Total']).to_numpy(dtype=float), docs_antigos['DESC_CLEAN'].tolist(),
+                            val_novas, novas['DESC_CLEAN'].tolist(), progresso, workers, cancelar)
+    if pares_a is None: return False
+    # 2) Documentos novos/alterados x todas as linhas registradas na faixa de valor (mais as novas)
+    if linhas_docs is not None:
+        linhas = pd.concat([linhas_docs[['ID_HASH', 'DESC_CLEAN']].assign(VALOR=linhas_docs['VALOR_ABS']),
+                            novas[['ID_HASH', 'DESC_CLEAN', 'VALOR']]], ignore_index=True)
+        pares_b = pontuar_pares(em_reais(docs_novos['Valor Total']).to_numpy(dtype=float), docs_novos['DESC_CLEAN'].tolist(),
+                                em_reais(linhas['VALOR'].abs()).to_numpy(dtype=float), linhas['DESC_CLEAN'].tolist(),
+                                progresso, workers, cancelar)
+        if pares_b is None: return False
+    else:
+        linhas, pares_b = novas, tuple(p[:0] for p in pares_a)
+
+    def pontuar(docs, lin):
+        return pontuar_pares(em_reais(docs['Valor Total']).to_numpy(dtype=float), docs['DESC_CLEAN'].tolist(),
+                             em_reais(lin['VALOR'].abs()).to_numpy(dtype=float), lin['DESC_CLEAN'].tolist(), workers=workers)
+
+    def tuplas(docs, lin, pares):
+        b, e, sc = pares
+        return zip(docs['ID_BENNER'].to_numpy()[b], lin['ID_HASH'].to_numpy()[e], sc.tolist())
+
+    # Documentos que saíram dos pendentes (conciliados, excluídos) deixam de ser mantidos; se voltarem, são pontuados de novo
+    saidos = gravadas.index.difference(bn_pendente['ID_BENNER'])
+    with closing(conectar_db()) as con, con:
+        # Trava de escrita antes de conferir o que outra pesquisa gravou depois da leitura acima:
+        # sem isso, um documento novo dela e uma linha nova desta nunca seriam pontuados juntos
+        con.execute("BEGIN IMMEDIATE")
+        pares_extra = []
+        if len(docs_novos):
+            tardias = _linhas_na_faixa(con, docs_novos['Valor Total'].to_numpy())
+            tardias = tardias[~tardias['ID_HASH'].isin(linhas['ID_HASH'])]
+            if len(tardias):
+                tardias = tardias.rename(columns={'VALOR_ABS': 'VALOR'})
+                pares_extra.append((docs_novos, tardias, pontuar(docs_novos, tardias)))
+        if len(novas):
+            concorrentes = _docs_concorrentes(con, gravadas, docs_novos)
+            if len(concorrentes): pares_extra.append((concorrentes, novas, pontuar(concorrentes, novas)))
+
+        con.executemany("INSERT OR IGNORE INTO cand_extrato VALUES (?, ?, ?)",
+                        zip(novas['ID_HASH'], novas['VALOR'].abs().tolist(), novas['DESC_CLEAN']))
+        con.executemany("DELETE FROM candidatos WHERE ID_BENNER=?", ((i,) for i in docs_novos['ID_BENNER'].tolist() + saidos.tolist()))
+        con.executemany("DELETE FROM cand_benner WHERE ID_BENNER=?", ((i,) for i in saidos))
+        sql = ("INSERT INTO candidatos (ID_BENNER, ID_HASH, SCORE) VALUES (?, ?, ?) "
+               "ON CONFLICT(ID_BENNER, ID_HASH) DO UPDATE SET SCORE=excluded.SCORE")
+        con.executemany(sql, tuplas(docs_antigos, novas, pares_a))
+        con.executemany(sql, tuplas(docs_novos, linhas, pares_b))
+        for docs, lin, pares in pares_extra: con.executemany(sql, tuplas(docs, lin, pares))
+        con.executemany("INSERT INTO cand_benner VALUES (?, ?) ON CONFLICT(ID_BENNER) DO UPDATE SET ASSINATURA=excluded.ASSINATURA",
+                        zip(docs_novos['ID_BENNER'], assinaturas[alterados]))
+    registradas.update(ex_pendente['ID_HASH'])
+    return True
+
+def melhores_candidatos(df_ex_robo, df_bn_robo):
+    """Melhor par ainda em aberto (nem confirmado nem rejeitado) de cada documento, dentro do escopo da tela."""
+    if df_ex_robo.empty or df_bn_robo.empty: return []
+    with closing(conectar_db()) as con:
+        _ids_temp(con, "ids_tela", df_bn_robo['ID_BENNER'])
+        cand = pd.read_sql_query("SELECT c.ID_BENNER, c.ID_HASH, c.SCORE FROM candidatos c JOIN ids_tela t ON c.ID_BENNER = t.id "
+                                 "WHERE c.SITUACAO IS NULL", con)
+    pos_bn = pd.Index(df_bn_robo['ID_BENNER']).get_indexer(cand['ID_BENNER'])
+    pos_ex = pd.Index(df_ex_robo['ID_HASH']).get_indexer(cand['ID_HASH'])
+    ok = (pos_bn >= 0) & (pos_ex >= 0)
+    pares = (pos_bn[ok].astype(np.int64), pos_ex[ok].astype(np.int64), cand['SCORE'].to_numpy(dtype=float)[ok])
+    return montar_matches(df_ex_robo, df_bn_robo, *melhor_par_por_documento(*pares))
+
+def marcar_candidatos(pares, situacao):
+    """Confirma ou rejeita pares (ID_BENNER, ID_HASH): não voltam a ser sugeridos."""
+    with closing(conectar_db()) as con, con:
+        con.executemany("UPDATE candidatos SET SITUACAO=? WHERE ID_BENNER=? AND ID_HASH=?", ((situacao, b, h) for b, h in pares))
+
+# --- PAGAMENTOS AGRUPADOS (SUBSET-SUM) ---
+# O que sobra do 1:1: várias linhas do extrato pagando um documento (N:1) ou uma linha quitando vários
+# documentos (1:N). Mesma similaridade de nome (>70) e tolerância de valor; datas a até JANELA_DIAS_GRUPO.
+MAX_PARCELAS = 4           # itens por grupo
+MAX_CANDIDATOS_GRUPO = 24  # itens considerados por alvo (os de maior score)
+JANELA_DIAS_GRUPO = 7
+
+@lru_cache(maxsize=32)
+def _metades(m, h):
+    """Subconjuntos de 1 a h posições entre m itens: posições (preenchidas com m), menor, maior e tamanho."""
+    comb = [c for t in range(1, h + 1) for c in combinations(range(m), t)]
+    pos = np.full((len(comb), h), m, dtype=np.int64)
+    for i, c in enumerate(comb): pos[i, :len(c)] = c
+    tam = (pos < m).sum(axis=1)
+    return pos, pos[:, 0], pos[np.arange(len(pos)), tam - 1], tam
+
+def melhor_subconjunto(valores, scores, alvo, tol, k=MAX_PARCELAS):
+    """Posições de 2 a k itens cuja soma fica a ±tol do alvo (tudo em centavos), ou None.
+    Meet-in-the-middle: metades de até ceil(k/2) itens casadas por busca binária na soma ordenada; a metade
+    da direita começa depois da última posição da esquerda, então cada par é disjunto.
+    Preferência: menor diferença, depois menos itens, depois maior score médio."""
+    m = len(valores)
+    if m < 2 or valores.sum() < alvo - tol: return None
+    pos, menor, maior, tam = _metades(m, -(-k // 2))
+    soma = np.append(valores, 0)[pos].sum(axis=1)
+    ordem = np.argsort(soma, kind='stable')
+    soma_ord = soma[ordem]
+    ini = np.searchsorted(soma_ord, alvo - tol - soma, side='left')
+    qtd = np.searchsorted(soma_ord, alvo + tol - soma, side='right') - ini
+    if not qtd.any(): return None
+    esq = np.repeat(np.arange(len(pos)), qtd)
+    dir_ = ordem[np.repeat(ini - (np.cumsum(qtd) - qtd), qtd) + np.arange(qtd.sum())]
+    ok = (maior[esq] < menor[dir_]) & (tam[esq] + tam[dir_] <= k)
+    if not ok.any(): return None
+    esq, dir_ = esq[ok], dir_[ok]
+    sc = np.append(scores, 0.0)[pos].sum(axis=1)
+    n = tam[esq] + tam[dir_]
+    melhor = np.lexsort((-(sc[esq] + sc[dir_]) / n, n, np.abs(soma[esq] + soma[dir_] - alvo)))[0]
+    escolhidas = np.r_[pos[esq[melhor]], pos[dir_[melhor]]]
+    return escolhidas[escolhidas < m]
+
+def _unicos_por_tokens(desc):
+    """Valores únicos pela forma tokenizada (mesmo score no token_set_ratio, menos strings para pontuar).
+    Retorna (únicos, posição de cada elemento neles, posição de cada elemento nos valores originais ordenados)."""
+    u, inv = np.unique(desc, return_inverse=True)
+    u_tok, inv_tok = np.unique(np.array([tokens_descricao(d) for d in u], dtype=object), return_inverse=True)
+    return u_tok, inv_tok[inv], inv
+
+def _pares_por_nome(desc_bn, desc_ex, d_bn, d_ex, cancelar=None):
+    """Pares (documento, linha do extrato) com datas a até JANELA_DIAS_GRUPO dias e similaridade > 70.
+    Cada nome de documento (entre os únicos) só é pontuado contra as descrições das linhas na janela de data
+    dos seus documentos, não contra o extrato inteiro. Datas vazias nunca casam.
+    Ordem: documento, descrição do extrato em ordem alfabética, linha (é o que desempata os grupos)."""
+    u_bn, inv_bn, _ = _unicos_por_tokens(desc_bn)
+    u_ex, inv_ex, ordem_ex = _unicos_por_tokens(desc_ex)
+    por_data = np.flatnonzero(~np.isnat(d_ex))
+    por_data = por_data[np.argsort(d_ex[por_data], kind='stable')]
+    d_ord, nome_ord = d_ex[por_data], inv_ex[por_data]
+    com_data = np.flatnonzero(~np.isnat(d_bn))
+    janela = np.timedelta64(JANELA_DIAS_GRUPO, 'D')
+    ini = np.searchsorted(d_ord, d_bn[com_data] - janela, side='left')
+    fim = np.searchsorted(d_ord, d_bn[com_data] + janela, side='right')
+    partes = [(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64))]
+    for n, (nome, idx) in enumerate(pd.Series(com_data).groupby(inv_bn[com_data], sort=True).indices.items()):
+        if cancelar is not None and n % 64 == 0 and cancelar.is_set(): return None
+        na_janela = np.zeros(len(u_ex), dtype=bool)
+        for i, f in zip(ini[idx], fim[idx]): na_janela[nome_ord[i:f]] = True
+        nomes_ex = np.flatnonzero(na_janela)
+        if not len(nomes_ex): continue
+        scores = process.cdist([u_bn[nome]], u_ex[nomes_ex], scorer=fuzz.token_set_ratio, dtype=np.float64,
+                               score_cutoff=SCORE_MIN_BUSCA)[0]
+        ok = scores > SCORE_MIN_BUSCA
+        partes.append((np.full(ok.sum(), nome), nomes_ex[ok], scores[ok]))
+    nomes = pd.DataFrame(dict(zip(("nome_bn", "nome_ex", "SCORE"), (np.concatenate(p) for p in zip(*partes)))))
+    docs = pd.DataFrame({"doc": com_data, "nome_bn": inv_bn[com_data]})
+    linhas = pd.DataFrame({"linha": np.arange(len(inv_ex)), "nome_ex": inv_ex})
+    pares = docs.merge(nomes, on="nome_bn").merge(linhas, on="nome_ex")[["doc", "linha", "SCORE"]]
+    dias = np.abs((d_ex[pares["linha"]] - d_bn[pares["doc"]]).astype(np.int64))
+    pares = pares[~np.isnat(d_ex[pares["linha"]]) & (dias <= JANELA_DIAS_GRUPO)]
+    return pares.iloc[np.lexsort((pares["linha"], ordem_ex[pares["linha"]], pares["doc"]))].reset_index(drop=True)
+
+def _grupos(alvo, item, valor_alvo, valor_item, score, sinal, tol, usado_alvo, usado_item):
+    """Percorre os alvos (documento no N:1, linha no 1:N) e escolhe, entre os itens ainda livres, o melhor
+    subconjunto que soma o valor do alvo. Entradas alinhadas por par; `usado_*` são máscaras por posição,
+    atualizadas aqui. Itens de sinais diferentes nunca entram no mesmo grupo."""
+    ok = valor_item <= valor_alvo + tol
+    ordem = np.flatnonzero(ok)[np.lexsort((-score[ok], sinal[ok], alvo[ok]))]
+    alvo, item, valor_alvo, valor_item, score, sinal = (a[ordem] for a in (alvo, item, valor_alvo, valor_item, score, sinal))
+    quebras = np.flatnonzero(np.r_[True, (alvo[1:] != alvo[:-1]) | (sinal[1:] != sinal[:-1]), True])
+    achados = []
+    for ini, fim in zip(quebras[:-1], quebras[1:]):
+        if fim - ini < 2 or usado_alvo[alvo[ini]]: continue
+        fatia = np.arange(ini, fim)
+        fatia = fatia[~usado_item[item[fatia]]][:MAX_CANDIDATOS_GRUPO]  # já ordenados por score
+        esc = melhor_subconjunto(valor_item[fatia], score[fatia], int(valor_alvo[ini]), tol)
+        if esc is None: continue
+        usado_alvo[alvo[ini]] = True
+        usado_item[item[fatia[esc]]] = True
+        achados.append((alvo[ini], item[fatia[esc]], score[fatia[esc]].mean()))
+    return achados
+
+def _linha_agrupada(tipo, ex, bn, score):
+    return {
+        "Extrato Data": ", ".join(dict.fromkeys(formatar_data(d) for d in ex['DATA'])),
+        "Extrato Desc": " + ".join(ex['DESCRIÇÃO'].astype(str)),
+        "Extrato Valor": formatar_br(ex['VALOR'].sum() / 100),
+        "Benner Doc": " + ".join(bn['Número'].astype(str)),
+        "Benner Nome": " + ".join(dict.fromkeys(bn['Nome'].astype(str))),
+        "Score": float(score),
+        "Tipo": tipo,
+        "ID_HASH": tuple(ex['ID_HASH']),
+        "ID_BENNER": tuple(bn['ID_BENNER'])
+    }
+
+def buscar_agrupados(df_ex, df_bn, cancelar=None):
+    """Matches N:1 e 1:N entre linhas e documentos que o 1:1 não usou. `df_bn` já com DESC_CLEAN.
+    Retorna None se cancelado."""
+    # Como no 1:1, documento sem valor positivo não entra em grupo (nem como alvo, nem como parcela)
+    df_bn = df_bn[df_bn['Valor Total'].to_numpy() > 0]
+    if df_ex.empty or df_bn.empty: return []
+    d_bn = df_bn['Data Baixa'].fillna(df_bn['Data de Vencimento']).to_numpy(dtype='datetime64[D]')
+    d_ex = df_ex['DATA'].to_numpy(dtype='datetime64[D]')
+    pares = _pares_por_nome(df_bn['DESC_CLEAN'].astype(str).to_numpy(), df_ex['DESC_CLEAN'].astype(str).to_numpy(),
+                            d_bn, d_ex, cancelar)
+    if pares is None: return None
+    doc, linha, score = (pares[c].to_numpy() for c in ("doc", "linha", "SCORE"))
+    val_ex = df_ex['VALOR'].to_numpy(dtype=np.int64)[linha]
+    val_bn = df_bn['Valor Total'].to_numpy(dtype=np.int64)[doc]
+    tol = int(round(TOL_VALOR_BUSCA * 100))
+    usado_doc, usado_linha = np.zeros(len(df_bn), dtype=bool), np.zeros(len(df_ex), dtype=bool)
+
+    # N:1 — várias linhas pagando um documento
+    n1 = _grupos(doc, linha, val_bn, np.abs(val_ex), score, np.sign(val_ex), tol, usado_doc, usado_linha)
+    if cancelar is not None and cancelar.is_set(): return None
+    # 1:N — uma linha quitando vários documentos
+    um_n = _grupos(linha, doc, np.abs(val_ex), val_bn, score, np.zeros_like(doc), tol, usado_linha, usado_doc)
+
+    matches = [_linha_agrupada("N:1", df_ex.iloc[itens], df_bn.iloc[[alvo]], sc) for alvo, itens, sc in n1]
+    matches += [_linha_agrupada("1:N", df_ex.iloc[[alvo]], df_bn.iloc[itens], sc) for alvo, itens, sc in um_n]
+    return matches
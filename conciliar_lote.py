@@ -0,0 +1,147 @@
+"""Conciliação em lote, sem navegador (para rodar à noite, ex.: pelo cron).
+
+    python conciliar_lote.py PASTA [--saida relatorio.xlsx] [--processos 4] [--conflitos manter|substituir]
+
+Lê da PASTA os extratos e as exportações do Benner (arquivos com "benner" no nome) e faz o mesmo que o app:
+grava a base Benner, arquiva as linhas dos extratos (Parquet por mês/banco, o mesmo arquivo que a
+Busca Extrato do app lê), concilia no histórico o que casa com os documentos baixados e pontua os candidatos
+valor + nome, um processo por banco/mês do extrato. As sugestões vão para o banco (a pesquisa da aba de
+conciliação as encontra já pontuadas) e para o relatório.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ingestao import (
+    processar_arquivo_extrato, processar_arquivo_benner, tipar_extrato, classificar_benner,
+    EXTENSOES_EXTRATO, EXTENSOES_BENNER,
+)
+from exportacao import FORMATOS, exportar_bytes
+from persistencia import (
+    inicializar_db, load_hist_extrato, save_hist_extrato, aplicar_historico, momento_conciliacao,
+    load_db_benner, gravar_db_benner, hashes_benner,
+)
+from conciliacao import conciliar_benner_com_extrato, atualizar_candidatos, melhores_candidatos, buscar_agrupados
+from arquivo_extrato import arquivar_extrato, DIR_ARQUIVO
+
+MARCADOR_BENNER = "benner"
+
+def _extensao(nome):
+    return os.path.splitext(nome)[1].lower().lstrip(".")
+
+def listar_arquivos(pasta):
+    """(extratos, arquivos do Benner) da pasta, com as mesmas extensões que o upload do app aceita."""
+    nomes = sorted(n for n in os.listdir(pasta) if not n.startswith("~$"))
+    benner = [n for n in nomes if MARCADOR_BENNER in n.lower() and _extensao(n) in EXTENSOES_BENNER]
+    extratos = [n for n in nomes if MARCADOR_BENNER not in n.lower() and _extensao(n) in EXTENSOES_EXTRATO]
+    return extratos, benner
+
+def _ler(funcao, pasta, nome):
+    with open(os.path.join(pasta, nome), "rb") as f:
+        return funcao(nome, f.read())
+
+def ler_arquivos(pool, pasta, nomes, funcao):
+    """Lê os arquivos em paralelo; devolve os DataFrames lidos e imprime os que falharam."""
+    futuros = [(n, pool.submit(_ler, funcao, pasta, n)) for n in nomes]
+    lidos = []
+    for nome, fut in futuros:
+        try: df = fut.result()
+        except Exception as e:
+            print(f"  ! {nome}: {e}", file=sys.stderr)
+            continue
+        if df is None: print(f"  ! {nome}: colunas de data e valor não encontradas.", file=sys.stderr)
+        else: lidos.append(df)
+    return lidos
+
+def importar_benner(df_new, extrato, conflitos):
+    """Mesmo fluxo do upload no app: grava os documentos novos (e os alterados, se `conflitos` = substituir)
+    e concilia no extrato o que casa com os baixados. Documentos iguais aos do banco (mesmo hash) ficam de fora.
+    Retorna (documentos gravados, linhas conciliadas, documentos sem alteração)."""
+    novos, alterados, iguais = classificar_benner(df_new, hashes_benner())
+    entram = pd.concat([novos, alterados], ignore_index=True) if conflitos == "substituir" else novos
+    if entram.empty: return 0, 0, iguais
+    db = load_db_benner()
+    base = db[~db['ID_BENNER'].isin(entram['ID_BENNER'])]
+    gravar_db_benner(pd.concat([base, entram], ignore_index=True), alterados=entram)
+
+    pendente = ~extrato['CONCILIADO'].to_numpy(dtype=bool)
+    baixados = entram[entram['Data Baixa'].notna()]
+    if not pendente.any() or baixados.empty: return len(entram), 0, iguais
+    ids = conciliar_benner_com_extrato(extrato, baixados, pendente)
+    if ids:
+        mask = extrato['ID_HASH'].isin(ids)
+        extrato.loc[mask, 'CONCILIADO'] = True
+        extrato.loc[mask, 'DATA_CONCILIACAO'] = momento_conciliacao()
+        save_hist_extrato(extrato[mask])
+    return len(entram), len(ids), iguais
+
+def pontuar_particao(ex_particao, bn_pendente):
+    # Roda num processo: só linhas novas do banco/mês x documentos já registrados (nenhum documento
+    # alterado aqui, então processos diferentes nunca reescrevem os mesmos candidatos)
+    atualizar_candidatos(ex_particao, bn_pendente, set(), workers=1)
+    return len(ex_particao)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conciliação em lote dos extratos com a base Benner.")
+    parser.add_argument("pasta", help="pasta com os extratos e as exportações do Benner")
+    parser.add_argument("--saida", default=f"conciliacao_{time.strftime('%Y%m%d')}.xlsx",
+                        help=f"relatório de sugestões ({', '.join(FORMATOS)}, pela extensão)")
+    parser.add_argument("--processos", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument("--conflitos", choices=["manter", "substituir"], default="manter",
+                        help="documentos do Benner que já estão no banco (padrão: manter os atuais)")
+    args = parser.parse_args(argv)
+    formato = os.path.splitext(args.saida)[1].lower().lstrip(".")
+    if formato not in FORMATOS: parser.error(f"formato do relatório não suportado: {formato}")
+
+    inicio = time.perf_counter()
+    for aviso in inicializar_db(): print(f"  ! {aviso}", file=sys.stderr)
+    nomes_ex, nomes_bn = listar_arquivos(args.pasta)
+    print(f"{len(nomes_ex)} extrato(s), {len(nomes_bn)} arquivo(s) do Benner em {args.pasta}")
+
+    with ProcessPoolExecutor(max_workers=args.processos, mp_context=multiprocessing.get_context("spawn")) as pool:
+        extratos = ler_arquivos(pool, args.pasta, nomes_ex, processar_arquivo_extrato)
+        benners = ler_arquivos(pool, args.pasta, nomes_bn, processar_arquivo_benner)
+        if not extratos:
+            print("Nenhum extrato lido.")
+            return 1
+        extrato = pd.concat(extratos, ignore_index=True).drop_duplicates('ID_HASH')
+        extrato = tipar_extrato(extrato.sort_values(["DATA", "VALOR"], kind="stable").reset_index(drop=True))
+        aplicar_historico(extrato, load_hist_extrato())
+        print(f"Extrato: {len(extrato)} linhas, {int(extrato['CONCILIADO'].sum())} já conciliadas no histórico, "
+              f"{arquivar_extrato(extrato)} nova(s) no arquivo ({DIR_ARQUIVO})")
+
+        for nome, df_new in zip(nomes_bn, benners):
+            gravados, conciliados, iguais = importar_benner(df_new, extrato, args.conflitos)
+            print(f"Benner {nome}: {gravados} documento(s) gravado(s), {iguais} sem alteração, "
+                  f"{conciliados} linha(s) conciliada(s) no extrato")
+
+        ex_pendente = extrato[~extrato['CONCILIADO'].to_numpy(dtype=bool)]
+        db = load_db_benner()
+        bn_pendente = db[db['STATUS_CONCILIACAO'] == 'Pendente'].reset_index(drop=True)
+
+        # Documentos novos/alterados primeiro (contra as linhas já registradas), depois as linhas novas
+        # de cada banco/mês em paralelo contra todos os documentos
+        atualizar_candidatos(ex_pendente.iloc[:0], bn_pendente, set())
+        particoes = [g for _, g in ex_pendente.groupby(['BANCO', 'MES_ANO'], observed=True, sort=False)]
+        pontuadas = sum(pool.map(pontuar_particao, particoes, [bn_pendente] * len(particoes)))
+    print(f"Candidatos: {pontuadas} linha(s) pendente(s) em {len(particoes)} banco/mês x {len(bn_pendente)} documento(s)")
+
+    matches = melhores_candidatos(ex_pendente, bn_pendente)
+    livres_ex = ex_pendente[~ex_pendente['ID_HASH'].isin([m['ID_HASH'] for m in matches])]
+    livres_bn = bn_pendente[~bn_pendente['ID_BENNER'].isin([m['ID_BENNER'] for m in matches])]
+    matches += buscar_agrupados(livres_ex, livres_bn)
+    relatorio = pd.DataFrame(matches, columns=["Extrato Data", "Extrato Desc", "Extrato Valor", "Benner Doc",
+                                               "Benner Nome", "Score", "Tipo", "ID_HASH", "ID_BENNER"])
+    with open(args.saida, "wb") as f:
+        f.write(exportar_bytes(relatorio.drop(columns=["ID_HASH", "ID_BENNER"]), formato))
+    por_tipo = relatorio['Tipo'].value_counts().to_dict()
+    print(f"Sugestões: {len(relatorio)} {por_tipo} -> {args.saida} ({time.perf_counter() - inicio:.1f}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Exportação dos dados para download (Excel, CSV ou Parquet).
+
+Sem dependência do Streamlit: o arquivo é escrito em blocos de linhas (openpyxl em modo write-only,
+CSV em pedaços), sem montar a planilha inteira na memória, e guardado em disco pelo token de versão
+dos dados, não por um hash do conteúdo.
+"""
+import os
+import io
+import hashlib
+import threading
+
+from openpyxl import Workbook
+
+from ingestao import aplicar_limite_cache
+
+FORMATOS = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+}
+LINHAS_POR_BLOCO = 50_000
+DIR_EXPORTACOES = ".cache_exportacoes"
+LIMITE_EXPORTACOES_BYTES = 256 * 1024 * 1024
+
+def _blocos(df):
+    for i in range(0, len(df), LINHAS_POR_BLOCO):
+        yield df.iloc[i:i + LINHAS_POR_BLOCO]
+
+def _escrever_xlsx(df, arquivo):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([str(c) for c in df.columns])
+    for bloco in _blocos(df):
+        # Células vazias (NaN/NaT) como None; categorias e strings pyarrow viram objetos Python
+        bloco = bloco.astype(object)
+        for linha in bloco.where(bloco.notna(), None).itertuples(index=False, name=None):
+            ws.append(linha)
+    wb.save(arquivo)
+
+def _escrever_csv(df, arquivo):
+    # Padrão brasileiro (;, vírgula decimal) e BOM para o Excel reconhecer o UTF-8
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    for n, bloco in enumerate(_blocos(df)):
+        bloco.to_csv(texto, sep=";", decimal=",", index=False, header=(n == 0))
+    if df.empty: df.to_csv(texto, sep=";", decimal=",", index=False)
+    texto.flush()
+    texto.detach()
+
+def _escrever_parquet(df, arquivo):
+    df.to_parquet(arquivo, index=False, row_group_size=LINHAS_POR_BLOCO)
+
+ESCRITORES = {"xlsx": _escrever_xlsx, "csv": _escrever_csv, "parquet": _escrever_parquet}
+
+def exportar_bytes(df, formato="xlsx"):
+    """Arquivo completo em memória; para tabelas pequenas (ex.: resultado de uma pesquisa)."""
+    saida = io.BytesIO()
+    ESCRITORES[formato](df, saida)
+    return saida.getvalue()
+
+def _caminho_exportacao(token, formato):
+    nome = hashlib.blake2b(repr(token).encode(), digest_size=16).hexdigest()
+    return os.path.join(DIR_EXPORTACOES, f"{nome}.{formato}")
+
+def exportar_em_cache(token, formato, gerar):
+    """Bytes do arquivo exportado. `token` identifica a versão dos dados e os filtros (barato de montar);
+    `gerar` só é chamado se esse token ainda não foi exportado neste formato."""
+    caminho = _caminho_exportacao(token, formato)
+    if not os.path.exists(caminho):
+        os.makedirs(DIR_EXPORTACOES, exist_ok=True)
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f: ESCRITORES[formato](gerar(), f)
+            os.replace(tmp, caminho)  # atômico: outro clique nunca lê arquivo pela metade
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+        aplicar_limite_cache(LIMITE_EXPORTACOES_BYTES, DIR_EXPORTACOES, tuple(f".{f}" for f in FORMATOS))
+    else:
+        try: os.utime(caminho)  # LRU pela data de modificação, como o cache de uploads
+        except OSError: pass
+    with open(caminho, "rb") as f:
+        return f.read()
@@ -0,0 +1,551 @@
+"""Leitura e normalização dos arquivos importados (extratos e Benner).
+
+Funções sem dependência do Streamlit: rodam em processos separados na importação de vários arquivos.
+"""
+import os
+import re
+import csv
+import zipfile
+import hashlib
+import itertools
+import threading
+from io import BytesIO
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from openpyxl.utils.exceptions import InvalidFileException
+
+# --- NORMALIZAÇÃO ---
+TERMOS_DESCRICAO = ["PIX", "TED", "DOC", "TRANSF", "PGTO", "PAGAMENTO", "ENVIO", "CREDITO", "DEBITO", "EM CONTA"]
+RE_NAO_ALFANUM = re.compile(r'[^A-Z0-9\s]')
+CACHE_DESCRICOES = 1 << 16  # textos distintos lembrados por processo (nomes de fornecedor se repetem muito)
+
+@lru_cache(maxsize=CACHE_DESCRICOES, typed=True)
+def limpar_descricao(texto):
+    texto = str(texto).upper()
+    # Um termo pode surgir ao remover outro: a remoção segue a ordem da lista, termo a termo
+    for t in TERMOS_DESCRICAO: texto = texto.replace(t, "")
+    return RE_NAO_ALFANUM.sub(' ', texto).strip()
+
+@lru_cache(maxsize=CACHE_DESCRICOES)
+def tokens_descricao(desc):
+    """Tokens distintos da descrição limpa, em ordem alfabética. O token_set_ratio só olha o conjunto de tokens:
+    o score não muda, e descrições que diferem só na ordem ou nos espaços viram a mesma string."""
+    return " ".join(sorted(set(desc.split())))
+
+def converter_valor(valor):
+    if pd.isna(valor) or valor == "": return 0.0
+    v = str(valor).strip().upper()
+    sinal = -1.0 if '-' in v else 1.0
+    v = v.replace('R$', '').replace(' ', '').replace('-', '')
+    # Se houver ponto e vírgula, trata formato brasileiro (1.000,00)
+    if ',' in v and '.' in v:
+        v = v.replace('.', '').replace(',', '.')
+    elif ',' in v:
+        v = v.replace(',', '.')
+    try: return float(v) * sinal
+    except: return 0.0
+
+def gerar_hash(row):
+    return hashlib.md5(f"{row['DATA']}{row['VALOR']}{row['DESCRIÇÃO']}{row['BANCO']}{row['OCORRENCIA']}".encode()).hexdigest()
+
+def formatar_br(valor):
+    try: return f"R$ {float(valor):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except: return "R$ 0,00"
+
+def formatar_data(dt):
+    try: return pd.to_datetime(dt).strftime("%d/%m/%Y")
+    except: return ""
+
+# --- VERSÕES VETORIZADAS (coluna inteira de uma vez, mesmos resultados das funções acima) ---
+RE_NUMERO_SIMPLES = re.compile(r'\d+(?:\.\d*)?|\.\d+')
+
+def limpar_descricoes(serie):
+    # Uma chamada (memoizada) por texto distinto, espalhada de volta para as linhas
+    codigos, unicos = pd.factorize(serie.astype(object).map(str))
+    limpos = np.array([limpar_descricao(u) for u in unicos], dtype=object)
+    return pd.Series(limpos[codigos], index=serie.index, dtype=str)
+
+def converter_valores(serie, decimal=None):
+    """converter_valor para uma coluna inteira. Casos fora do padrão caem na função escalar.
+    decimal='.' (detectado no arquivo) trata '1,234.56' como milhar com vírgula em vez do padrão brasileiro."""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        out = serie.astype(float).fillna(0.0)
+        # str(float) em notação científica ('1e-05') passa por outras regras em converter_valor
+        exot = (out != 0) & ((out.abs() < 1e-4) | (out.abs() >= 1e16))
+        if exot.any(): out[exot] = serie[exot].map(converter_valor)
+        return out
+    out = np.zeros(len(serie))
+    validos = ~(serie.isna() | (serie.astype(object) == "")).to_numpy()
+    txt = serie[validos].astype(object).map(str).str.strip().str.upper()
+    negativo = txt.str.contains('-', regex=False).to_numpy()
+    txt = txt.str.replace('R$', '', regex=False).str.replace(' ', '', regex=False).str.replace('-', '', regex=False)
+    ambos = txt.str.contains(',', regex=False) & txt.str.contains('.', regex=False)
+    if decimal == '.':
+        txt = txt.where(~ambos, txt.str.replace(',', '', regex=False))
+    else:
+        # Formato brasileiro (1.000,00): remove milhar e troca a vírgula decimal
+        txt = txt.where(~ambos, txt.str.replace('.', '', regex=False))
+    txt = txt.str.replace(',', '.', regex=False)
+    simples = txt.str.fullmatch(RE_NUMERO_SIMPLES).fillna(False).to_numpy(dtype=bool)
+    conv = np.zeros(len(txt))
+    conv[simples] = txt[simples].astype(float).to_numpy() * np.where(negativo[simples], -1.0, 1.0)
+    # Demais casos passam pela função escalar (que assume o padrão brasileiro)
+    resto = ~simples
+    if decimal == '.': resto &= ~ambos.to_numpy(dtype=bool)
+    if resto.any(): conv[resto] = serie[validos][resto].map(converter_valor).to_numpy(dtype=float)
+    out[validos] = conv
+    return pd.Series(out, index=serie.index)
+
+def formatar_datas(serie, fmt):
+    # Extratos têm poucas datas distintas: formata cada uma só uma vez
+    codigos, unicos = pd.factorize(serie)
+    txt = np.append(pd.DatetimeIndex(unicos).strftime(fmt).to_numpy(dtype=object), np.nan)
+    return pd.Series(txt[codigos], index=serie.index)
+
+def _texto_hash(serie):
+    # Mesmo texto que f"{valor}" produz em gerar_hash para cada elemento
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        if getattr(serie.dt, 'tz', None) is not None: return serie.astype(object).map(str)
+        txt = formatar_datas(serie, '%Y-%m-%d %H:%M:%S')
+        frac = serie.notna() & ((serie.dt.microsecond != 0) | (serie.dt.nanosecond != 0))
+        if frac.any(): txt[frac] = serie[frac].map(str)
+        return txt.fillna('NaT')
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(str).fillna('nan').astype(object)
+    return serie.astype(object).map(str)
+
+def gerar_hashes(df):
+    """gerar_hash em lote: monta a chave concatenada da coluna inteira e aplica md5."""
+    chave = _texto_hash(df['DATA']) + _texto_hash(df['VALOR']) + _texto_hash(df['DESCRIÇÃO']) + _texto_hash(df['BANCO']) + _texto_hash(df['OCORRENCIA'])
+    md5 = hashlib.md5
+    return pd.Series([md5(k.encode()).hexdigest() for k in chave], index=df.index)
+
+# --- ESQUEMA EM MEMÓRIA ---
+# Tipos aplicados uma vez, na carga: colunas repetidas como categoria, dinheiro em centavos (int64),
+# datas como datetime e textos em strings pyarrow. Formatação (R$, dd/mm/aaaa) só na exibição.
+try: TIPO_TEXTO = pd.StringDtype("pyarrow", na_value=np.nan)  # mesma semântica de NaN das colunas object
+except (ImportError, TypeError): TIPO_TEXTO = object
+TIPO_MOVIMENTO = pd.CategoricalDtype(["CRÉDITO", "DÉBITO"])
+TIPO_STATUS = pd.CategoricalDtype(["Pendente", "Conciliado"])
+
+def para_centavos(serie):
+    return pd.Series(np.round(serie.astype(float).fillna(0.0).to_numpy() * 100).astype(np.int64), index=serie.index)
+
+def em_reais(serie):
+    return serie / 100
+
+COLS_DINHEIRO = ["VALOR", "Valor Total"]  # guardadas em centavos (int64)
+
+def para_exibicao(df):
+    # Centavos -> reais só na hora de mostrar ou exportar
+    return df.assign(**{c: em_reais(df[c]) for c in COLS_DINHEIRO if c in df.columns})
+
+def _categoria_texto(serie):
+    # Categorias sempre texto: códigos de banco numéricos (1, 237) viram '1', '237', como nos nomes das
+    # partições do arquivo de extratos. Só as categorias são convertidas, não as linhas
+    serie = serie.astype("category")
+    texto = serie.cat.categories.map(str)
+    if texto.has_duplicates: return serie.astype(str).where(serie.notna()).astype("category")  # ex.: 1 e '1' juntos
+    return serie.cat.rename_categories(texto)
+
+def tipar_extrato(df):
+    """Aplica o esquema ao extrato (idempotente: reaplicado depois de juntar arquivos, que desfaz categorias)."""
+    for c in ["BANCO", "MES_ANO"]: df[c] = _categoria_texto(df[c])
+    df["TIPO"] = df["TIPO"].astype(TIPO_MOVIMENTO)
+    for c in ["DESCRIÇÃO", "DESC_CLEAN", "ID_HASH"]: df[c] = df[c].astype(TIPO_TEXTO)
+    df["CONCILIADO"] = df["CONCILIADO"].astype(bool)
+    df["DATA_CONCILIACAO"] = pd.to_datetime(df["DATA_CONCILIACAO"], errors='coerce')
+    return df
+
+def tipar_benner(df):
+    """Aplica o esquema à base Benner ('Valor Total' já em centavos)."""
+    for c in ['Número', 'Nome', 'CNPJ/CPF', 'ID_BENNER', 'DESC_CLEAN']: df[c] = df[c].astype(TIPO_TEXTO)
+    df['Tipo do Documento'] = df['Tipo do Documento'].astype("category")
+    df['STATUS_CONCILIACAO'] = df['STATUS_CONCILIACAO'].astype(TIPO_STATUS)
+    for c in ['Data de Vencimento', 'Data Baixa']: df[c] = pd.to_datetime(df[c], errors='coerce')
+    df['Valor Total'] = df['Valor Total'].astype(np.int64)
+    return df
+
+# --- LEITURA DE CSV (DETECÇÃO RÁPIDA + BLOCOS) ---
+TAM_AMOSTRA_CSV = 64 * 1024
+LINHAS_POR_BLOCO = 100_000
+ENCODINGS_CSV = ["utf-8-sig", "cp1252", "latin-1"]
+RE_VALOR_BR = re.compile(r'(?<![\d.,])-?\d{1,3}(?:\.\d{3})*,\d{2}(?![\d,])')
+RE_VALOR_US = re.compile(r'(?<![\d.,])-?\d{1,3}(?:,\d{3})*\.\d{2}(?![\d.])')
+
+def detectar_formato_csv(amostra):
+    """Detecta encoding, separador e estilo decimal olhando só os primeiros KB do arquivo."""
+    encoding, texto = "latin-1", None
+    for enc in ENCODINGS_CSV:
+        try:
+            # A amostra pode cortar um caractere multibyte no fim: ignora os últimos bytes
+            texto = amostra.decode(enc) if len(amostra) < TAM_AMOSTRA_CSV else amostra[:-4].decode(enc)
+            encoding = enc
+            break
+        except UnicodeDecodeError: continue
+    if texto is None: texto = amostra.decode("latin-1")
+
+    linhas = texto.splitlines()
+    if len(amostra) >= TAM_AMOSTRA_CSV: linhas = linhas[:-1]  # última linha provavelmente incompleta
+    trecho = "\n".join(linhas[:50])
+    try:
+        dialeto = csv.Sniffer().sniff(trecho, delimiters=";,\t|")
+        sep, quote = dialeto.delimiter, dialeto.quotechar
+    except csv.Error:
+        cab = linhas[0] if linhas else ""
+        sep, quote = max(";,\t|", key=cab.count), '"'
+
+    br, us = len(RE_VALOR_BR.findall(trecho)), len(RE_VALOR_US.findall(trecho))
+    decimal = '.' if us > br else ','
+    return {"encoding": encoding, "sep": sep, "quotechar": quote or '"', "decimal": decimal}
+
+def _abrir_csv(file):
+    file.seek(0)
+    fmt = detectar_formato_csv(file.read(TAM_AMOSTRA_CSV))
+    file.seek(0)
+    return fmt
+
+def ler_csv(file, **kwargs):
+    """Substitui pd.read_csv(sep=None, engine='python'): detecta o formato na amostra e lê com o parser C."""
+    fmt = _abrir_csv(file)
+    df = pd.read_csv(file, sep=fmt["sep"], quotechar=fmt["quotechar"], encoding=fmt["encoding"],
+                     engine="c", **kwargs)
+    return df, fmt
+
+def ler_csv_em_blocos(file, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """Gera blocos do CSV para normalização incremental (memória limitada ao bloco + resultado)."""
+    fmt = _abrir_csv(file)
+    leitor = pd.read_csv(file, sep=fmt["sep"], quotechar=fmt["quotechar"], encoding=fmt["encoding"],
+                         engine="c", chunksize=linhas_por_bloco)
+    with leitor:
+        for bloco in leitor: yield bloco, fmt
+
+# --- LEITURA DE EXCEL (FLUXO + DETECÇÃO DO CABEÇALHO) ---
+LINHAS_CABECALHO_EXCEL = 30  # linhas do topo de cada aba examinadas atrás do cabeçalho (logo, título, período...)
+LINHAS_POR_BLOCO_EXCEL = 5_000  # linhas como objetos Python só até o bloco ser tipado
+
+def _celula_excel(v):
+    # Mesma conversão do pd.read_excel: vazia -> "", erro (#N/A, #REF!...) -> NaN, 1.0 -> 1
+    if v is None: return ""
+    if type(v) is float: return int(v) if v.is_integer() else v
+    if type(v) is str and v in ERROR_CODES: return np.nan
+    return v
+
+def _linhas_excel(aba):
+    # Linhas da aba em fluxo (openpyxl em modo read-only), sem as células vazias do fim, como no pandas
+    aba.reset_dimensions()  # alguns geradores gravam a dimensão errada, o que cortaria linhas
+    for linha in aba.iter_rows(values_only=True):
+        linha = [_celula_excel(v) for v in linha]
+        while linha and linha[-1] == "": linha.pop()
+        yield linha
+
+def _bloco_excel(cabecalho, linhas):
+    # Tipagem pelo mesmo TextParser do pd.read_excel (inferência, NaN, nomes "Unnamed: i" e ".1").
+    # Células além da última coluna do cabeçalho ficam de fora (sem nome, e o esquema não muda entre blocos)
+    largura = len(cabecalho)
+    dados = [cabecalho] + [(l + [""] * (largura - len(l)))[:largura] for l in linhas]
+    return TextParser(dados, header=0, skip_blank_lines=False).read()
+
+def _blocos_excel(pasta, pontuar, linhas_por_bloco):
+    # Aba: a primeira em que alguma das primeiras linhas tem nota `pontuar(celulas)` > 0 (a de maior nota é o
+    # cabeçalho). Sem nenhuma, primeira aba e primeira linha não vazia
+    escolha = None
+    for aba in pasta.worksheets:
+        linhas = _linhas_excel(aba)
+        topo = list(itertools.islice(linhas, LINHAS_CABECALHO_EXCEL))
+        notas = [pontuar(l) for l in topo]
+        if notas and max(notas) > 0:
+            i = notas.index(max(notas))
+            escolha = (topo[i], topo[i + 1:], linhas)
+            break
+        linhas.close()
+    if escolha is None:
+        linhas = _linhas_excel(pasta.worksheets[0])
+        escolha = (next((l for l in linhas if l), []), [], linhas)
+
+    cabecalho, resto, linhas = escolha
+    if not cabecalho:
+        yield pd.DataFrame()
+        return
+    # Linhas vazias no meio dos dados ficam (como no pd.read_excel); as do fim, não
+    bloco, vazias, emitidos = [], 0, 0
+    for linha in itertools.chain(resto, linhas):
+        if not linha:
+            vazias += 1
+            continue
+        bloco.extend([[]] * vazias + [linha])
+        vazias = 0
+        if len(bloco) >= linhas_por_bloco:
+            yield _bloco_excel(cabecalho, bloco)
+            emitidos, bloco = emitidos + 1, []
+    if bloco or not emitidos: yield _bloco_excel(cabecalho, bloco)
+
+def ler_excel_em_blocos(file, pontuar, linhas_por_bloco=LINHAS_POR_BLOCO_EXCEL):
+    """Blocos tipados de uma planilha: .xlsx/.xlsm em fluxo (openpyxl read-only), com aba e cabeçalho detectados
+    por `pontuar`; outros formatos (.xls) inteiros pelo pd.read_excel, cabeçalho na primeira linha."""
+    file.seek(0)
+    try: pasta = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    except (zipfile.BadZipFile, KeyError, InvalidFileException):
+        file.seek(0)
+        yield pd.read_excel(file)
+        return
+    try: yield from _blocos_excel(pasta, pontuar, linhas_por_bloco)
+    finally: pasta.close()
+
+# --- EXTRATO ---
+EXTENSOES_EXTRATO = ["xlsx", "xlsm", "csv"]  # aceitas no upload do app e na conciliação em lote
+MAPA_COLUNAS_EXTRATO = {'DATA LANÇAMENTO': 'DATA', 'LANCAMENTO': 'DATA', 'HISTÓRICO': 'DESCRIÇÃO', 'VALOR (R$)': 'VALOR', 'INSTITUICAO': 'BANCO', 'HISTORICO': 'DESCRIÇÃO'}
+# Papel de cada coluna pelos mesmos trechos de nome que normalizar_bloco_extrato procura
+PAPEIS_EXTRATO = [("DATA", ("DATA",)), ("VALOR", ("VALOR",)), ("DESCRIÇÃO", ("DESC", "HIST")), ("BANCO", ("BANCO", "INSTITU"))]
+
+def pontuar_cabecalho_extrato(celulas):
+    """Nota de uma linha como cabeçalho de extrato: papéis reconhecidos em células diferentes (0 sem data e valor)."""
+    papeis = set()
+    for c in celulas:
+        if not isinstance(c, str): continue
+        nome = c.upper().strip()
+        nome = MAPA_COLUNAS_EXTRATO.get(nome, nome)
+        papel = next((p for p, trechos in PAPEIS_EXTRATO if p not in papeis and any(t in nome for t in trechos)), None)
+        if papel: papeis.add(papel)
+    return len(papeis) if {"DATA", "VALOR"} <= papeis else 0
+
+def normalizar_bloco_extrato(df, decimal=None):
+    """Passos linha a linha da ingestão (não dependem das outras linhas), aplicáveis a cada bloco lido."""
+    df.columns = [str(c).upper().strip() for c in df.columns]
+    
+    # Mapa flexível de colunas
+    df = df.rename(columns=MAPA_COLUNAS_EXTRATO)
+    
+    c_data = next((c for c in df.columns if 'DATA' in c), None)
+    c_val = next((c for c in df.columns if 'VALOR' in c), None)
+    
+    if not c_data or not c_val: return None
+    
+    df["DATA"] = pd.to_datetime(df[c_data], dayfirst=True, errors='coerce')
+    df["VALOR"] = converter_valores(df[c_val], decimal)
+    
+    c_desc = next((c for c in df.columns if 'DESC' in c or 'HIST' in c), 'DESCRIÇÃO')
+    df["DESCRIÇÃO"] = df[c_desc].astype(str).fillna("")
+    
+    c_banco = next((c for c in df.columns if 'BANCO' in c or 'INSTITU' in c), 'BANCO')
+    if c_banco not in df.columns: 
+        df["BANCO"] = "PADRÃO"
+    else:
+        df["BANCO"] = df[c_banco]
+    return df
+
+def finalizar_extrato(df):
+    """Passos que dependem do arquivo inteiro (ordenação, ocorrência, hash) e colunas derivadas."""
+    df = df.sort_values(["DATA", "VALOR"])
+    df['OCORRENCIA'] = df.groupby(['DATA', 'VALOR', 'DESCRIÇÃO']).cumcount()
+    df['ID_HASH'] = gerar_hashes(df)
+    df["MES_ANO"] = formatar_datas(df["DATA"], '%m/%Y')
+    df["DESC_CLEAN"] = limpar_descricoes(df["DESCRIÇÃO"])
+    df["TIPO"] = np.where(df["VALOR"] >= 0, "CRÉDITO", "DÉBITO")
+    # Centavos só depois do hash (que usa o valor lido do arquivo)
+    df["VALOR"] = para_centavos(df["VALOR"])
+    
+    # Inicializa colunas
+    df["CONCILIADO"] = False
+    df["DATA_CONCILIACAO"] = pd.NaT
+    
+    return tipar_extrato(df)
+
+def process_extrato(file):
+    """Lê um extrato (Excel ou CSV) e devolve o DataFrame normalizado, ou None se faltar coluna de data/valor."""
+    # Lê Excel ou CSV
+    if file.name.endswith('.csv'):
+        blocos = []
+        for bloco, fmt in ler_csv_em_blocos(file):
+            bloco = normalizar_bloco_extrato(bloco, fmt["decimal"])
+            if bloco is None: return None
+            blocos.append(bloco)
+        if not blocos: return None
+        df = pd.concat(blocos, ignore_index=True) if len(blocos) > 1 else blocos[0]
+    else:
+        # Excel em fluxo: logo/título no topo e outras abas são pulados pela detecção do cabeçalho
+        blocos = []
+        for bloco in ler_excel_em_blocos(file, pontuar_cabecalho_extrato):
+            bloco = normalizar_bloco_extrato(bloco)
+            if bloco is None: return None
+            blocos.append(bloco)
+        df = pd.concat(blocos, ignore_index=True) if len(blocos) > 1 else blocos[0]
+    
+    return finalizar_extrato(df)
+
+def processar_arquivo_extrato(nome, conteudo):
+    """Ponto de entrada dos processos de leitura: recebe nome e bytes do arquivo enviado (objetos picláveis)."""
+    def ler():
+        file = BytesIO(conteudo)
+        file.name = nome
+        return process_extrato(file)
+    return em_cache("extrato", nome, conteudo, ler, tipar_extrato)
+
+# --- BENNER ---
+MAPA_COLUNAS_BENNER = {
+    'Número': 'Número', 'Numero': 'Número',
+    'Nome': 'Nome', 'Favorecido': 'Nome',
+    'CNPJ/CPF': 'CNPJ/CPF',
+    'Tipo do Documento': 'Tipo do Documento', 'TIPO DO DOCUMENTO': 'Tipo do Documento',
+    'Data de Vencimento': 'Data de Vencimento', 'Vencimento': 'Data de Vencimento',
+    'Data Baixa': 'Data Baixa', 'Baixa': 'Data Baixa',
+    'Valor Total': 'Valor Total', 'Valor Liquido': 'Valor Total', 'Valor': 'Valor Total', 'VALOR TOTAL': 'Valor Total'
+}
+EXTENSOES_BENNER = ["csv", "xlsx"]
+
+def pontuar_cabecalho_benner(celulas):
+    """Nota de uma linha como cabeçalho da exportação do Benner: colunas conhecidas (0 com menos de duas)."""
+    n = len({MAPA_COLUNAS_BENNER[c.strip()] for c in celulas if isinstance(c, str) and c.strip() in MAPA_COLUNAS_BENNER})
+    return n if n >= 2 else 0
+
+def prepare_benner_upload(df_raw):
+    # Padroniza nomes de colunas para busca
+    df_raw.columns = [str(c).strip() for c in df_raw.columns]
+    
+    df = df_raw.rename(columns={k:v for k,v in MAPA_COLUNAS_BENNER.items() if k in df_raw.columns})
+    
+    if 'Tipo do Documento' in df.columns:
+        df['Tipo do Documento'] = df['Tipo do Documento'].apply(lambda x: 'BASA' if 'AMAZONAS' in str(x).upper() else ('BB' if 'BRASIL' in str(x).upper() else x))
+
+    for c in ['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total']:
+        if c not in df.columns: df[c] = None
+    
+    df = df[['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total']]
+    
+    # ID Benner é o Número
+    df['ID_BENNER'] = df['Número'].astype(str).str.strip()
+    df = df.drop_duplicates(subset=['ID_BENNER'], keep='last')
+    
+    df['Data Baixa'] = pd.to_datetime(df['Data Baixa'], errors='coerce')
+    df['STATUS_CONCILIACAO'] = np.where(df['Data Baixa'].notna(), 'Conciliado', 'Pendente')
+    df['DESC_CLEAN'] = limpar_descricoes(df['Nome'])  # normalizado uma vez e gravado junto (os matchers reaproveitam)
+    
+    # Converte valor
+    df['Valor Total'] = para_centavos(converter_valores(df['Valor Total']))
+    
+    return tipar_benner(df)
+
+# Campos como vêm do Benner: o status fica de fora porque o app o altera (confirmação de conciliação)
+COLS_CONTEUDO_BENNER = ['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total']
+VERSAO_HASH_BENNER = 2  # incrementar se o texto do hash mudar (o banco recalcula os hashes gravados)
+VAZIO_HASH = "\x1e"  # campo ausente, qualquer que seja o tipo da coluna (None, NaN, NaT, categoria)
+
+def _texto_conteudo(serie):
+    # Ausente vira sempre o mesmo texto: 'nan'/'None'/'NaT' dependeriam do tipo com que a coluna chegou
+    return _texto_hash(serie).where(serie.notna().to_numpy(), VAZIO_HASH)
+
+def hashes_conteudo_benner(df):
+    """Impressão digital (md5) do conteúdo de cada documento: reexportado sem mudança, mesmo hash."""
+    chave = _texto_conteudo(df[COLS_CONTEUDO_BENNER[0]])
+    for c in COLS_CONTEUDO_BENNER[1:]: chave = chave + "\x1f" + _texto_conteudo(df[c])
+    md5 = hashlib.md5
+    return pd.Series([md5(k.encode()).hexdigest() for k in chave], index=df.index, dtype=object)
+
+def classificar_benner(df_new, hashes_db):
+    """Separa um upload em (novos, alterados, qtd. iguais) consultando `hashes_db` (ID_BENNER -> hash gravado).
+    Só novos e alterados precisam ser gravados e reconciliados."""
+    gravado = df_new['ID_BENNER'].astype(object).map(hashes_db)
+    novo = gravado.isna().to_numpy()
+    igual = ~novo & (gravado.to_numpy() == hashes_conteudo_benner(df_new).to_numpy())
+    return df_new[novo], df_new[~novo & ~igual], int(igual.sum())
+
+def _texto_campo(serie, col):
+    # Valor legível para a tela de diferenças
+    if col == 'Valor Total': return em_reais(serie).map(formatar_br)
+    if pd.api.types.is_datetime64_any_dtype(serie): return formatar_datas(serie, '%d/%m/%Y').fillna("")
+    return serie.astype(object).fillna("").map(str)
+
+def diferencas_benner(atuais, novos):
+    """Campos que mudaram nos documentos alterados: uma linha por (documento, campo) com o valor atual e o novo."""
+    a = atuais.set_index('ID_BENNER').reindex(novos['ID_BENNER'])
+    n = novos.set_index('ID_BENNER')
+    partes = []
+    for c in COLS_CONTEUDO_BENNER:
+        # Compara o mesmo texto usado no hash (categorias diferentes não se comparam com ==)
+        muda = _texto_conteudo(a[c]).to_numpy() != _texto_conteudo(n[c]).to_numpy()
+        if muda.any():
+            partes.append(pd.DataFrame({"Número": n.index[muda], "Campo": c,
+                                        "Atual": _texto_campo(a[c], c)[muda].to_numpy(),
+                                        "Novo": _texto_campo(n[c], c)[muda].to_numpy()}))
+    if not partes: return pd.DataFrame(columns=["Número", "Campo", "Atual", "Novo"])
+    # Estável: dentro do documento, os campos ficam na ordem das colunas
+    return pd.concat(partes, ignore_index=True).sort_values("Número", kind="stable", ignore_index=True)
+
+def processar_arquivo_benner(nome, conteudo):
+    def ler():
+        file = BytesIO(conteudo)
+        if nome.endswith('.csv'): df_raw = ler_csv(file)[0]
+        else: df_raw = pd.concat(ler_excel_em_blocos(file, pontuar_cabecalho_benner), ignore_index=True)
+        return prepare_benner_upload(df_raw)
+    return em_cache("benner", nome, conteudo, ler, tipar_benner)
+
+# --- CACHE DE ARQUIVOS LIDOS (ENDEREÇADO POR CONTEÚDO) ---
+# Mesmo arquivo (mesmos bytes) + mesma versão do parser = mesmo resultado: lido do disco em milissegundos.
+# Fica em disco, compartilhado por todas as sessões/processos do servidor.
+VERSAO_PARSER = 6  # incrementar sempre que a leitura/normalização mudar (invalida o cache)
+DIR_CACHE = ".cache_uploads"
+LIMITE_CACHE_BYTES = 512 * 1024 * 1024
+
+def chave_cache(tipo, nome, conteudo):
+    ext = os.path.splitext(nome)[1].lower().lstrip('.')
+    digest = hashlib.blake2b(conteudo, digest_size=20).hexdigest()
+    return f"{tipo}-v{VERSAO_PARSER}-{ext}-{digest}"
+
+def _caminho_cache(chave):
+    return os.path.join(DIR_CACHE, chave + ".parquet")
+
+def ler_cache(chave):
+    caminho = _caminho_cache(chave)
+    if not os.path.exists(caminho): return None
+    try:
+        df = pd.read_parquet(caminho)
+    except Exception:
+        return None
+    try: os.utime(caminho)  # marca como usado recentemente (LRU pela data de modificação)
+    except OSError: pass
+    return df
+
+def gravar_cache(chave, df):
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    destino = _caminho_cache(chave)
+    tmp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, destino)  # atômico: leitores nunca veem arquivo pela metade
+    except Exception:
+        # Ex.: coluna com tipos misturados que o Parquet não aceita; segue sem cache
+        if os.path.exists(tmp): os.remove(tmp)
+        return
+    aplicar_limite_cache()
+
+def aplicar_limite_cache(limite=LIMITE_CACHE_BYTES, pasta=DIR_CACHE, extensoes=(".parquet",)):
+    """Remove os arquivos usados há mais tempo até o cache caber no limite (temporários em gravação ficam)."""
+    arquivos = []
+    for e in os.scandir(pasta):
+        if not e.name.endswith(extensoes): continue
+        try:
+            info = e.stat()
+            arquivos.append((info.st_mtime, info.st_size, e.path))
+        except FileNotFoundError: continue
+    total = sum(a[1] for a in arquivos)
+    for _, tam, caminho in sorted(arquivos):
+        if total <= limite: break
+        try:
+            os.remove(caminho)
+            total -= tam
+        except FileNotFoundError: pass
+
+def em_cache(tipo, nome, conteudo, ler, tipar):
+    """Resultado de `ler()` pelo cache. O Parquet não guarda categorias vazias nem o tipo das categorias
+    (volta object/float/int64): o que vem do disco passa de novo por `tipar`."""
+    chave = chave_cache(tipo, nome, conteudo)
+    df = ler_cache(chave)
+    if df is not None: return tipar(df)
+    df = ler()
+    if df is not None: gravar_cache(chave, df)
+    return df
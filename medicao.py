@@ -0,0 +1,90 @@
+"""Medição do tempo de cada etapa de um rerun do app e, sob demanda, cProfile de um rerun inteiro.
+
+Desligada por padrão: sem FINANCEIRO_PERFIL=1 no ambiente o app não cria medições e os marcos não fazem nada.
+Com FINANCEIRO_PERFIL_LOG=arquivo.jsonl, cada rerun encerrado também vira uma linha JSON nesse arquivo.
+Sem dependência do Streamlit.
+"""
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import deque
+
+ATIVO = os.environ.get("FINANCEIRO_PERFIL", "0") not in ("", "0")
+ARQUIVO_LOG = os.environ.get("FINANCEIRO_PERFIL_LOG")
+MAX_RERUNS = 50
+LINHAS_PERFIL = 40
+
+_lock_log = threading.Lock()
+
+def _gravar_log(registro):
+    if not ARQUIVO_LOG: return
+    linha = json.dumps(registro, ensure_ascii=False, default=str)
+    with _lock_log, open(ARQUIVO_LOG, "a", encoding="utf-8") as f:
+        f.write(linha + "\n")
+
+class MedicaoRerun:
+    """Tempos de um rerun. `marco(nome)` fecha a etapa que vai do marco anterior até aqui (serve para o
+    roteiro de cima a baixo do app, sem reindentar blocos)."""
+    def __init__(self, sessao="", perfilar=False):
+        self.sessao = sessao
+        self.pagina = None
+        self.inicio = time.time()
+        self.etapas = []  # (nome, segundos)
+        self.total = None
+        self.situacao = "rodando"
+        self.perfil = None
+        self._t0 = self._ultimo = time.perf_counter()
+        self._perfilador = None
+        if perfilar:
+            self._perfilador = cProfile.Profile()
+            try: self._perfilador.enable()
+            except ValueError:  # outro perfilador ativo no processo (outra sessão)
+                self._perfilador, self.perfil = None, "Perfil indisponível: outro rerun já estava sendo perfilado."
+
+    def marco(self, nome):
+        agora = time.perf_counter()
+        self.etapas.append((nome, agora - self._ultimo))
+        self._ultimo = agora
+
+    def encerrar(self, situacao="ok"):
+        """Fecha o rerun. `interrompido` = saiu por st.rerun()/st.stop(): o total vai até o último marco."""
+        if self.total is not None: return
+        fim = time.perf_counter() if situacao == "ok" else self._ultimo
+        self.total, self.situacao = fim - self._t0, situacao
+        if self._perfilador is not None:
+            self._perfilador.disable()
+            saida = io.StringIO()
+            pstats.Stats(self._perfilador, stream=saida).strip_dirs().sort_stats("cumulative").print_stats(LINHAS_PERFIL)
+            self.perfil, self._perfilador = saida.getvalue(), None
+        _gravar_log(self.como_dict())
+
+    def como_dict(self):
+        return {
+            "inicio": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.inicio)),
+            "sessao": self.sessao,
+            "pagina": self.pagina,
+            "situacao": self.situacao,
+            "total_ms": None if self.total is None else round(self.total * 1000, 1),
+            "etapas": [{"etapa": n, "ms": round(s * 1000, 1)} for n, s in self.etapas],
+            "perfil": self.perfil,
+        }
+
+class RegistroReruns:
+    """Últimos reruns do processo (todas as sessões), para o painel de administração."""
+    def __init__(self, maximo=MAX_RERUNS):
+        self.lock = threading.Lock()
+        self.reruns = deque(maxlen=maximo)
+
+    def adicionar(self, rerun):
+        with self.lock: self.reruns.append(rerun)
+
+    def ultimos(self):
+        with self.lock: reruns = list(self.reruns)
+        return [r.como_dict() for r in reruns]
+
+    def exportar_json(self):
+        return json.dumps(self.ultimos(), ensure_ascii=False, indent=2, default=str).encode("utf-8")
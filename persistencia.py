@@ -0,0 +1,349 @@
+"""Persistência em SQLite: histórico de conciliações do extrato, base Benner e contadores de versão.
+
+Sem dependência do Streamlit: usada pelo app e pela conciliação em lote (conciliar_lote.py).
+"""
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+
+from ingestao import (
+    converter_valores, para_centavos, para_exibicao, tipar_benner, hashes_conteudo_benner, limpar_descricoes,
+    VERSAO_HASH_BENNER,
+)
+
+# --- BANCO (SQLITE) ---
+DB_SQLITE = "financeiro.db"
+# CSVs antigos: importados uma única vez para o SQLite
+DB_EXTRATO_HIST = "historico_conciliacoes_db.csv"
+DB_BENNER = "db_benner_master.csv"
+
+COLS_HIST = ["ID_HASH", "CONCILIADO", "DATA_CONCILIACAO"]
+FMT_CONCILIACAO = "%d/%m/%Y %H:%M"  # DATA_CONCILIACAO como texto no banco; datetime em memória
+COLS_BENNER = ['Número', 'Nome', 'CNPJ/CPF', 'Tipo do Documento', 'Data de Vencimento', 'Data Baixa', 'Valor Total', 'STATUS_CONCILIACAO', 'ID_BENNER', 'DESC_CLEAN']
+COLS_BENNER_DB = COLS_BENNER + ['HASH_CONTEUDO']  # hash do conteúdo só no banco (classifica os uploads)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS hist_extrato (
+    ID_HASH TEXT PRIMARY KEY,
+    CONCILIADO TEXT,
+    DATA_CONCILIACAO TEXT
+);
+CREATE TABLE IF NOT EXISTS benner (
+    "Número" TEXT,
+    "Nome" TEXT,
+    "CNPJ/CPF" TEXT,
+    "Tipo do Documento" TEXT,
+    "Data de Vencimento" TEXT,
+    "Data Baixa" TEXT,
+    "Valor Total" REAL,
+    "STATUS_CONCILIACAO" TEXT,
+    "ID_BENNER" TEXT PRIMARY KEY,
+    "HASH_CONTEUDO" TEXT,
+    "DESC_CLEAN" TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE IF NOT EXISTS cand_extrato (ID_HASH TEXT PRIMARY KEY, VALOR_ABS INTEGER, DESC_CLEAN TEXT);
+CREATE INDEX IF NOT EXISTS idx_cand_extrato_valor ON cand_extrato (VALOR_ABS);
+CREATE TABLE IF NOT EXISTS cand_benner (ID_BENNER TEXT PRIMARY KEY, ASSINATURA TEXT);
+CREATE TABLE IF NOT EXISTS candidatos (
+    ID_BENNER TEXT,
+    ID_HASH TEXT,
+    SCORE REAL,
+    SITUACAO TEXT,
+    PRIMARY KEY (ID_BENNER, ID_HASH)
+);
+"""
+
+def _q(col):
+    return '"' + col.replace('"', '""') + '"'
+
+def _sql_upsert(tabela, cols, chave):
+    # Só reescreve a linha se algum campo mudou
+    sets = ", ".join(f"{_q(c)}=excluded.{_q(c)}" for c in cols if c != chave)
+    difs = " OR ".join(f"{_q(c)} IS NOT excluded.{_q(c)}" for c in cols if c != chave)
+    return (f"INSERT INTO {tabela} ({', '.join(_q(c) for c in cols)}) VALUES ({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT({_q(chave)}) DO UPDATE SET {sets} WHERE {difs}")
+
+def _linhas_sql(df, cols):
+    """Converte o DataFrame em tuplas com tipos aceitos pelo sqlite3 (NaN/NaT -> NULL, datas -> texto)."""
+    df = df[cols].astype(object)
+    df = df.where(df.notna(), None)
+    for c in cols:
+        df[c] = df[c].map(lambda x: str(x) if isinstance(x, (pd.Timestamp, datetime, date, bool)) else x)
+    return list(df.itertuples(index=False, name=None))
+
+def _incrementar_versao(con, tabela):
+    # Contador gravado junto com os dados: invalida o cache compartilhado (inclusive de outros processos)
+    chave = f"versao_{tabela}"
+    con.execute("INSERT INTO meta VALUES (?, '1') ON CONFLICT(chave) DO UPDATE SET valor = CAST(valor AS INTEGER) + 1", (chave,))
+    return int(con.execute("SELECT valor FROM meta WHERE chave=?", (chave,)).fetchone()[0])
+
+def versao_tabela(tabela):
+    inicializar_db()
+    with closing(conectar_db()) as con:
+        row = con.execute("SELECT valor FROM meta WHERE chave=?", (f"versao_{tabela}",)).fetchone()
+    return int(row[0]) if row else 0
+
+def conectar_db():
+    con = sqlite3.connect(DB_SQLITE, timeout=30)
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+def _migrar_csvs(con):
+    """Importa os CSVs antigos uma única vez. Retorna os avisos de falha (quem chamou decide como mostrar)."""
+    avisos = []
+    if con.execute("SELECT 1 FROM meta WHERE chave='migracao_csv'").fetchone(): return avisos
+    if os.path.exists(DB_EXTRATO_HIST):
+        try:
+            hist = pd.read_csv(DB_EXTRATO_HIST, dtype=str).drop_duplicates('ID_HASH', keep='last')
+            con.executemany(_sql_upsert("hist_extrato", COLS_HIST, "ID_HASH"), _linhas_sql(hist, COLS_HIST))
+        except Exception as e: avisos.append(f"Falha ao migrar {DB_EXTRATO_HIST}: {e}")
+    if os.path.exists(DB_BENNER):
+        try:
+            db = pd.read_csv(DB_BENNER, dtype={'Número': str, 'ID_BENNER': str})
+            for c in COLS_BENNER:
+                if c not in db.columns: db[c] = None
+            db = db.drop_duplicates('ID_BENNER', keep='last')
+            con.executemany(_sql_upsert("benner", COLS_BENNER, "ID_BENNER"), _linhas_sql(db, COLS_BENNER))
+        except Exception as e: avisos.append(f"Falha ao migrar {DB_BENNER}: {e}")
+    con.execute("INSERT INTO meta VALUES ('migracao_csv', ?)", (datetime.now().isoformat(),))
+    return avisos
+
+def _migrar_derivadas(con):
+    # Bancos anteriores ao hash de conteúdo / nome normalizado: cria as colunas e calcula onde faltam.
+    # Hashes de outra versão do cálculo são todos refeitos (senão todo documento pareceria alterado)
+    existentes = {r[1] for r in con.execute("PRAGMA table_info(benner)")}
+    for c in ["HASH_CONTEUDO", "DESC_CLEAN"]:
+        if c not in existentes: con.execute(f"ALTER TABLE benner ADD COLUMN {_q(c)} TEXT")
+    versao = con.execute("SELECT valor FROM meta WHERE chave='versao_hash_benner'").fetchone()
+    atual = versao is not None and int(versao[0]) == VERSAO_HASH_BENNER
+    df = _ler_benner(con, "WHERE HASH_CONTEUDO IS NULL OR DESC_CLEAN IS NULL" if atual else "")
+    if not df.empty:
+        con.executemany("UPDATE benner SET HASH_CONTEUDO=?, DESC_CLEAN=? WHERE ID_BENNER=?",
+                        zip(hashes_conteudo_benner(df), limpar_descricoes(df['Nome']), df['ID_BENNER'].astype(object)))
+    if not atual:
+        con.execute("INSERT INTO meta VALUES ('versao_hash_benner', ?) ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+                    (str(VERSAO_HASH_BENNER),))
+
+_db_pronto = False
+_lock_db = threading.Lock()
+
+def inicializar_db():
+    """Executa uma vez por processo: WAL (leitores não bloqueiam o escritor), tabelas e migração dos CSVs.
+    Retorna os avisos da migração na primeira chamada; nas seguintes, lista vazia."""
+    global _db_pronto
+    if _db_pronto: return []
+    with _lock_db:
+        if _db_pronto: return []
+        with closing(conectar_db()) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA_SQL)
+            with con:
+                avisos = _migrar_csvs(con)
+                _migrar_derivadas(con)
+        _db_pronto = True
+    return avisos
+
+# --- EXTRATO ---
+def load_hist_extrato():
+    inicializar_db()
+    with closing(conectar_db()) as con:
+        hist = pd.read_sql_query("SELECT ID_HASH, CONCILIADO, DATA_CONCILIACAO FROM hist_extrato", con, dtype=str)
+    hist['DATA_CONCILIACAO'] = pd.to_datetime(hist['DATA_CONCILIACAO'], format=FMT_CONCILIACAO, errors='coerce')
+    return hist
+
+def _linhas_hist(df):
+    # Só os conciliados vão para o histórico
+    conc = df[df["CONCILIADO"] == True][COLS_HIST]
+    conc = conc.assign(DATA_CONCILIACAO=conc["DATA_CONCILIACAO"].dt.strftime(FMT_CONCILIACAO))
+    return _linhas_sql(conc, COLS_HIST)
+
+def save_hist_extrato(df):
+    # Salva apenas os conciliados no histórico para persistência (upsert, custo independe do tamanho do histórico)
+    linhas = _linhas_hist(df)
+    if not linhas: return
+    inicializar_db()
+    with closing(conectar_db()) as con, con:
+        antes = con.total_changes
+        con.executemany(_sql_upsert("hist_extrato", COLS_HIST, "ID_HASH"), linhas)
+        if con.total_changes > antes: return _incrementar_versao(con, "hist_extrato")
+
+def gravar_lote_hist(lote):
+    """Grava numa transação só um lote {ID_HASH: (CONCILIADO, DATA_CONCILIACAO) ou None = remover}.
+    Retorna a nova versão do histórico (None se nada mudou)."""
+    marcar = [(i,) + v for i, v in lote.items() if v is not None]
+    remover = [(i,) for i, v in lote.items() if v is None]
+    inicializar_db()
+    with closing(conectar_db()) as con:
+        con.execute("PRAGMA synchronous=FULL")  # roda fora da tela: pode esperar o disco confirmar
+        with con:
+            con.execute("BEGIN IMMEDIATE")  # trava de escrita do SQLite (vale entre processos) já no início
+            antes = con.total_changes
+            con.executemany(_sql_upsert("hist_extrato", COLS_HIST, "ID_HASH"), marcar)
+            con.executemany("DELETE FROM hist_extrato WHERE ID_HASH=?", remover)
+            if con.total_changes > antes: return _incrementar_versao(con, "hist_extrato")
+
+def aplicar_historico(df, hist):
+    """Marca como conciliadas (com a data do histórico) as linhas de df cujo ID_HASH está no histórico.
+    Retorna as posições marcadas."""
+    if hist.empty or df.empty: return []
+    datas = hist.drop_duplicates('ID_HASH', keep='last').set_index('ID_HASH')['DATA_CONCILIACAO']
+    presentes = df['ID_HASH'].isin(datas.index)
+    if presentes.any():
+        df.loc[presentes, 'CONCILIADO'] = True
+        df.loc[presentes, 'DATA_CONCILIACAO'] = df.loc[presentes, 'ID_HASH'].map(datas)
+    return np.flatnonzero(presentes.to_numpy())
+
+def momento_conciliacao():
+    # Mesma precisão do texto gravado no histórico (minutos)
+    return pd.Timestamp.now().floor("min")
+
+# --- GRAVAÇÃO DO HISTÓRICO EM SEGUNDO PLANO ---
+ATRASO_GRAVACAO = 0.5  # segundos sem alteração nova antes de gravar o lote
+ATRASO_MAXIMO = 2.0    # grava mesmo que as alterações continuem chegando
+LOTES_LEMBRADOS = 200
+
+class FilaHistorico:
+    """Write-behind do histórico do extrato: marcar/desmarcar só entra na fila (a tela não espera o disco)
+    e uma thread grava tudo num lote. Várias alterações seguidas da mesma linha viram uma só (a última vence).
+    `esperar()` é a barreira de durabilidade: volta quando o que foi enfileirado antes dela está no banco."""
+    def __init__(self, atraso=ATRASO_GRAVACAO, maximo=ATRASO_MAXIMO):
+        self.atraso, self.maximo = atraso, maximo
+        self.cond = threading.Condition()
+        self.pendentes = {}  # ID_HASH -> (CONCILIADO, DATA_CONCILIACAO) ou None (remover)
+        self.em_gravacao = {}  # lote que a thread está gravando agora
+        self.origens = set()  # quem alterou o que está pendente (ex.: id da sessão)
+        self.lotes = {}  # versão gravada -> origens do lote
+        self.pedidos = self.gravados = 0  # alterações enfileiradas / já gravadas (para a barreira)
+        self.ultima_alteracao = 0.0
+        self.urgente = False
+        self.erro = None
+        self.thread = None
+
+    def _enfileirar(self, itens, origem):
+        with self.cond:
+            self.pendentes.update(itens)
+            self.origens.add(origem)
+            self.pedidos += 1
+            self.ultima_alteracao = time.monotonic()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._rodar, name="fila-historico", daemon=True)
+                self.thread.start()
+                atexit.register(self.esperar, 10)  # não perde o que está na fila ao desligar o servidor
+            self.cond.notify_all()
+
+    def marcar(self, df, origem=None):
+        linhas = _linhas_hist(df)
+        if linhas: self._enfileirar({i: (c, d) for i, c, d in linhas}, origem)
+
+    def remover(self, ids, origem=None):
+        ids = list(ids)
+        if ids: self._enfileirar(dict.fromkeys(ids), origem)
+
+    def remocoes_pendentes(self):
+        """IDs cuja remoção ainda não chegou ao banco (quem relê o histórico não deve remarcá-los)."""
+        with self.cond:
+            return {i for d in (self.em_gravacao, self.pendentes) for i, v in d.items() if v is None}
+
+    def so_de(self, origem, de, ate):
+        """True se todas as versões do histórico em (de, ate] foram gravadas por esta fila só com alterações de `origem`."""
+        with self.cond:
+            return ate > de and all(self.lotes.get(v) == {origem} for v in range(de + 1, ate + 1))
+
+    def esperar(self, timeout=None):
+        """Grava já o que está na fila e espera terminar. Repassa o erro da gravação, se houver."""
+        with self.cond:
+            alvo = self.pedidos
+            if alvo > self.gravados: self.urgente = True
+            self.cond.notify_all()
+            if not self.cond.wait_for(lambda: self.gravados >= alvo or self.erro is not None, timeout):
+                raise TimeoutError("Gravação do histórico ainda em andamento.")
+            if self.gravados < alvo: raise self.erro
+
+    def _rodar(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pendentes)
+                # Espera as alterações pararem de chegar (ex.: várias caixas marcadas em sequência)
+                limite = time.monotonic() + self.maximo
+                while not self.urgente:
+                    restante = min(self.ultima_alteracao + self.atraso, limite) - time.monotonic()
+                    if restante <= 0: break
+                    self.cond.wait(restante)
+                lote, origens, ate = self.pendentes, self.origens, self.pedidos
+                self.pendentes, self.origens, self.em_gravacao, self.urgente = {}, set(), lote, False
+            try:
+                versao = gravar_lote_hist(lote)
+            except Exception as e:
+                with self.cond:
+                    # Devolve o lote sem passar por cima do que chegou depois e tenta de novo
+                    for i, v in lote.items(): self.pendentes.setdefault(i, v)
+                    self.origens |= origens
+                    self.em_gravacao, self.erro = {}, e
+                    self.cond.notify_all()
+                time.sleep(self.maximo)
+                continue
+            with self.cond:
+                if versao:
+                    self.lotes[versao] = origens
+                    if len(self.lotes) > LOTES_LEMBRADOS: del self.lotes[min(self.lotes)]
+                self.em_gravacao, self.gravados, self.erro = {}, ate, None
+                self.cond.notify_all()
+
+# --- BENNER (SQLITE) ---
+def _tipar_lido(df):
+    df['Valor Total'] = para_centavos(converter_valores(df['Valor Total']))
+    return tipar_benner(df)
+
+def _ler_benner(con, filtro=""):
+    cols = ", ".join(_q(c) for c in COLS_BENNER)
+    return _tipar_lido(pd.read_sql_query(f"SELECT {cols} FROM benner {filtro}", con))
+
+def load_db_benner():
+    inicializar_db()
+    try:
+        with closing(conectar_db()) as con: return _ler_benner(con)
+    except Exception: return _tipar_lido(pd.DataFrame(columns=COLS_BENNER))
+
+def hashes_benner():
+    """ID_BENNER -> hash do conteúdo gravado (classifica um upload sem carregar a base)."""
+    inicializar_db()
+    with closing(conectar_db()) as con:
+        df = pd.read_sql_query("SELECT ID_BENNER, HASH_CONTEUDO FROM benner", con, dtype=object)
+    return df.set_index('ID_BENNER')['HASH_CONTEUDO']
+
+def _linhas_benner(df):
+    # No banco o valor fica em reais (REAL), como sempre foi; o hash vai junto com o conteúdo
+    return _linhas_sql(para_exibicao(df[COLS_BENNER]).assign(HASH_CONTEUDO=hashes_conteudo_benner(df)), COLS_BENNER_DB)
+
+def gravar_db_benner(df, alterados=None):
+    """Persiste a base Benner. Com `alterados`, grava só essas linhas (upsert);
+    sem, sincroniza a tabela com `df` (upsert + remoção dos IDs que saíram).
+    Retorna (df tipado, nova versão da tabela)."""
+    inicializar_db()
+    df = tipar_benner(df)  # concat de bases com categorias diferentes volta para object
+    sql = _sql_upsert("benner", COLS_BENNER_DB, "ID_BENNER")
+    with closing(conectar_db()) as con, con:
+        if alterados is not None:
+            con.executemany(sql, _linhas_benner(alterados))
+        else:
+            con.executemany(sql, _linhas_benner(df))
+            con.execute("CREATE TEMP TABLE IF NOT EXISTS ids_manter (id TEXT PRIMARY KEY)")
+            con.execute("DELETE FROM ids_manter")
+            con.executemany("INSERT OR IGNORE INTO ids_manter VALUES (?)", ((i,) for i in df['ID_BENNER'].astype(str)))
+            con.execute("DELETE FROM benner WHERE ID_BENNER NOT IN (SELECT id FROM ids_manter)")
+        versao = _incrementar_versao(con, "benner")
+    return df, versao
+
+def limpar_db_benner():
+    inicializar_db()
+    with closing(conectar_db()) as con, con:
+        con.execute("DELETE FROM benner")
+        _incrementar_versao(con, "benner")
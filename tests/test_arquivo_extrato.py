@@ -0,0 +1,26 @@
+import pandas as pd
+
+from ingestao import processar_arquivo_extrato
+from arquivo_extrato import arquivar_extrato, catalogo, abrir_extrato
+
+def _extrato_bancos_numericos():
+    conteudo = pd.DataFrame({
+        "Data": ["01/02/2024", "02/02/2024", "03/03/2024"], "Histórico": ["PIX A", "TED B", "TARIFA"],
+        "Valor": ["10,00", "-20,00", "-1,50"], "Banco": [1, 237, 237],
+    }).to_csv(index=False, sep=";").encode()
+    return processar_arquivo_extrato("extrato.csv", conteudo)
+
+def test_banco_numerico_igual_na_sessao_e_no_arquivo(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    sessao = _extrato_bancos_numericos()
+    assert list(sessao["BANCO"].cat.categories) == ["1", "237"]
+
+    raiz = str(tmp_path / "arquivo")
+    assert arquivar_extrato(sessao, raiz) == 3
+    arquivados = {b for _, b in catalogo(raiz)}
+    # Filtro da Busca: sessão + arquivo, sem o mesmo banco duas vezes (e ordenável)
+    assert sorted(set(sessao["BANCO"].cat.categories) | arquivados) == ["1", "237"]
+
+    fatia = abrir_extrato(None, ["237"], raiz)
+    assert fatia["BANCO"].tolist() == ["237", "237"]
+    assert set(fatia["ID_HASH"]) == set(sessao.loc[sessao["BANCO"] == "237", "ID_HASH"])
@@ -0,0 +1,107 @@
+import sqlite3
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import conciliacao
+import persistencia
+
+@pytest.fixture
+def banco(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(persistencia, "_db_pronto", False)
+    persistencia.inicializar_db()
+    return tmp_path
+
+def _extrato(*linhas):
+    # (ID_HASH, valor em centavos, descrição)
+    return pd.DataFrame({"ID_HASH": [l[0] for l in linhas], "VALOR": [-l[1] for l in linhas],
+                         "DESC_CLEAN": [l[2] for l in linhas], "DATA": pd.Timestamp("2024-02-01"),
+                         "DESCRIÇÃO": [l[2] for l in linhas]})
+
+def _benner(*docs):
+    # (ID_BENNER, valor em centavos, nome)
+    return pd.DataFrame({"ID_BENNER": [d[0] for d in docs], "Valor Total": [d[1] for d in docs],
+                         "DESC_CLEAN": [d[2] for d in docs], "Nome": [d[2] for d in docs],
+                         "Número": range(1, len(docs) + 1), "Data Baixa": pd.NaT,
+                         "Data de Vencimento": pd.Timestamp("2024-02-03")})
+
+def _candidatos():
+    with sqlite3.connect(persistencia.DB_SQLITE) as con:
+        return set(con.execute("SELECT ID_BENNER, ID_HASH FROM candidatos"))
+
+def test_documento_e_linha_registrados_ao_mesmo_tempo_sao_pontuados(banco, monkeypatch):
+    # A registra a linha L enquanto B registra o documento D: B termina entre a leitura e a escrita de A
+    linha, doc = _extrato(("L", 10000, "FORNECEDOR ALFA")), _benner(("D", 10000, "FORNECEDOR ALFA"))
+    original = conciliacao.pontuar_pares
+    def pontuar(*args, **kwargs):
+        monkeypatch.setattr(conciliacao, "pontuar_pares", original)
+        conciliacao.atualizar_candidatos(linha.iloc[:0], doc, set())
+        return original(*args, **kwargs)
+    monkeypatch.setattr(conciliacao, "pontuar_pares", pontuar)
+    conciliacao.atualizar_candidatos(linha, doc.iloc[:0], set())
+    assert _candidatos() == {("D", "L")}
+
+def test_documento_que_sai_dos_pendentes_perde_os_candidatos(banco):
+    ex = _extrato(("L1", 10000, "FORNECEDOR ALFA"), ("L2", 5000, "FORNECEDOR BETA"))
+    bn = _benner(("D1", 10000, "FORNECEDOR ALFA"), ("D2", 5000, "FORNECEDOR BETA"))
+    conciliacao.atualizar_candidatos(ex, bn, set())
+    assert _candidatos() == {("D1", "L1"), ("D2", "L2")}
+    conciliacao.atualizar_candidatos(ex, bn.iloc[1:], set(ex["ID_HASH"]))
+    assert _candidatos() == {("D2", "L2")}
+    with sqlite3.connect(persistencia.DB_SQLITE) as con:
+        assert con.execute("SELECT ID_BENNER FROM cand_benner").fetchall() == [("D2",)]
+
+def test_melhores_candidatos_so_do_escopo_da_tela(banco):
+    ex = _extrato(("L1", 10000, "FORNECEDOR ALFA"), ("L2", 5000, "FORNECEDOR BETA"))
+    bn = _benner(("D1", 10000, "FORNECEDOR ALFA"), ("D2", 5000, "FORNECEDOR BETA"))
+    conciliacao.atualizar_candidatos(ex, bn, set())
+    matches = conciliacao.melhores_candidatos(ex, bn.iloc[1:])
+    assert [(m["ID_BENNER"], m["ID_HASH"]) for m in matches] == [("D2", "L2")]
+
+def _chave(valores, scores, alvo, pos):
+    # Preferência de melhor_subconjunto: menor diferença, menos itens, maior score médio
+    return abs(valores[list(pos)].sum() - alvo), len(pos), -scores[list(pos)].mean()
+
+def test_melhor_subconjunto_igual_a_forca_bruta():
+    rng = np.random.default_rng(7)
+    for _ in range(300):
+        m = int(rng.integers(0, 10))
+        valores = rng.integers(1, 60, m) * 50
+        scores = rng.integers(71, 101, m).astype(float)
+        alvo, tol = int(rng.integers(50, 6000)), int(rng.integers(0, 30))
+        validos = [c for t in range(2, conciliacao.MAX_PARCELAS + 1) for c in combinations(range(m), t)
+                   if abs(valores[list(c)].sum() - alvo) <= tol]
+        achado = conciliacao.melhor_subconjunto(valores, scores, alvo, tol)
+        if not validos:
+            assert achado is None
+            continue
+        assert achado is not None and len(set(achado.tolist())) == len(achado)
+        assert _chave(valores, scores, alvo, achado) == min(_chave(valores, scores, alvo, c) for c in validos)
+
+def _grupos(matches):
+    return [(m["Tipo"], sorted(m["ID_HASH"]), sorted(m["ID_BENNER"])) for m in matches]
+
+def test_agrupados_varias_linhas_pagando_um_documento():
+    ex = _extrato(("L1", 6000, "PIX FORNECEDOR ALFA"), ("L2", 4000, "PIX FORNECEDOR ALFA"), ("L3", 2500, "TARIFA"))
+    bn = _benner(("D", 10000, "FORNECEDOR ALFA"))
+    assert _grupos(conciliacao.buscar_agrupados(ex, bn)) == [("N:1", ["L1", "L2"], ["D"])]
+
+def test_agrupados_uma_linha_quitando_varios_documentos():
+    ex = _extrato(("L", 10000, "PIX FORNECEDOR ALFA"))
+    bn = _benner(("D1", 8000, "FORNECEDOR ALFA"), ("D2", 2000, "FORNECEDOR ALFA"), ("D3", 2000, "FORNECEDOR BETA"))
+    assert _grupos(conciliacao.buscar_agrupados(ex, bn)) == [("1:N", ["L"], ["D1", "D2"])]
+
+def test_agrupados_fora_da_janela_de_datas():
+    ex = _extrato(("L", 10000, "PIX FORNECEDOR ALFA"))
+    bn = _benner(("D1", 8000, "FORNECEDOR ALFA"), ("D2", 2000, "FORNECEDOR ALFA"))
+    bn["Data de Vencimento"] = pd.Timestamp("2024-02-01") + pd.to_timedelta([0, conciliacao.JANELA_DIAS_GRUPO + 1], unit="D")
+    assert conciliacao.buscar_agrupados(ex, bn) == []
+
+def test_agrupados_ignora_documento_sem_valor_positivo():
+    # 80 + 50 - 30 = 100: o documento negativo não pode completar a soma
+    ex = _extrato(("L", 10000, "PIX FORNECEDOR ALFA"))
+    bn = _benner(("D1", 8000, "FORNECEDOR ALFA"), ("D2", -3000, "FORNECEDOR ALFA"), ("D3", 5000, "FORNECEDOR ALFA"))
+    assert conciliacao.buscar_agrupados(ex, bn) == []
@@ -0,0 +1,209 @@
+import io
+import re
+import zipfile
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from ingestao import (
+    gerar_hash, gerar_hashes, converter_valor, converter_valores, normalizar_bloco_extrato,
+    processar_arquivo_extrato, processar_arquivo_benner, prepare_benner_upload, hashes_conteudo_benner,
+    ler_excel_em_blocos, pontuar_cabecalho_extrato, pontuar_cabecalho_benner, process_extrato,
+)
+
+# --- HASH DO EXTRATO (gerar_hashes x gerar_hash linha a linha) ---
+def _pre_hash(df):
+    # Mesmos passos de finalizar_extrato até o hash
+    df = df.sort_values(["DATA", "VALOR"])
+    df['OCORRENCIA'] = df.groupby(['DATA', 'VALOR', 'DESCRIÇÃO']).cumcount()
+    return df
+
+def _conferir(df):
+    assert gerar_hashes(df).tolist() == df.apply(gerar_hash, axis=1).tolist()
+
+def test_hash_formato_brasileiro():
+    bruto = pd.DataFrame({
+        "Data": ["01/02/2024", "01/02/2024", "01/02/2024", "15/03/2024", "31/12/2023"],
+        "Histórico": ["PIX ENVIADO JOSÉ", "PIX ENVIADO JOSÉ", "TARIFA AÇÃO Nº 1", "TED CRÉDITO", "SAQUE"],
+        "Valor": ["1.234,56", "1.234,56", "-0,50", "R$ 10.000,00", "-25"],
+        "Banco": ["BB", "BB", "ITAÚ", "BB", "CAIXA"],
+    })
+    _conferir(_pre_hash(normalizar_bloco_extrato(bruto.copy(), ",")))
+
+def test_hash_formato_americano_e_notacao_cientifica():
+    bruto = pd.DataFrame({
+        "Data": ["2024-02-01", "2024-02-01", "2024-02-02", "2024-02-03"],
+        "Descricao": ["Café", "Café", "Pagamento", "Estorno"],
+        "Valor": ["1,234.56", "1.5e3", "-2.5E-2", "0.1"],
+    })
+    df = _pre_hash(normalizar_bloco_extrato(bruto.copy(), "."))
+    assert df["VALOR"].tolist() == converter_valores(bruto["Valor"], ".").loc[df.index].tolist()
+    _conferir(df)
+
+def test_hash_valores_ausentes():
+    df = pd.DataFrame({
+        "DATA": pd.to_datetime(["2024-01-05 00:00:00", None, "2024-01-05 10:30:00", "2024-01-05 10:30:00.250"], format="ISO8601"),
+        "VALOR": [np.nan, 12.3, -0.1, 1e20],
+        "DESCRIÇÃO": ["nan", "JOÃO", "", "Ç"],
+        "BANCO": ["BB", np.nan, "PADRÃO", "BB"],
+        "OCORRENCIA": [0, 0, 0, 1],
+    })
+    _conferir(df)
+    # Arquivo com linhas vazias: OCORRENCIA vira float no hash
+    _conferir(df.assign(OCORRENCIA=[0.0, np.nan, 1.0, 0.0]))
+
+def test_converter_valores_igual_ao_escalar():
+    serie = pd.Series(["1.234,56", "-1.234,56", "R$ 99,90", "1e3", "abc", "", None, np.nan, 7, 3.25, " - 10,00 "])
+    esperado = serie.map(converter_valor).tolist()
+    assert converter_valores(serie).tolist() == esperado
+
+# --- CACHE DE UPLOADS (mesmo esquema lido do arquivo ou do cache) ---
+def _csv(df):
+    return df.to_csv(index=False, sep=";").encode()
+
+def _ler_duas_vezes(monkeypatch, tmp_path, funcao, nome, conteudo):
+    tmp_path.mkdir(exist_ok=True)
+    monkeypatch.chdir(tmp_path)  # .cache_uploads vazio, dentro do tmp
+    lido = funcao(nome, conteudo)
+    do_cache = funcao(nome, conteudo)
+    assert len(list((tmp_path / ".cache_uploads").glob("*.parquet"))) == 1
+    return lido, do_cache
+
+def _mesmo_esquema(lido, do_cache):
+    pd.testing.assert_frame_equal(lido, do_cache, check_dtype=False)
+    for c in lido.columns: assert lido[c].dtype.kind == do_cache[c].dtype.kind, c
+    for c in lido.select_dtypes("category").columns: assert do_cache[c].dtype == lido[c].dtype, c
+
+def test_cache_extrato_banco_vazio_e_numerico(monkeypatch, tmp_path):
+    for banco in ([None, None], [1, 237]):
+        conteudo = _csv(pd.DataFrame({"Data": ["01/02/2024", "02/02/2024"], "Histórico": ["A", "B"],
+                                      "Valor": ["1,00", "-2,00"], "Banco": banco}))
+        lido, do_cache = _ler_duas_vezes(monkeypatch, tmp_path / str(banco[0]), processar_arquivo_extrato, "e.csv", conteudo)
+        _mesmo_esquema(lido, do_cache)
+        do_cache["BANCO"].cat.categories  # o app usa o acessor .cat (bitmaps da busca)
+
+def test_cache_benner_sem_tipo_documento(monkeypatch, tmp_path):
+    conteudo = _csv(pd.DataFrame({"Número": [1, 2], "Nome": ["X", "Y"], "Valor Total": ["10,00", "20,00"], "Data Baixa": ["01/02/2024", ""]}))
+    lido, do_cache = _ler_duas_vezes(monkeypatch, tmp_path, processar_arquivo_benner, "benner.csv", conteudo)
+    _mesmo_esquema(lido, do_cache)
+
+# --- HASH DE CONTEÚDO DO BENNER ---
+def test_hash_conteudo_ausente_independe_do_tipo():
+    df = prepare_benner_upload(pd.DataFrame({"Número": ["1", "2"], "Nome": ["X", None], "Valor Total": ["10,00", "20,00"]}))
+    esperado = hashes_conteudo_benner(df).tolist()
+    for c in ["Nome", "CNPJ/CPF", "Tipo do Documento", "Data Baixa"]:
+        for vazio in (None, np.nan, pd.NaT):
+            outro = df.assign(**{c: df[c].astype(object).where(df[c].notna(), vazio)})
+            assert hashes_conteudo_benner(outro).tolist() == esperado, (c, vazio)
+
+# --- LEITURA DE EXCEL (mesmo resultado do pd.read_excel) ---
+CABECALHO = ["Data", "Histórico", "Valor", "Inteiro", "Misto", "Vazia", "Histórico", "Hora"]
+LINHAS = [
+    [dt.datetime(2024, 2, 1), "PIX JOSÉ", -10.5, 1, "A", None, "x", dt.time(8, 30)],
+    [dt.datetime(2024, 2, 1, 14, 5), "TED & CIA <1>", 2.0, 2, 3, None, None, None],
+    [None, None, None, None, None, None, None, None],  # linha vazia no meio: fica
+    [dt.datetime(2024, 2, 3), "#REF!", 1e6, 3, True, None, "y", None],
+    [dt.datetime(2024, 2, 4), "", -0.01, 4, None, None, "z", None],
+]
+
+def _xlsx(abas):
+    # abas: [(nome, linhas)]; o openpyxl grava os textos em linha (inlineStr)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for nome, linhas in abas:
+        ws = wb.create_sheet(nome)
+        for linha in linhas: ws.append(linha)
+    b = io.BytesIO()
+    wb.save(b)
+    return b.getvalue()
+
+def _textos_compartilhados(conteudo):
+    # Passa os textos para a tabela sharedStrings, como o Excel grava
+    zin = zipfile.ZipFile(io.BytesIO(conteudo))
+    textos = {}
+    def trocar(m):
+        i = textos.setdefault(m[3], len(textos))
+        return f'<c r="{m[1]}"{m[2]} t="s"><v>{i}</v></c>'
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w") as zout:
+        for nome in zin.namelist():
+            d = zin.read(nome)
+            if nome.startswith("xl/worksheets/"):
+                d = re.sub(r'<c r="([A-Z]+\d+)"([^>]*) t="inlineStr"><is><t>(.*?)</t></is></c>', trocar, d.decode()).encode()
+            elif nome == "[Content_Types].xml":
+                d = d.replace(b"</Types>", b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+                              b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+            elif nome == "xl/_rels/workbook.xml.rels":
+                d = d.replace(b"</Relationships>", b'<Relationship Id="rIdSS" Target="sharedStrings.xml" Type="http://'
+                              b'schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/></Relationships>')
+            zout.writestr(nome, d)
+        zout.writestr("xl/sharedStrings.xml", '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                      + "".join(f"<si><t>{t}</t></si>" for t in textos) + "</sst>")
+    return saida.getvalue()
+
+def _inteiros_como_float(conteudo):
+    # Números inteiros gravados como "3.0" (outros geradores de planilha fazem assim)
+    zin = zipfile.ZipFile(io.BytesIO(conteudo))
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w") as zout:
+        for nome in zin.namelist():
+            d = zin.read(nome)
+            if nome.startswith("xl/worksheets/"): d = re.sub(rb'(t="n"><v>-?\d+)(</v>)', rb"\1.0\2", d)
+            zout.writestr(nome, d)
+    return saida.getvalue()
+
+def _ler(conteudo, pontuar=pontuar_cabecalho_extrato, **kw):
+    return pd.concat(ler_excel_em_blocos(io.BytesIO(conteudo), pontuar, **kw), ignore_index=True)
+
+def test_excel_igual_ao_read_excel():
+    conteudo = _xlsx([("Extrato", [CABECALHO] + LINHAS + [[None] * 8, [None] * 8])])  # vazias no fim: saem
+    esperado = pd.read_excel(io.BytesIO(conteudo))
+    assert b"inlineStr" in zipfile.ZipFile(io.BytesIO(conteudo)).read("xl/worksheets/sheet1.xml")
+    pd.testing.assert_frame_equal(_ler(conteudo), esperado)
+    assert esperado.columns[6] == "Histórico.1" and esperado["Histórico"].isna().sum() == 3  # vazia, "" e #REF!
+
+def test_excel_textos_compartilhados():
+    conteudo = _textos_compartilhados(_xlsx([("Extrato", [CABECALHO] + LINHAS)]))
+    assert b"<is>" not in zipfile.ZipFile(io.BytesIO(conteudo)).read("xl/worksheets/sheet1.xml")
+    pd.testing.assert_frame_equal(_ler(conteudo), pd.read_excel(io.BytesIO(conteudo)))
+
+def test_excel_inteiros_gravados_como_float():
+    linhas = [[dt.datetime(2024, 3, 1), "PIX", -1.5, 7], [dt.datetime(2024, 3, 2), "TED", 2, 8]]
+    conteudo = _inteiros_como_float(_xlsx([("Extrato", [CABECALHO[:4]] + linhas)]))
+    assert b"<v>7.0</v>" in zipfile.ZipFile(io.BytesIO(conteudo)).read("xl/worksheets/sheet1.xml")
+    lido = _ler(conteudo)
+    pd.testing.assert_frame_equal(lido, pd.read_excel(io.BytesIO(conteudo)))
+    assert lido["Inteiro"].dtype == np.int64
+
+def test_excel_em_varios_blocos():
+    linhas = [[dt.datetime(2024, 3, 1 + i % 28), f"PIX {i}", i * 1.5, i] for i in range(23)]
+    conteudo = _xlsx([("Extrato", [CABECALHO[:4]] + linhas)])
+    blocos = list(ler_excel_em_blocos(io.BytesIO(conteudo), pontuar_cabecalho_extrato, linhas_por_bloco=5))
+    assert [len(b) for b in blocos] == [5, 5, 5, 5, 3]
+    pd.testing.assert_frame_equal(pd.concat(blocos, ignore_index=True), pd.read_excel(io.BytesIO(conteudo)))
+
+def test_excel_titulo_e_outra_aba():
+    # Aba de resumo antes do extrato e logo/título/período acima do cabeçalho
+    topo = [["BANCO EXEMPLO S.A."], [], ["Extrato de conta corrente", None, "Período: 02/2024"]]
+    conteudo = _xlsx([("Resumo", [["Saldo anterior", 10], ["Saldo atual", 20]]), ("Extrato", topo + [CABECALHO] + LINHAS)])
+    esperado = pd.read_excel(io.BytesIO(conteudo), sheet_name="Extrato", skiprows=len(topo))
+    pd.testing.assert_frame_equal(_ler(conteudo), esperado)
+
+    limpo = io.BytesIO(_xlsx([("Extrato", [CABECALHO] + LINHAS)]))
+    sujo = io.BytesIO(conteudo)
+    limpo.name = sujo.name = "extrato.xlsx"
+    pd.testing.assert_frame_equal(process_extrato(sujo), process_extrato(limpo))
+
+def test_excel_benner_com_titulo():
+    cab = ["Número", "Favorecido", "Vencimento", "Baixa", "Valor Liquido"]
+    docs = [[101, "FORNECEDOR A", dt.datetime(2024, 2, 1), None, 1234.56], [102, "FORNECEDOR B", dt.datetime(2024, 2, 2), dt.datetime(2024, 2, 5), 10]]
+    limpo = _ler(_xlsx([("Docs", [cab] + docs)]), pontuar_cabecalho_benner)
+    pd.testing.assert_frame_equal(_ler(_xlsx([("Docs", [["Relatório de títulos"], [], cab] + docs)]), pontuar_cabecalho_benner), limpo)
+
+def test_excel_sem_cabecalho_reconhecido_e_vazio():
+    conteudo = _xlsx([("Plan1", [["a", "b"], [1, 2]]), ("Plan2", [["Data", "Valor"], [dt.datetime(2024, 1, 1), 1]])])
+    # Nenhuma linha pontua: primeira aba, primeira linha (como o pd.read_excel)
+    pd.testing.assert_frame_equal(_ler(conteudo, lambda celulas: 0), pd.read_excel(io.BytesIO(conteudo)))
+    assert _ler(_xlsx([("Vazia", [])])).empty
@@ -0,0 +1,43 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import persistencia
+from ingestao import processar_arquivo_benner, classificar_benner
+
+@pytest.fixture
+def banco(monkeypatch, tmp_path):
+    # financeiro.db e .cache_uploads novos, dentro do tmp
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(persistencia, "_db_pronto", False)
+    persistencia.inicializar_db()
+    return tmp_path
+
+def _benner_csv():
+    return pd.DataFrame({
+        "Número": [101, 102, 103], "Nome": ["FORNECEDOR A", "FORNECEDOR B", None],
+        "Data de Vencimento": ["01/02/2024", "", "03/02/2024"], "Data Baixa": ["05/02/2024", "", ""],
+        "Valor Total": ["1.234,56", "10,00", "-3,50"],
+    }).to_csv(index=False, sep=";").encode()
+
+def _gravar(df):
+    persistencia.gravar_db_benner(df, alterados=df)
+
+def test_reenvio_do_mesmo_benner_fica_sem_alteracao(banco):
+    # Sem "Tipo do Documento" e com campos vazios: o segundo envio vem do cache e o hash vem do banco
+    conteudo = _benner_csv()
+    _gravar(processar_arquivo_benner("benner.csv", conteudo))
+    novos, alterados, iguais = classificar_benner(processar_arquivo_benner("benner.csv", conteudo), persistencia.hashes_benner())
+    assert (len(novos), len(alterados), iguais) == (0, 0, 3)
+
+def test_hashes_de_outra_versao_sao_recalculados(banco):
+    conteudo = _benner_csv()
+    _gravar(processar_arquivo_benner("benner.csv", conteudo))
+    with sqlite3.connect(persistencia.DB_SQLITE) as con:
+        con.execute("UPDATE benner SET HASH_CONTEUDO = 'antigo'")
+        con.execute("DELETE FROM meta WHERE chave = 'versao_hash_benner'")
+    persistencia._db_pronto = False
+    persistencia.inicializar_db()
+    _, alterados, iguais = classificar_benner(processar_arquivo_benner("benner.csv", conteudo), persistencia.hashes_benner())
+    assert (len(alterados), iguais) == (0, 3)